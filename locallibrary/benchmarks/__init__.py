@@ -0,0 +1,44 @@
+"""
+Benchmarks for the catalog app.
+
+Run them from the project folder (the one holding manage.py), e.g.
+
+    python -m benchmarks.holds
+
+Every benchmark runs against a throw away test database created from the configured settings, so the
+real library data is never touched. Use the same database engine as production (PostgreSQL) for
+numbers that mean anything.
+"""
+
+import contextlib
+import os
+import time
+
+
+@contextlib.contextmanager
+def test_database():
+    """Sets Django up and yields while a fresh, migrated test database is in use"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.development_settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextlib.contextmanager
+def timer(label, rows=None):
+    """Prints how long the block took, and the throughput when the number of rows is known"""
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    if rows:
+        print('{0:<50} {1:>10.3f}s {2:>12,.0f} rows/s'.format(label, elapsed, rows / elapsed))
+    else:
+        print('{0:<50} {1:>10.3f}s'.format(label, elapsed))
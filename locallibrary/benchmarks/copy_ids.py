@@ -0,0 +1,56 @@
+"""
+BookInstance primary keys: insert throughput and primary key index size with random (uuid4) against
+time ordered (uuid7) ids.
+
+    python -m benchmarks.copy_ids [number of copies]
+
+The index size is only reported on PostgreSQL.
+"""
+
+import sys
+import uuid
+
+from benchmarks import test_database, timer
+
+COPIES = 2000000
+BATCH_SIZE = 5000
+
+
+def primary_key_index_size(connection):
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_relation_size(indexrelid) FROM pg_index "
+                       "WHERE indrelid = 'catalog_bookinstance'::regclass AND indisprimary")
+        return cursor.fetchone()[0]
+
+
+def empty_copy_table(connection):
+    # TRUNCATE rather than DELETE, so that the second run starts with a fresh index as well
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('TRUNCATE catalog_bookinstance CASCADE')
+        else:
+            cursor.execute('DELETE FROM catalog_bookinstance')
+
+
+def run(copies):
+    from django.db import connection
+    from catalog.models import Book, BookInstance
+    from catalog.utils import batched, uuid7
+
+    book = Book.objects.create(title='Benchmark')
+    for label, new_id in (('uuid4', uuid.uuid4), ('uuid7', uuid7)):
+        empty_copy_table(connection)
+        with timer('insert {0:,} copies with {1} ids'.format(copies, label), rows=copies):
+            rows = (BookInstance(id=new_id(), book=book, imprint='Benchmark') for _ in range(copies))
+            for batch in batched(rows, BATCH_SIZE):
+                BookInstance.objects.bulk_create(batch)
+        size = primary_key_index_size(connection)
+        if size is not None:
+            print('{0:<50} {1:>10.1f} MB'.format('primary key index size with {0} ids'.format(label), size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    with test_database():
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else COPIES)
@@ -0,0 +1,70 @@
+"""
+Fines: working out the fines of every member with overdue loans, row by row in Python against the
+vectorized engine in catalog.fines.
+
+    python -m benchmarks.fines [number of overdue loans]
+"""
+
+import datetime
+import random
+import sys
+from collections import defaultdict
+
+from benchmarks import test_database, timer
+
+LOANS = 1000000
+MEMBERS = 20000
+BATCH_SIZE = 5000
+
+
+def row_by_row_fines(today):
+    """What the job would look like without NumPy: one Python loop iteration per overdue loan"""
+    from catalog import fines
+    from catalog.models import BookInstance
+
+    tiers, cap = fines.fine_tiers(), fines.max_fine_per_loan()
+    totals = defaultdict(int)
+    # The same loans as catalog.fines.member_fines, which leaves out copies without a borrower
+    loans = BookInstance.objects.on_loan().filter(due_back__lt=today, borrower__isnull=False).values_list(
+        'borrower_id', 'due_back')
+    for borrower, due_back in loans.iterator(chunk_size=BATCH_SIZE):
+        days_overdue = (today - due_back).days
+        fine = 0
+        for index, (first_day, rate) in enumerate(tiers):
+            last_day = tiers[index + 1][0] - 1 if index + 1 < len(tiers) else days_overdue
+            fine += max(min(days_overdue, last_day) - first_day + 1, 0) * rate
+        totals[borrower] += min(fine, cap) if cap is not None else fine
+    return totals
+
+
+def run(loans):
+    from django.contrib.auth.models import User
+    from catalog import fines
+    from catalog.models import Book, BookInstance
+    from catalog.utils import batched
+
+    today = datetime.date.today()
+    User.objects.bulk_create(
+        [User(username='member{0}'.format(number)) for number in range(MEMBERS)], batch_size=BATCH_SIZE)
+    # Read back: bulk_create() doesn't set the ids on SQLite
+    members = list(User.objects.values_list('pk', flat=True))
+    book = Book.objects.create(title='Benchmark')
+    with timer('insert {0:,} overdue loans'.format(loans), rows=loans):
+        rows = (BookInstance(book=book, imprint='Benchmark', status='o', borrower_id=random.choice(members),
+                             due_back=today - datetime.timedelta(days=random.randint(1, 90)))
+                for _ in range(loans))
+        for batch in batched(rows, BATCH_SIZE):
+            BookInstance.objects.bulk_create(batch)
+
+    with timer('fines row by row in Python', rows=loans):
+        expected = row_by_row_fines(today)
+    with timer('fines with NumPy (catalog.fines.member_fines)', rows=loans):
+        member_ids, cents, _ = fines.member_fines(today)
+    assert dict(zip(member_ids.tolist(), cents.tolist())) == expected
+    with timer('compute and save fines (catalog.fines.apply_fines)', rows=loans):
+        fines.apply_fines(today)
+
+
+if __name__ == '__main__':
+    with test_database():
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else LOANS)
@@ -0,0 +1,56 @@
+"""
+Hold queue benchmark: next-in-line lookup, queue position and hand over of a returned copy on books
+with thousands of holds.
+
+    python -m benchmarks.holds [number of holds per book]
+"""
+
+import sys
+
+from benchmarks import test_database, timer
+
+HOLDS_PER_BOOK = 5000
+BOOKS = 20
+LOOKUPS = 1000
+
+
+def run(holds_per_book):
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from catalog.models import Book, BookInstance, Hold
+
+    User.objects.bulk_create(User(username='member{0}'.format(i)) for i in range(holds_per_book))
+    Book.objects.bulk_create(Book(title='Book {0}'.format(i)) for i in range(BOOKS))
+    users = list(User.objects.order_by('id'))
+    books = list(Book.objects.order_by('id'))
+
+    with timer('create {0:,} holds'.format(holds_per_book * BOOKS), rows=holds_per_book * BOOKS):
+        for book in books:
+            Hold.objects.bulk_create((Hold(book=book, user=user, seq=seq) for seq, user in enumerate(users, 1)),
+                                   batch_size=1000)
+
+    book = books[BOOKS // 2]
+    with timer('{0:,} next in line lookups'.format(LOOKUPS), rows=LOOKUPS):
+        for _ in range(LOOKUPS):
+            Hold.objects.next_in_line(book)
+
+    front = list(Hold.objects.queue(book)[:10])
+    back = list(Hold.objects.queue(book).reverse()[:10])
+    with timer('{0:,} positions, front of the queue'.format(LOOKUPS), rows=LOOKUPS):
+        for i in range(LOOKUPS):
+            Hold.objects.position(front[i % len(front)])
+    with timer('{0:,} positions, back of the queue'.format(LOOKUPS), rows=LOOKUPS):
+        for i in range(LOOKUPS):
+            Hold.objects.position(back[i % len(back)])
+
+    copies = BookInstance.objects.bulk_create(
+        BookInstance(book=book, imprint='Benchmark', status='o') for _ in range(LOOKUPS))
+    with timer('{0:,} returns handed to the head of the queue'.format(LOOKUPS), rows=LOOKUPS):
+        for copy in copies:
+            with transaction.atomic():
+                Hold.objects.fulfil_next(copy)
+
+
+if __name__ == '__main__':
+    with test_database():
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else HOLDS_PER_BOOK)
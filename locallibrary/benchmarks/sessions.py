@@ -0,0 +1,63 @@
+"""
+Expired session cleanup: Django's clearsessions (a single DELETE) against the batched
+clear_expired_sessions command, on a django_session table where half of the sessions expired.
+
+    python -m benchmarks.sessions [number of sessions]
+
+Besides the total time, the command reports its longest single DELETE, which is how long it holds its
+locks at most. Filling the table is only fast on PostgreSQL.
+"""
+
+import sys
+from io import StringIO
+
+from benchmarks import test_database, timer
+
+SESSIONS = 10000000
+BATCH_SIZE = 10000
+
+
+def fill_session_table(connection, sessions):
+    from django.contrib.sessions.models import Session
+    from django.utils import timezone
+    from django.utils.crypto import get_random_string
+    from catalog.utils import batched
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('TRUNCATE django_session')
+            # Random keys as Django makes them, every other session expired a day ago
+            cursor.execute(
+                "INSERT INTO django_session (session_key, session_data, expire_date) "
+                "SELECT md5(random()::text) || lpad(n::text, 8, '0'), 'e30:benchmark', "
+                "now() + CASE WHEN n %% 2 = 0 THEN interval '-1 day' ELSE interval '14 days' END "
+                "FROM generate_series(1, %s) AS n", [sessions])
+            cursor.execute('ANALYZE django_session')
+            return
+        cursor.execute('DELETE FROM django_session')
+    now = timezone.now()
+    rows = (Session(session_key=get_random_string(32), session_data='e30:benchmark',
+                    expire_date=now + timezone.timedelta(days=-1 if n % 2 == 0 else 14)) for n in range(sessions))
+    for batch in batched(rows, BATCH_SIZE):
+        Session.objects.bulk_create(batch)
+
+
+def run(sessions):
+    from django.core.management import call_command
+    from django.db import connection
+
+    with timer('fill django_session with {0:,} sessions'.format(sessions), rows=sessions):
+        fill_session_table(connection, sessions)
+    with timer('clearsessions (one DELETE)', rows=sessions // 2):
+        call_command('clearsessions')
+
+    fill_session_table(connection, sessions)
+    out = StringIO()
+    with timer('clear_expired_sessions (batches of {0:,})'.format(BATCH_SIZE), rows=sessions // 2):
+        call_command('clear_expired_sessions', batch_size=BATCH_SIZE, sleep=0, verbosity=0, stdout=out)
+    print(out.getvalue().strip())
+
+
+if __name__ == '__main__':
+    with test_database():
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else SESSIONS)
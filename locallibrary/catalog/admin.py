@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Author, Book, BookInstance, Genre, Language
+from .models import Author, Book, BookInstance, Genre, Language, Hold, OutgoingEmail
+from .forms import BookModelForm
 
 # Register your models here.
 
@@ -39,6 +40,8 @@ class BookAdmin(admin.ModelAdmin):
     list_display = ('title', 'author', 'display_genre', 'language')
 
     fields = [('title', 'author'), ('isbn', 'language'), 'summary', 'genre', 'book_cover']
+    # Checks the cover from the header CoverUploadHandler read, instead of verifying the whole image
+    form = BookModelForm
 
 
 @admin.register(BookInstance)
@@ -62,6 +65,20 @@ class BookInstanceAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_filter = ('fulfilled_at', )
+    list_display = ('book', 'user', 'created_at', 'fulfilled_at', 'book_instance')
+    readonly_fields = ('created_at', )
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_filter = ('sent_at', )
+    list_display = ('subject', 'to', 'created_at', 'attempts', 'send_after', 'sent_at')
+    readonly_fields = ('created_at', 'last_error')
+
+
 # Both models below only have one field, so no need to work on the display
 # except to register the model only as done below
 
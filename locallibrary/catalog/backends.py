@@ -0,0 +1,81 @@
+"""
+Authentication backends for the library.
+
+CachedPermissionBackend is Django's ModelBackend with the permission set of every user kept in the cache
+across requests, so that PermissionRequiredMixin, @permission_required and {{ perms }} in the templates
+don't rebuild it from the auth_permission joins on every request. The cache keys carry a global permissions
+version, which catalog.signals replaces whenever a user's or a group's permissions or groups change.
+
+CachedUserBackend goes one step further and also caches the User (with its groups) that the authentication
+middleware loads for every request of a logged in user. Together with the cached_db session engine, an
+authenticated page view on a warm cache then needs neither the session nor the user row.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+PERMISSIONS_VERSION_KEY = 'catalog:permissions-version'
+
+
+def permissions_version():
+    """Current version of every user's permissions, a new (random) version is started when there is none"""
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        # add() rather than set(), so that two processes starting a version at once agree on one of them
+        if not cache.add(PERMISSIONS_VERSION_KEY, version, None):
+            version = cache.get(PERMISSIONS_VERSION_KEY, version)
+    return version
+
+
+def invalidate_permissions():
+    """Makes every cached permission set stale. A random version (rather than a counter) can't ever come
+    back to a version still in the cache, even after the version key itself was evicted"""
+    cache.set(PERMISSIONS_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class CachedPermissionBackend(ModelBackend):
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        # ModelBackend keeps the set on the user for the rest of the request, it is only looked up once
+        if not hasattr(user_obj, '_perm_cache'):
+            # date_joined tells apart users given the same id once the first one is gone (e.g. between tests)
+            key = 'catalog:permissions:{0}:{1}:{2}:{3}'.format(
+                permissions_version(), user_obj.pk, user_obj.date_joined.isoformat(), int(user_obj.is_superuser))
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
+
+
+def user_cache_key(user_id):
+    # Keyed by the permissions version as well, which changes with every group membership change
+    return 'catalog:user:{0}:{1}'.format(permissions_version(), user_id)
+
+
+def invalidate_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+class CachedUserBackend(CachedPermissionBackend):
+    """CachedPermissionBackend which also caches the users it loads for the sessions. catalog.signals drops
+    a user from the cache whenever it is saved (which a password change does) or deleted."""
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            try:
+                user = get_user_model()._default_manager.prefetch_related('groups').get(pk=user_id)
+            except get_user_model().DoesNotExist:
+                return None
+            cache.set(key, user, getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+        # The session auth hash (a hash of the password) is still checked against this user by
+        # django.contrib.auth, so a stale copy with an old password would log the session out
+        return user if self.user_can_authenticate(user) else None
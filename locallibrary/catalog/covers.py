@@ -0,0 +1,187 @@
+"""
+Responsive variants of the book covers.
+
+Every Book.book_cover is resized to a few widths, each saved both as a JPEG and as a WebP file next to the
+original (e.g. "covers/3f/3f9a...jpg" gets "covers/3f/3f9a....320w.jpg" and ".320w.webp"), so that the
+browser can pick the smallest file that fits the page instead of downloading the full size upload.
+
+Resizing an image is far too slow for the request that uploads it, the variants are made by the
+make_cover_variants worker. Book.cover_variants_of holds the name of the cover the variants were made
+from: until it matches book_cover (a new book, or a cover that has just been replaced) the pages show a
+placeholder image.
+"""
+
+import os
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F
+from PIL import Image, ImageOps
+
+from .models import Book
+
+# Widths, in pixels, of the variants made for every cover
+COVER_WIDTHS = (160, 320, 640)
+
+# (extension, Pillow format, save() options) of the files made for every width. The WebP file is listed
+# in a <source> for the browsers that support it, the JPEG one is the fallback.
+VARIANT_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 6}),
+    ('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+)
+
+# Served instead of the cover while its variants are not ready, or when the book has no cover at all
+PLACEHOLDER_COVER = 'images/cover-placeholder.svg'
+
+
+def cover_widths():
+    return tuple(sorted(getattr(settings, 'COVER_WIDTHS', COVER_WIDTHS)))
+
+
+def variant_name(name, width, extension):
+    """Storage name of the <width> pixels wide <extension> variant of the cover saved as <name>"""
+    stem = os.path.splitext(name)[0]
+    return '{0}.{1}w.{2}'.format(stem, width, extension)
+
+
+def dominant_color(image):
+    """Most common color of <image> as #rrggbb, worked out on a thumbnail reduced to a handful of colors.
+    It needs the pixels, so it is only called off the request: on the variants being made, or by the
+    backfill_cover_metadata command"""
+    small = image.convert('RGB')
+    small.thumbnail((64, 64))
+    palette = small.quantize(colors=5)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    return '#{0:02x}{1:02x}{2:02x}'.format(red, green, blue)
+
+
+def cover_color(file):
+    """dominant_color() of the image <file>, decoded at a reduced size when the format allows it"""
+    file.seek(0)
+    with Image.open(file) as image:
+        # draft() lets the JPEG decoder skip most of the pixels of a big image
+        image.draft('RGB', (128, 128))
+        return dominant_color(image)
+
+
+def orientation(image):
+    # Read from the EXIF block found in the header, getexif() would decode a whole PNG looking for one
+    if 'exif' not in image.info:
+        return None
+    exif = Image.Exif()
+    exif.load(image.info['exif'])
+    return exif.get(0x0112)
+
+
+def cover_metadata(file):
+    """Values of the Book cover_width, cover_height and cover_bytes fields for the image <file> (an uploaded
+    file, or a file opened from the storage). Only the image header is read, no pixel is decoded: it runs
+    in the request saving the book"""
+    file.seek(0)
+    image = Image.open(file)
+    width, height = image.size
+    # The EXIF orientation swaps the sides of pictures stored sideways, the variants are turned upright
+    if orientation(image) in (5, 6, 7, 8):
+        width, height = height, width
+    file.seek(0)
+    return {'cover_width': width, 'cover_height': height, 'cover_bytes': file.size}
+
+
+def set_cover_metadata(book):
+    """Fills in the cover size fields of <book> from the header of its cover (without saving it), and clears
+    its color until the variants worker works it out. A cover that can't be read leaves them empty"""
+    metadata = {'cover_width': None, 'cover_height': None, 'cover_bytes': None}
+    try:
+        if book.book_cover and not book.book_cover._committed:
+            # A new upload, read before the storage saves it
+            metadata = cover_metadata(book.book_cover.file)
+        elif book.book_cover:
+            with book.book_cover.storage.open(book.book_cover.name, 'rb') as cover:
+                metadata = cover_metadata(cover)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        pass
+    metadata['cover_color'] = ''
+    for field, value in metadata.items():
+        setattr(book, field, value)
+
+
+def variants_ready(book):
+    return bool(book.book_cover) and book.cover_variants_of == book.book_cover.name
+
+
+def books_needing_variants():
+    """Books with a cover whose variants have not been made yet (or were made from a previous cover)"""
+    return Book.objects.exclude(book_cover='').exclude(cover_variants_of=F('book_cover'))
+
+
+def resize(image, width):
+    """Copy of <image> scaled down to <width> pixels wide, images narrower than that are kept as they are"""
+    if image.width <= width:
+        return image.copy()
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def make_variants(name):
+    """Saves every variant of the cover stored as <name> next to it, returns the names of the files written
+    and the dominant color of the cover (worked out on the smallest variant, the image is decoded anyway).
+    Doesn't touch the database (it runs in the worker processes of process_covers), see generate_variants()"""
+    storage = Book._meta.get_field('book_cover').storage
+    with storage.open(name, 'rb') as cover:
+        image = Image.open(cover)
+        # Phone pictures are often stored sideways with an EXIF orientation tag, which the variants would lose
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+    written = []
+    color = ''
+    for width in cover_widths():
+        resized = resize(image, width)
+        if not color:
+            color = dominant_color(resized)
+        for extension, image_format, options in VARIANT_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            # The variants are named after the cover, not after their own content. save_as() writes to a
+            # temporary file renamed into place, a variant is never seen half written
+            written.append(storage.save_as(variant_name(name, width, extension), ContentFile(buffer.getvalue())))
+    return written, color
+
+
+def timed_make_variants(name):
+    """make_variants() for a worker process: returns (name, seconds taken, color, error message or None)"""
+    start = time.perf_counter()
+    try:
+        _, color = make_variants(name)
+    except Exception as error:
+        return name, time.perf_counter() - start, '', '{0}: {1}'.format(type(error).__name__, error)
+    return name, time.perf_counter() - start, color, None
+
+
+def mark_variants_ready(name, book_ids=None, color=''):
+    """Records that the variants of the cover <name> have been made (and its dominant <color>), for every
+    book using it (or only the <book_ids> ones). Returns the number of books updated, a book that got another
+    cover in the meantime is left for the next pass"""
+    books = Book.objects.filter(book_cover=name).exclude(cover_variants_of=name)
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+    return books.update(cover_variants_of=name, cover_color=color)
+
+
+def variant_names(name):
+    """Names of every variant the cover saved as <name> may have"""
+    return [variant_name(name, width, extension) for width in cover_widths() for extension, _, _ in VARIANT_FORMATS]
+
+
+def generate_variants(book):
+    """Makes the variants of the cover of <book> and marks them ready. Returns False if the cover was
+    replaced while they were being made, in which case the book is left for the next pass"""
+    name = book.book_cover.name
+    _, color = make_variants(name)
+    ready = mark_variants_ready(name, [book.pk], color) > 0
+    if ready:
+        book.cover_variants_of = name
+        book.cover_color = color
+    return ready
@@ -0,0 +1,96 @@
+"""
+Fines on overdue loans.
+
+Fines are worked out for every overdue copy at once rather than one BookInstance at a time: the loans are
+read in chunks of plain columns (borrower id and due_back as a day number), turned into NumPy arrays, and
+the fine of every loan in a chunk is computed with a handful of array operations. The fines are then summed
+up per member with bincount() and written to the members' LoanCounter rows with bulk_update().
+
+Amounts are worked out in whole cents (integers) and only turned into Decimals when they are saved.
+"""
+
+import datetime
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .models import BookInstance, LoanCounter
+from .utils import batched
+
+# Daily fine in cents, by how long a copy is overdue: (first day of the tier, cents per day). The
+# default is 10 cents a day for the first week, 25 cents a day up to four weeks, then 50 cents a day.
+FINE_TIERS = ((1, 10), (8, 25), (29, 50))
+
+# Most a single overdue copy can be fined, in cents
+MAX_FINE_PER_LOAN = 2000
+
+
+def fine_tiers():
+    return tuple(getattr(settings, 'FINE_TIERS', FINE_TIERS))
+
+
+def max_fine_per_loan():
+    return getattr(settings, 'MAX_FINE_PER_LOAN', MAX_FINE_PER_LOAN)
+
+
+def loan_fines(days_overdue, tiers=None, cap=None):
+    """Fine in cents of every loan in the <days_overdue> array (one fine per element)"""
+    tiers = fine_tiers() if tiers is None else tiers
+    cap = max_fine_per_loan() if cap is None else cap
+    days_overdue = np.asarray(days_overdue, dtype=np.int64)
+    fines = np.zeros(days_overdue.shape, dtype=np.int64)
+    for index, (first_day, rate) in enumerate(tiers):
+        # Number of overdue days that fall into this tier, from 0 up to the length of the tier
+        days = days_overdue - (first_day - 1)
+        if index + 1 < len(tiers):
+            days = np.minimum(days, tiers[index + 1][0] - first_day)
+        fines += np.clip(days, 0, None) * rate
+    if cap is not None:
+        np.minimum(fines, cap, out=fines)
+    return fines
+
+
+def overdue_loan_chunks(today, chunk_size):
+    """Yields (borrower ids, due_back day numbers) arrays of at most <chunk_size> overdue loans"""
+    loans = BookInstance.objects.on_loan().filter(borrower__isnull=False, due_back__lt=today).values_list(
+        'borrower_id', 'due_back').order_by()
+    for chunk in batched(loans.iterator(chunk_size=chunk_size), chunk_size):
+        borrowers = np.fromiter((borrower for borrower, _ in chunk), dtype=np.int64, count=len(chunk))
+        due_back = np.fromiter((due.toordinal() for _, due in chunk), dtype=np.int64, count=len(chunk))
+        yield borrowers, due_back
+
+
+def member_fines(today=None, chunk_size=50000):
+    """Returns (member ids, fines in cents, number of overdue loans) arrays of every member with an overdue loan"""
+    today = today or datetime.date.today()
+    tiers, cap = fine_tiers(), max_fine_per_loan()
+    totals = np.zeros(0, dtype=np.int64)
+    loans = 0
+    for borrowers, due_back in overdue_loan_chunks(today, chunk_size):
+        fines = loan_fines(today.toordinal() - due_back, tiers, cap)
+        # Member ids index the totals directly, so summing a chunk up per member is a single bincount
+        chunk_totals = np.bincount(borrowers, weights=fines, minlength=len(totals))
+        if len(chunk_totals) > len(totals):
+            totals = np.concatenate([totals, np.zeros(len(chunk_totals) - len(totals), dtype=np.int64)])
+        # The weights are summed as floats, exact for any realistic amount of cents
+        totals += np.rint(chunk_totals).astype(np.int64)
+        loans += len(borrowers)
+    members = np.flatnonzero(totals)
+    return members, totals[members], loans
+
+
+def apply_fines(today=None, chunk_size=50000, batch_size=1000):
+    """Works out the fines of every member and saves them on their LoanCounter, members without an
+    overdue loan any more are cleared. Returns (number of members fined, total in cents, number of loans)"""
+    members, fines, loans = member_fines(today, chunk_size)
+    with transaction.atomic():
+        LoanCounter.objects.filter(fines__gt=0).update(fines=0)
+        for batch in batched(zip(members.tolist(), fines.tolist()), batch_size):
+            counters = [LoanCounter(user_id=member, fines=Decimal(cents).scaleb(-2)) for member, cents in batch]
+            # Members who have never borrowed through the circulation views have no counter yet
+            LoanCounter.objects.bulk_create(
+                [LoanCounter(user_id=counter.user_id) for counter in counters], ignore_conflicts=True)
+            LoanCounter.objects.bulk_update(counters, ['fines'])
+    return len(members), int(fines.sum()), loans
@@ -1,9 +1,12 @@
 from django.forms import ModelForm
 from django import forms
 import datetime
+import uuid
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy
-from .models import BookInstance
+from PIL import Image
+from .models import Book, BookInstance
+from .uploads import CoverUploadError, check_header
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
@@ -46,6 +49,19 @@ class LibrarianRenewBookForm(forms.Form):
 # then be used within your views in exactly the same way as an ordinary Form.
 
 
+def validate_renewal_date(data):
+    """Renewal rules shared by the single copy and the bulk renewal forms"""
+    # Check if a date is in the past.
+    if data < datetime.date.today():
+        raise ValidationError(ugettext_lazy('Invalid date - renewal in past'))
+
+    # Check if a date is in the allowed range (+2 weeks from today).
+    if data > datetime.date.today() + BookInstance.RENEWAL_PERIOD:
+        raise ValidationError(ugettext_lazy('Invalid date - renewal more than 2 weeks ahead'))
+
+    return data
+
+
 class LibrarianRenewBookModelForm(ModelForm):
     """This forms provide the form interface for the librarian to extend return date on book borrow"""
 
@@ -54,16 +70,8 @@ class LibrarianRenewBookModelForm(ModelForm):
     def clean_due_back(self):
         data = self.cleaned_data['due_back']
 
-        # Check if a date is in the past.
-        if data < datetime.date.today():
-            raise ValidationError(ugettext_lazy('Invalid date - renewal in past'))
-
-        # Check if a date is in the allowed range (+2 weeks from today).
-        if data > datetime.date.today() + datetime.timedelta(weeks=2):
-            raise ValidationError(ugettext_lazy('Invalid date - renewal more than 2 weeks ahead'))
-
         # Remember to always return the cleaned data.
-        return data
+        return validate_renewal_date(data)
 
     class Meta:
         model = BookInstance
@@ -81,6 +89,50 @@ class LibrarianRenewBookModelForm(ModelForm):
         help_texts = {'due_back': ugettext_lazy('Enter a date between now and 2 weeks (default 1).')}
 
 
+class LibrarianBulkRenewBookForm(forms.Form):
+    """This form interface allows the librarian to renew every loan matching a selection in one go
+    (e.g. all overdue copies at the end of term)"""
+    SELECTION_CHOICES = (
+        ('overdue', 'Overdue loans'),
+        ('due_within', 'Loans due within the number of days below'),
+    )
+
+    selection = forms.ChoiceField(choices=SELECTION_CHOICES, initial='overdue')
+    days = forms.IntegerField(min_value=0, initial=7, required=False,
+                              help_text='Only used for loans due within a number of days')
+    borrower = forms.ModelChoiceField(queryset=User.objects.filter(bookinstance__status__exact='o').distinct(),
+                                      required=False, help_text='Leave empty to renew for every member')
+    book = forms.ModelChoiceField(queryset=Book.objects.all(), required=False,
+                                  help_text='Leave empty to renew every book')
+    due_back = forms.DateField(label=ugettext_lazy('Renewal date'),
+                               help_text=ugettext_lazy('Enter a date between now and 2 weeks (default 1).'))
+
+    def clean_due_back(self):
+        return validate_renewal_date(self.cleaned_data['due_back'])
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('selection') == 'due_within' and cleaned_data.get('days') is None:
+            self.add_error('days', ugettext_lazy('Enter the number of days'))
+        return cleaned_data
+
+    def get_queryset(self):
+        """Returns the loans selected by the cleaned form data"""
+        if self.cleaned_data['selection'] == 'overdue':
+            queryset = BookInstance.objects.overdue()
+        else:
+            queryset = BookInstance.objects.due_within(self.cleaned_data['days'])
+        return self.narrow_queryset(queryset)
+
+    def narrow_queryset(self, queryset):
+        """Restricts a BookInstance queryset to the member and/or book picked on the form"""
+        if self.cleaned_data['borrower'] is not None:
+            queryset = queryset.for_borrower(self.cleaned_data['borrower'])
+        if self.cleaned_data['book'] is not None:
+            queryset = queryset.for_book(self.cleaned_data['book'])
+        return queryset
+
+
 class UserBorrowBookModelForm(ModelForm):
     """This form interface allows the user to make a book copy borrow request"""
 
@@ -129,6 +181,51 @@ class LibrarianCreateBookCopyModelForm(ModelForm):
         return data
 
 
+class LibrarianBulkCreateBookCopyForm(forms.Form):
+    """This form interface allows the librarian to add a whole shipment of copies of one book to the
+    library catalogue, either a number of copies or one copy per pre-printed barcode (copy ID)"""
+    MAX_COPIES = 1000
+
+    book = forms.ModelChoiceField(queryset=Book.objects.all())
+    imprint = forms.CharField(max_length=200)
+    quantity = forms.IntegerField(min_value=1, max_value=MAX_COPIES, required=False,
+                                  help_text='Number of copies to add, leave empty when entering barcodes')
+    barcodes = forms.CharField(widget=forms.Textarea, required=False,
+                               help_text='Pre-printed copy IDs, one per line')
+
+    def clean_barcodes(self):
+        lines = [line.strip() for line in self.cleaned_data['barcodes'].splitlines() if line.strip()]
+        barcodes = []
+        for line in lines:
+            try:
+                barcodes.append(uuid.UUID(line))
+            except ValueError:
+                raise ValidationError(ugettext_lazy('Invalid barcode - %(barcode)s'), params={'barcode': line})
+        if len(barcodes) > self.MAX_COPIES:
+            raise ValidationError(ugettext_lazy('Too many barcodes - %(max)s at most'), params={'max': self.MAX_COPIES})
+        if len(set(barcodes)) != len(barcodes):
+            raise ValidationError(ugettext_lazy('Duplicate barcodes'))
+        taken = BookInstance.objects.filter(pk__in=barcodes).values_list('pk', flat=True)[:1]
+        if taken:
+            raise ValidationError(ugettext_lazy('Barcode already in use - %(barcode)s'), params={'barcode': taken[0]})
+        return barcodes
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('quantity') and not cleaned_data.get('barcodes') and not self.errors:
+            raise ValidationError(ugettext_lazy('Enter a quantity or a list of barcodes'))
+        return cleaned_data
+
+    def get_copies(self):
+        """Unsaved BookInstance objects for the copies described by the cleaned form data"""
+        book = self.cleaned_data['book']
+        imprint = self.cleaned_data['imprint']
+        if self.cleaned_data['barcodes']:
+            return [BookInstance(id=barcode, book=book, imprint=imprint, status='a')
+                    for barcode in self.cleaned_data['barcodes']]
+        return [BookInstance(book=book, imprint=imprint, status='a') for _ in range(self.cleaned_data['quantity'])]
+
+
 class LibrarianUpdateBookCopyModelForm(ModelForm):
     """This form interface allows the librarian to update a book copy status as available or maintenance only"""
 
@@ -138,7 +235,7 @@ class LibrarianUpdateBookCopyModelForm(ModelForm):
 
     def clean_status(self):
         data = self.cleaned_data['status']
-        if data == 'o':
+        if data in ('o', 'p'):
             raise ValidationError(ugettext_lazy('You must update as "Available" or "Maintenance" or "Reserved" only!'))
         return data
 
@@ -184,6 +281,38 @@ class LibrarianMarkBookCopyAsReturnedModelForm(ModelForm):
         return data
 
 
+class CoverImageField(forms.ImageField):
+    """ImageField of the book covers. The uploads were streamed to disk and checked from their header by
+    CoverUploadHandler (catalog/uploads.py) as they arrived, so the whole image isn't opened and verified
+    again here, the handler's verdict is reported instead."""
+
+    def to_python(self, data):
+        upload_error = getattr(data, 'upload_error', None)
+        if upload_error:
+            raise ValidationError(upload_error, code='invalid_image')
+        if data and getattr(data, 'image_format', None) is None:
+            # A file that didn't come through the handler (e.g. built in code) gets the same header checks
+            try:
+                data.image_format, data.image_size = check_header(data)
+            except CoverUploadError as error:
+                raise ValidationError(str(error), code='invalid_image')
+            except Exception as error:
+                raise ValidationError(self.error_messages['invalid_image'], code='invalid_image') from error
+        f = forms.FileField.to_python(self, data)
+        if f is not None:
+            f.content_type = Image.MIME.get(data.image_format)
+        return f
+
+
+class BookModelForm(ModelForm):
+    """Form used by the librarians (and the admin) to add and edit books"""
+
+    class Meta:
+        model = Book
+        fields = '__all__'
+        field_classes = {'book_cover': CoverImageField}
+
+
 class SignupForm(UserCreationForm):
     """This form interface handles the signup page for the library"""
     email = forms.EmailField(max_length=150,
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from catalog.models import library_members_group_id
+from catalog.utils import batched
+
+
+class Command(BaseCommand):
+    help = ('Adds every active user who is not in the Library Members group yet to it. Safe to re-run: '
+            'users already in the group are skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Memberships inserted per statement')
+
+    def handle(self, *args, **options):
+        group_id = library_members_group_id()
+        Membership = User.groups.through
+        missing = User.objects.filter(is_active=True).exclude(groups=group_id).values_list('pk', flat=True)
+
+        members = Membership.objects.filter(group_id=group_id)
+        before = members.count()
+        for batch in batched(missing.order_by('pk').iterator(), options['batch_size']):
+            # ignore_conflicts makes a user who joined meanwhile (by confirming their email) harmless
+            Membership.objects.bulk_create([Membership(user_id=pk, group_id=group_id) for pk in batch],
+                                           ignore_conflicts=True)
+        # Counted on the group rather than the batches, which also hold the users ignore_conflicts skipped
+        self.stdout.write('Added {0} users to the Library Members group'.format(members.count() - before))
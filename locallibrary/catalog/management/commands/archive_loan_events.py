@@ -0,0 +1,102 @@
+import datetime
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog import partitions
+from catalog.models import LoanEvent
+
+
+class Command(BaseCommand):
+    help = ('Creates the upcoming monthly partitions of the loan event log, then archives the months older than '
+            'the retention period to gzipped JSON lines files and drops them. Run it once a month (e.g. from cron). '
+            'It is safe to re-run after a failure: a month\'s rows are only removed once an archive file holding '
+            'them is complete, and an archive file is never overwritten (a re-run writes the rows left to the '
+            'next part file of the month).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=24,
+                            help='Number of months (including the current one) kept in the database')
+        parser.add_argument('--create-ahead', type=int, default=3,
+                            help='Number of monthly partitions created ahead, starting with the current month')
+        parser.add_argument('--archive-dir', default=os.path.join(settings.BASE_DIR, 'archive', 'loan_events'),
+                            help='Folder the monthly archive files are written to')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Drop the expired months without writing archive files')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows deleted per statement when a month is not a partition of its own')
+
+    def handle(self, *args, **options):
+        today = datetime.date.today()
+        for name in partitions.create_month_partitions(connection, today, options['create_ahead']):
+            self.stdout.write('Created partition {0}'.format(name))
+
+        cutoff = partitions.month_start(today)
+        for _ in range(max(options['keep_months'] - 1, 0)):
+            cutoff = partitions.month_start(cutoff - datetime.timedelta(days=1))
+
+        oldest = LoanEvent.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if oldest is None or oldest.date() >= cutoff:
+            self.stdout.write('No loan events older than {0}'.format(cutoff))
+            return
+
+        month = partitions.month_start(oldest.astimezone(datetime.timezone.utc).date())
+        while month < cutoff:
+            events = LoanEvent.objects.between(*partitions.month_bounds(month))
+            if options['no_archive']:
+                archived = 0
+                dropped = partitions.drop_month_partition(connection, month)
+            else:
+                archived, last_id = self.archive(events, month, options['archive_dir'])
+                # Only the rows written to the archive are removed: the partition is only dropped if it holds
+                # nothing else, otherwise the archived rows are deleted and the ones added since are left for
+                # the next run
+                dropped = partitions.drop_month_partition(connection, month, expected_rows=archived)
+                events = events.filter(id__lte=last_id or 0)
+            # Rows of a month without its own partition (SQLite, or the default partition on PostgreSQL), or whose
+            # partition was kept
+            deleted = self.delete_in_batches(events, options['batch_size'])
+            self.stdout.write('{0:%Y-%m}: archived {1} events, {2}'.format(
+                month, archived, 'dropped partition' if dropped else 'deleted {0} rows'.format(deleted)))
+            month = partitions.next_month(month)
+
+    def archive_path(self, archive_dir, month):
+        """<archive_dir>/loan-events-<yyyy>-<mm>.jsonl.gz, or its next free part (loan-events-<yyyy>-<mm>.2.jsonl.gz
+        and so on) when an earlier run already archived some rows of the month"""
+        path = os.path.join(archive_dir, 'loan-events-{0:%Y-%m}.jsonl.gz'.format(month))
+        part = 1
+        while os.path.exists(path):
+            part += 1
+            path = os.path.join(archive_dir, 'loan-events-{0:%Y-%m}.{1}.jsonl.gz'.format(month, part))
+        return path
+
+    def archive(self, events, month, archive_dir):
+        """Streams the events of <month> to a new archive file of the month and returns their number and the
+        highest id written (None when there was none). The file is written under a temporary name and renamed
+        once complete, months without any event don't get a file."""
+        os.makedirs(archive_dir, exist_ok=True)
+        path = self.archive_path(archive_dir, month)
+        count = 0
+        last_id = None
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+            for event in events.order_by('created_at', 'id').values().iterator(chunk_size=2000):
+                archive.write(json.dumps(event, default=str) + '\n')
+                count += 1
+                last_id = max(last_id or 0, event['id'])
+        if count:
+            os.replace(path + '.tmp', path)
+        else:
+            os.remove(path + '.tmp')
+        return count, last_id
+
+    def delete_in_batches(self, events, batch_size):
+        deleted = 0
+        while True:
+            ids = list(events.order_by().values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += events.filter(id__in=ids).delete()[0]
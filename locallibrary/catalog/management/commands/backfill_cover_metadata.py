@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from PIL import Image
+
+from catalog.covers import cover_color, set_cover_metadata
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+    help = ('Reads the width, height, size and dominant color of the covers of the books saved before these '
+            'were recorded. A file shared by several books is only read once.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Books read from the database at a time')
+        parser.add_argument('--all', action='store_true',
+                            help='Read every cover again, not only those without metadata')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(book_cover='')
+        if not options['all']:
+            books = books.filter(Q(cover_width__isnull=True) | Q(cover_color=''))
+        done = set()
+        read = unreadable = updated = 0
+        last_pk = 0
+        while True:
+            batch = list(books.filter(pk__gt=last_pk).order_by('pk').only('pk', 'book_cover')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for book in batch:
+                name = book.book_cover.name
+                if name in done:
+                    continue
+                done.add(name)
+                set_cover_metadata(book)
+                read += 1
+                try:
+                    # The color needs the pixels, fine in this command but not in the request saving a book
+                    with book.book_cover.storage.open(name, 'rb') as cover:
+                        book.cover_color = cover_color(cover)
+                except (OSError, ValueError, Image.DecompressionBombError):
+                    book.cover_width = None
+                if book.cover_width is None:
+                    unreadable += 1
+                    self.stderr.write('Could not read {0}'.format(name))
+                    continue
+                # Every book with this cover gets the values at once
+                updated += Book.objects.filter(book_cover=name).update(
+                    cover_width=book.cover_width, cover_height=book.cover_height, cover_bytes=book.cover_bytes,
+                    cover_color=book.cover_color)
+        self.stdout.write('Read {0} covers ({1} unreadable), updated {2} books'.format(read, unreadable, updated))
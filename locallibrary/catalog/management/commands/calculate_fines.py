@@ -0,0 +1,29 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import fines
+
+
+class Command(BaseCommand):
+    help = ('Works out the fines every member owes on their overdue copies and saves them. The fines are '
+            'recomputed from scratch each time, run it once a day (e.g. from cron).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day (YYYY-MM-DD) the fines are worked out for, defaults to today')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Overdue loans read from the database and fined at a time')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Members saved per statement')
+
+    def handle(self, *args, **options):
+        today = None
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError('--date must be a date as YYYY-MM-DD')
+
+        members, cents, loans = fines.apply_fines(today, options['chunk_size'], options['batch_size'])
+        self.stdout.write('Fined {0} members {1:.2f} in total for {2} overdue loans'.format(
+            members, cents / 100, loans))
@@ -0,0 +1,62 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Deletes the expired sessions a batch at a time, walking django_session in primary key order and '
+            'sleeping between batches, so that the table is never locked for long (unlike clearsessions, which '
+            'deletes them all in one statement). With --loop it keeps running as a low priority worker.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Most sessions deleted per statement')
+        parser.add_argument('--sleep', type=float, default=0.1,
+                            help='Seconds to wait between two batches')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, starting a new pass every --interval seconds')
+        parser.add_argument('--interval', type=float, default=3600,
+                            help='Seconds between the start of two passes (with --loop)')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        try:
+            while True:
+                started = time.monotonic()
+                self.clear(options['batch_size'], options['sleep'])
+                if not options['loop']:
+                    break
+                time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
+        except KeyboardInterrupt:
+            pass
+
+    def clear(self, batch_size, sleep):
+        """Deletes every session that expired before the pass started, returns how many there were"""
+        now = timezone.now()
+        expired = Session.objects.filter(expire_date__lt=now).order_by('session_key')
+        deleted = batches = longest = 0
+        last_key = ''
+        start = time.perf_counter()
+        while True:
+            # The upper bound of the batch is the batch_size-th expired key, so that the DELETE is a short
+            # range scan of the primary key deleting at most batch_size rows
+            keys = list(expired.filter(session_key__gt=last_key).values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                break
+            batch_start = time.perf_counter()
+            count, _ = expired.filter(session_key__gt=last_key, session_key__lte=keys[-1]).delete()
+            longest = max(longest, time.perf_counter() - batch_start)
+            deleted += count
+            batches += 1
+            last_key = keys[-1]
+            if self.verbosity >= 2 or (self.verbosity and batches % 100 == 0):
+                self.stdout.write('Deleted {0} expired sessions, up to key {1}'.format(deleted, last_key))
+            if len(keys) < batch_size:
+                break
+            time.sleep(sleep)
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Deleted {0} expired sessions in {1} batches ({2:.2f}s, longest batch {3:.3f}s)'.format(
+            deleted, batches, elapsed, longest))
+        return deleted
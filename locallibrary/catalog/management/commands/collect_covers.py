@@ -0,0 +1,48 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from catalog.covers import variant_names
+from catalog.models import Book, CoverBlob
+from catalog.storage import cover_storage
+
+
+class Command(BaseCommand):
+    help = ('Deletes the cover files (and their resized variants) that no book uses any more. A file is only '
+            'deleted once it has been unused for --grace-period hours, so that a cover just uploaded through '
+            'a form is not collected before its book is saved.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-period', type=float, default=24,
+                            help='Hours a file must have gone without being uploaded before it can be deleted')
+        parser.add_argument('--recount', action='store_true',
+                            help='Count the references of every file again from the books first')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write('Recounted the references of {0} files'.format(self.recount()))
+        cutoff = timezone.now() - datetime.timedelta(hours=options['grace_period'])
+        deleted = freed = 0
+        for name in CoverBlob.objects.filter(references__lte=0, stored_at__lt=cutoff).values_list('name', flat=True):
+            with transaction.atomic():
+                # The row lock makes an upload of the same file wait, and the checks are repeated under it
+                blob = CoverBlob.objects.select_for_update().filter(
+                    name=name, references__lte=0, stored_at__lt=cutoff).first()
+                if blob is None or Book.objects.filter(book_cover=name).exists():
+                    continue
+                # The files go before the row is deleted, an upload waiting on the lock then writes the file again
+                for file_name in [name] + variant_names(name):
+                    cover_storage.delete(file_name)
+                blob.delete()
+            deleted += 1
+            freed += blob.size
+        self.stdout.write('Deleted {0} unused cover files ({1} bytes)'.format(deleted, freed))
+
+    def recount(self):
+        books = Book.objects.filter(book_cover=OuterRef('name')).order_by().values('book_cover')
+        references = books.annotate(count=Count('id')).values('count')
+        return CoverBlob.objects.update(references=Coalesce(Subquery(references), 0))
@@ -0,0 +1,202 @@
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from catalog.models import Author, Book, CoverBlob, Genre, Language
+from catalog.utils import batched
+
+# Longest values the columns take, longer ones are reported as invalid rows rather than failing a whole batch
+TITLE_MAX_LENGTH = Book._meta.get_field('title').max_length
+ISBN_MAX_LENGTH = Book._meta.get_field('isbn').max_length
+NAME_MAX_LENGTH = min(Author._meta.get_field('last_name').max_length, Author._meta.get_field('first_name').max_length,
+                      Language._meta.get_field('name').max_length, Genre._meta.get_field('name').max_length)
+
+
+class InvalidRow(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Imports books from a CSV or JSON Lines file of any size, read one row at a time. Columns (or keys): '
+            'title, author ("Last name, First name"), summary, isbn, language, genres (several separated by '
+            '--genre-separator in a CSV file, a list in JSON) and cover (name of a file already in the cover '
+            'storage). Authors, languages and genres are matched by name, the missing ones are created. The '
+            'books are inserted --batch-size at a time, one transaction per batch. Run backfill_cover_metadata '
+            'and process_covers afterwards if the books have covers.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='File to import, - for the standard input. A .gz file is decompressed')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Format of the file, guessed from its extension by default')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Books inserted per batch')
+        parser.add_argument('--genre-separator', default='|',
+                            help='Separator of the genres in the genres column of a CSV file')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.genre_separator = options['genre_separator']
+        file_format = options['format'] or self.guess_format(options['file'])
+
+        # Every author, language and genre is looked up in memory, each table is read once here
+        self.authors = {(first, last): pk for pk, first, last in
+                        Author.objects.values_list('pk', 'first_name', 'last_name').iterator()}
+        self.languages = {name: pk for pk, name in Language.objects.values_list('pk', 'name').iterator()}
+        self.genres = {name: pk for pk, name in Genre.objects.values_list('pk', 'name').iterator()}
+        self.created = Counter()
+        self.imported = self.invalid = 0
+
+        start = time.perf_counter()
+        with self.open(options['file']) as file:
+            rows = self.read_csv(file) if file_format == 'csv' else self.read_jsonl(file)
+            for batch in batched(self.parse(rows), options['batch_size']):
+                self.import_batch(batch)
+                if self.verbosity >= 2:
+                    self.stdout.write('{0} books imported, {1:,.0f} rows/s'.format(
+                        self.imported, self.imported / (time.perf_counter() - start)))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            'Imported {0} books ({1} invalid rows skipped), created {2} authors, {3} languages and {4} genres '
+            'in {5:.1f}s ({6:,.0f} rows/s)'.format(
+                self.imported, self.invalid, self.created[Author], self.created[Language], self.created[Genre],
+                elapsed, (self.imported + self.invalid) / elapsed))
+
+    def guess_format(self, path):
+        name = path[:-3] if path.endswith('.gz') else path
+        if name.endswith('.csv'):
+            return 'csv'
+        if name.endswith(('.jsonl', '.ndjson')):
+            return 'jsonl'
+        raise CommandError('Can not tell the format of {0}, use --format'.format(path))
+
+    def open(self, path):
+        if path == '-':
+            return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding='utf-8', newline='')
+        return open(path, encoding='utf-8', newline='')
+
+    def read_csv(self, file):
+        """Yields (line number, row dict) of a CSV file with a header line"""
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+
+    def read_jsonl(self, file):
+        """Yields (line number, row dict) of a JSON Lines file, blank lines are skipped"""
+        for line_number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as error:
+                    yield line_number, error
+
+    def parse(self, rows):
+        """Turns the rows into the values of the books, reporting and skipping the invalid ones"""
+        for line_number, row in rows:
+            try:
+                yield self.parse_row(row)
+            except InvalidRow as error:
+                self.invalid += 1
+                self.stderr.write('Line {0}: {1}'.format(line_number, error))
+
+    def text(self, row, key):
+        """Value of <key> in <row> as a stripped string, JSON numbers (e.g. an ISBN) are turned into text"""
+        value = row.get(key)
+        if value is None:
+            return ''
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise InvalidRow('{0} is not text'.format(key))
+        return str(value).strip()
+
+    def parse_row(self, row):
+        if not isinstance(row, dict):
+            raise InvalidRow(row)
+        title = self.text(row, 'title')
+        isbn = self.text(row, 'isbn')
+        if not title:
+            raise InvalidRow('no title')
+        if len(title) > TITLE_MAX_LENGTH or len(isbn) > ISBN_MAX_LENGTH:
+            raise InvalidRow('title or ISBN too long')
+        author = self.text(row, 'author')
+        if author:
+            last_name, _, first_name = author.partition(',')
+            author = (first_name.strip(), last_name.strip())
+        genres = row.get('genres') or []
+        if isinstance(genres, str):
+            genres = genres.split(self.genre_separator)
+        if not isinstance(genres, list) or not all(isinstance(genre, str) for genre in genres):
+            raise InvalidRow('genres is not a list of names')
+        # dict.fromkeys() drops the duplicates but keeps the order
+        genres = list(dict.fromkeys(genre.strip() for genre in genres if genre.strip()))
+        language = self.text(row, 'language')
+        names = [language] + genres + list(author or ())
+        if any(len(name) > NAME_MAX_LENGTH for name in names):
+            raise InvalidRow('author, language or genre name too long')
+        return {
+            'title': title,
+            'author': author or None,
+            'summary': self.text(row, 'summary'),
+            'isbn': isbn,
+            'language': language or None,
+            'genres': genres,
+            'cover': self.text(row, 'cover'),
+        }
+
+    def create_missing(self, model, ids, keys, build, lookup):
+        """Creates the <model> rows of the <keys> not in the <ids> dictionary yet and adds their ids to it"""
+        missing = [key for key in dict.fromkeys(keys) if key is not None and key not in ids]
+        if not missing:
+            return
+        objects = [build(key) for key in missing]
+        model.objects.bulk_create(objects)
+        self.created[model] += len(objects)
+        if objects[0].pk is None:
+            # Databases that don't return the ids of bulk inserts (SQLite), they are read back in one query
+            objects = model.objects.filter(**lookup(missing))
+        for obj in objects:
+            ids.setdefault(self.key(model, obj), obj.pk)
+
+    def key(self, model, obj):
+        if model is Author:
+            return obj.first_name, obj.last_name
+        return obj.name
+
+    def import_batch(self, batch):
+        with transaction.atomic():
+            self.create_missing(Author, self.authors, [book['author'] for book in batch],
+                                lambda key: Author(first_name=key[0], last_name=key[1]),
+                                lambda keys: {'last_name__in': {last for _, last in keys},
+                                              'first_name__in': {first for first, _ in keys}})
+            self.create_missing(Language, self.languages, [book['language'] for book in batch],
+                                lambda name: Language(name=name), lambda names: {'name__in': names})
+            self.create_missing(Genre, self.genres, [genre for book in batch for genre in book['genres']],
+                                lambda name: Genre(name=name), lambda names: {'name__in': names})
+
+            books = [Book(title=book['title'], author_id=self.authors.get(book['author']), summary=book['summary'],
+                          isbn=book['isbn'], language_id=self.languages.get(book['language']),
+                          book_cover=book['cover']) for book in batch]
+            Book.objects.bulk_create(books)
+            book_ids = [book.pk for book in books]
+            if book_ids[0] is None:
+                # Databases that don't return the ids of bulk inserts (SQLite): the batch holds the newest rows,
+                # which is right as long as nothing else adds books during the import
+                book_ids = list(Book.objects.order_by('-pk').values_list('pk', flat=True)[:len(books)])[::-1]
+
+            through = Book.genre.through
+            through.objects.bulk_create(
+                [through(book_id=book_id, genre_id=self.genres[genre])
+                 for book_id, book in zip(book_ids, batch) for genre in book['genres']])
+
+            # bulk_create() skips the signals counting the books using each cover (see catalog/signals.py)
+            for cover, count in Counter(book['cover'] for book in batch if book['cover']).items():
+                CoverBlob.objects.filter(name=cover).update(references=F('references') + count)
+        self.imported += len(batch)
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.covers import books_needing_variants, generate_variants
+
+
+class Command(BaseCommand):
+    help = ('Makes the resized JPEG and WebP variants of the book covers that do not have them yet (new books '
+            'and replaced covers). Run it with --loop as a worker process, or without it from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Books taken at a time')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll for new covers instead of stopping once all are done')
+        parser.add_argument('--poll-interval', type=float, default=10,
+                            help='Seconds to wait for new covers when there are none left (with --loop)')
+
+    def handle(self, *args, **options):
+        # Books whose cover could not be read are only tried again when the worker is restarted
+        self.failed = set()
+        done = 0
+        try:
+            while True:
+                handled, batch_done = self.process_batch(options['batch_size'])
+                done += batch_done
+                # A batch whose covers all failed (or were replaced meanwhile) still leaves books to go through,
+                # only a batch without any book means that all are done
+                if not handled:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Made the variants of {0} covers, {1} failed'.format(done, len(self.failed)))
+
+    def process_batch(self, batch_size):
+        """Makes the variants of one batch of covers, returns whether there were any books left to go through
+        and the number of covers whose variants were made"""
+        done = 0
+        books = list(books_needing_variants().order_by('pk').exclude(pk__in=self.failed)[:batch_size])
+        for book in books:
+            try:
+                ready = generate_variants(book)
+            except Exception as error:
+                self.failed.add(book.pk)
+                self.stderr.write('Could not make the variants of {0}: {1}'.format(book.book_cover.name, error))
+            else:
+                done += ready
+        return bool(books), done
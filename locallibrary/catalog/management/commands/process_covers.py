@@ -0,0 +1,92 @@
+import csv
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+
+from catalog.covers import books_needing_variants, mark_variants_ready, timed_make_variants
+
+
+class Command(BaseCommand):
+    help = ('Makes the resized variants of every cover that does not have them yet (or has them for a previous '
+            'cover) across a pool of worker processes, e.g. after importing a catalog. Every cover is recorded '
+            'as soon as it is done, so the command can be stopped and run again at any time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes (defaults to the number of CPUs)')
+        parser.add_argument('--queue-size', type=int,
+                            help='Most covers handed to the workers at a time (defaults to twice --workers)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Books read from the database at a time')
+        parser.add_argument('--timings', metavar='FILE',
+                            help='Write the time every cover took (and the error of those that failed) to a CSV file')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        queue_size = options['queue_size'] or 2 * workers
+        self.verbosity = options['verbosity']
+        self.done = self.failed = 0
+        self.total_seconds = self.longest = 0
+        self.timings = None
+        timings_file = open(options['timings'], 'w', newline='') if options['timings'] else None
+        if timings_file:
+            self.timings = csv.writer(timings_file)
+            self.timings.writerow(['cover', 'seconds', 'books', 'error'])
+        start = time.perf_counter()
+        try:
+            # The workers only read and write files, the results are saved to the database from this process.
+            # django.setup() makes the workers usable with the spawn start method too (macOS, Windows)
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as executor:
+                pending = set()
+                for name in self.covers_to_process(options['batch_size']):
+                    # Bounded queue: never more than queue_size covers submitted and not recorded yet
+                    if len(pending) >= queue_size:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.record(finished)
+                    pending.add(executor.submit(timed_make_variants, name))
+                self.record(wait(pending).done)
+        finally:
+            if timings_file:
+                timings_file.close()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            'Processed {0} covers ({1} failed) in {2:.1f}s with {3} workers, {4:.1f} covers/s, '
+            'per cover: mean {5:.3f}s, max {6:.3f}s'.format(
+                self.done + self.failed, self.failed, elapsed, workers, (self.done + self.failed) / elapsed,
+                self.total_seconds / ((self.done + self.failed) or 1), self.longest))
+
+    def covers_to_process(self, batch_size):
+        """Yields the name of every cover needing variants once, reading the books a batch at a time"""
+        submitted = set()
+        last_pk = 0
+        while True:
+            batch = list(books_needing_variants().filter(pk__gt=last_pk).order_by('pk').values_list(
+                'pk', 'book_cover')[:batch_size])
+            if not batch:
+                return
+            last_pk = batch[-1][0]
+            for _, name in batch:
+                # A cover shared by several books is only processed once
+                if name not in submitted:
+                    submitted.add(name)
+                    yield name
+
+    def record(self, futures):
+        for future in futures:
+            name, seconds, color, error = future.result()
+            self.total_seconds += seconds
+            self.longest = max(self.longest, seconds)
+            books = 0
+            if error is None:
+                books = mark_variants_ready(name, color=color)
+                self.done += 1
+            else:
+                self.failed += 1
+                self.stderr.write('Could not make the variants of {0}: {1}'.format(name, error))
+            if self.timings:
+                self.timings.writerow([name, '{0:.4f}'.format(seconds), books, error or ''])
+            if self.verbosity >= 2:
+                self.stdout.write('{0} {1:.3f}s'.format(name, seconds))
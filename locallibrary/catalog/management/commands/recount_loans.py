@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.models import LoanCounter
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the per-member loan counters from the book copies. The circulation views keep the '
+            'counters up to date, run this after changing copies outside of them (e.g. in the admin site).')
+
+    def handle(self, *args, **options):
+        members = LoanCounter.objects.recount()
+        self.stdout.write('Recounted the loans of {0} members'.format(members))
@@ -0,0 +1,95 @@
+import datetime
+import itertools
+import os
+import time
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import get_template
+
+from catalog.models import BookInstance
+from catalog.utils import batched
+
+SUBJECT = "Joels' Local Library Overdue Books"
+
+
+def checkpoint_path(day):
+    """Returns the default checkpoint file of the run made on <day>"""
+    return os.path.join(settings.BASE_DIR, '.overdue_notices_checkpoint_{0}'.format(day.isoformat()))
+
+
+class Command(BaseCommand):
+    help = ('Emails every member with overdue books one notice listing all of them. Loans are streamed from the '
+            'database, notices are sent in batches over a single SMTP connection, and the last member notified '
+            'is checkpointed after every batch so that a failed run can be resumed with --resume.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Number of notices handed to the mail connection at once')
+        parser.add_argument('--checkpoint',
+                            help="File keeping the id of the last member notified, by default one per day in BASE_DIR")
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the members already notified by a previous, failed run')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Render every notice but send nothing, then report the throughput')
+
+    def handle(self, *args, **options):
+        # The default checkpoint is named after the day of the run, so a failed run that was never resumed
+        # can't make a later run skip members.
+        if not options['checkpoint']:
+            options['checkpoint'] = checkpoint_path(datetime.date.today())
+        loans = BookInstance.objects.overdue().with_days_overdue().exclude(borrower__email='')
+        if options['resume'] and os.path.exists(options['checkpoint']):
+            with open(options['checkpoint']) as checkpoint:
+                last_member = int(checkpoint.read())
+            loans = loans.filter(borrower_id__gt=last_member)
+            self.stdout.write('Resuming after member {0}'.format(last_member))
+
+        # Ordered by member so that all the loans of one member come one after the other and can be
+        # grouped while streaming, without ever holding the whole list of overdue loans.
+        rows = loans.order_by('borrower_id', 'due_back').values(
+            'borrower_id', 'borrower__username', 'borrower__first_name', 'borrower__email',
+            'book__title', 'due_back', 'days_overdue').iterator(chunk_size=2000)
+        members = itertools.groupby(rows, key=itemgetter('borrower_id'))
+
+        template = get_template('catalog/overdue_notice_email.html')
+        connection = None if options['dry_run'] else get_connection()
+        sent = 0
+        start = time.perf_counter()
+        try:
+            if connection is not None:
+                connection.open()
+            for batch in batched((self.notice(template, loans) for _, loans in members), options['batch_size']):
+                if connection is not None:
+                    try:
+                        connection.send_messages([message for _, message in batch])
+                    except Exception as error:
+                        raise CommandError('Sending failed after {0} notices, run again with --resume: {1}'.format(
+                            sent, error))
+                    with open(options['checkpoint'], 'w') as checkpoint:
+                        checkpoint.write(str(batch[-1][0]))
+                sent += len(batch)
+        finally:
+            if connection is not None:
+                connection.close()
+        elapsed = time.perf_counter() - start
+
+        if not options['dry_run'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        self.stdout.write('{0} {1} notices in {2:.2f}s ({3:.0f} notices/s)'.format(
+            'Rendered' if options['dry_run'] else 'Sent', sent, elapsed, sent / elapsed if elapsed else 0))
+
+    def notice(self, template, loans):
+        """Returns (member id, email message) for the overdue <loans> of one member"""
+        loans = list(loans)
+        member = loans[0]
+        message = template.render({
+            'member': {'username': member['borrower__username'], 'first_name': member['borrower__first_name']},
+            'loans': [{'title': loan['book__title'], 'due_back': loan['due_back'],
+                       'days_overdue': loan['days_overdue']} for loan in loans],
+        })
+        mail = EmailMessage(SUBJECT, message, to=[member['borrower__email']], from_email=settings.EMAIL_HOST_USER)
+        mail.content_subtype = 'html'
+        return member['borrower_id'], mail
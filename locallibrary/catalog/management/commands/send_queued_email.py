@@ -0,0 +1,71 @@
+import datetime
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.models import OutgoingEmail
+
+
+class Command(BaseCommand):
+    help = ('Sends the emails waiting in the outbox, in batches over a single mail server connection. An email '
+            'that fails is retried later with an exponential backoff. Run it with --loop as a worker process, '
+            'or without it from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Emails taken from the outbox at a time')
+        parser.add_argument('--retry-delay', type=int, default=60,
+                            help='Seconds before the first retry of a failed email, doubled after every failure')
+        parser.add_argument('--max-retry-delay', type=int, default=3600,
+                            help='Longest wait, in seconds, between two attempts of an email')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running and poll the outbox instead of stopping once it is empty')
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help='Seconds to wait for new emails when the outbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        sent = failed = 0
+        try:
+            while True:
+                batch_sent, batch_failed = self.send_batch(connection, options)
+                sent += batch_sent
+                failed += batch_failed
+                if batch_sent + batch_failed == 0:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write('Sent {0} emails, {1} failed attempts'.format(sent, failed))
+
+    def send_batch(self, connection, options):
+        """Sends one batch of the outbox, returns the number of emails sent and of failed attempts"""
+        sent = failed = 0
+        # The rows stay locked until the batch is recorded, skip_locked lets several workers share the outbox
+        with transaction.atomic():
+            emails = list(OutgoingEmail.objects.due().select_for_update(skip_locked=True)[:options['batch_size']])
+            for email in emails:
+                try:
+                    # A no-op while the connection is open, reconnects after a failure closed it
+                    connection.open()
+                    connection.send_messages([email.message(connection)])
+                except Exception as error:
+                    connection.close()
+                    email.attempts += 1
+                    email.last_error = str(error)
+                    delay = min(options['retry_delay'] * 2 ** (email.attempts - 1), options['max_retry_delay'])
+                    email.send_after = timezone.now() + datetime.timedelta(seconds=delay)
+                    email.save(update_fields=['attempts', 'last_error', 'send_after'])
+                    failed += 1
+                else:
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+                    email.save(update_fields=['attempts', 'sent_at'])
+                    sent += 1
+        return sent, failed
@@ -0,0 +1,135 @@
+"""
+Serving of the uploaded files (MEDIA_ROOT).
+
+Django only decides whether and what to serve, the bytes are sent by whatever is cheapest for the
+deployment, chosen with settings.MEDIA_SERVE_MODE:
+
+ - 'x-accel-redirect': the response only carries an X-Accel-Redirect header and nginx sends the file
+   from its internal MEDIA_ACCEL_REDIRECT_PREFIX location (see docker/nginx/default.conf). The worker is
+   free as soon as the headers are out, and nginx deals with range requests itself.
+ - 'x-sendfile': the same with the X-Sendfile header of Apache's mod_xsendfile and lighttpd.
+ - 'django' (the default): a FileResponse, which the WSGI server hands to its wsgi.file_wrapper, so the
+   file goes out with sendfile() rather than being read into Python. Range requests get a 206 response
+   with the requested bytes only.
+"""
+
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from .storage import COVERS_DIRECTORY
+
+# A year, the longest max-age browsers and proxies honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Internal nginx location aliasing MEDIA_ROOT, used with MEDIA_SERVE_MODE = 'x-accel-redirect'
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Only single ranges are honoured, a request for several ranges gets the whole file (which RFC 7233 allows)
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def serve_mode():
+    return getattr(settings, 'MEDIA_SERVE_MODE', 'django')
+
+
+def is_immutable(path):
+    # The content addressed covers, and their variants, never change once written (see catalog/storage.py)
+    return path.startswith(COVERS_DIRECTORY + '/')
+
+
+def requested_range(request, size, last_modified):
+    """(first byte, last byte) of the range asked for by <request>, None for the whole file. Raises ValueError
+    if the range is outside of the file"""
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    # A stale If-Range means the client's copy is out of date, it must get the whole new file
+    if match is None or request.META.get('HTTP_IF_RANGE', last_modified) != last_modified:
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range, the last <last> bytes
+        if not last:
+            return None
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first > last or first >= size:
+        raise ValueError('Range not satisfiable')
+    return first, last
+
+
+def iter_range(file, length):
+    with file:
+        while length > 0:
+            chunk = file.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_response(request, fullpath, stat, content_type, last_modified):
+    try:
+        byte_range = requested_range(request, stat.st_size, last_modified)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{0}'.format(stat.st_size)
+        return response
+    if byte_range is None:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+        file = open(fullpath, 'rb')
+        file.seek(first)
+        response = StreamingHttpResponse(iter_range(file, last - first + 1), status=206, content_type=content_type)
+        response['Content-Length'] = last - first + 1
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(first, last, stat.st_size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, path, document_root=None, show_indexes=False):
+    """Serves the file at <path> under MEDIA_ROOT the way MEDIA_SERVE_MODE says (see the module docstring).
+    Takes the arguments of django.views.static.serve(), but never lists directories"""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        fullpath = safe_join(document_root or settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('"{0}" does not exist'.format(path))
+    if not os.path.isfile(fullpath):
+        raise Http404('"{0}" does not exist'.format(path))
+    stat = os.stat(fullpath)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+        return HttpResponseNotModified()
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+    last_modified = http_date(stat.st_mtime)
+    mode = serve_mode()
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', MEDIA_ACCEL_REDIRECT_PREFIX)
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + path)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = fullpath
+    else:
+        response = file_response(request, fullpath, stat, content_type, last_modified)
+    response['Last-Modified'] = last_modified
+    if encoding:
+        response['Content-Encoding'] = encoding
+    if response.status_code in (200, 206) and is_immutable(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,48 @@
+"""
+Middleware of the catalog app.
+
+PublicReadMiddleware serves the public catalog pages (the views with public_read = True) to anonymous
+visitors as shared, cacheable pages: no cookie is set, the response doesn't vary on Cookie, and it is sent
+with Cache-Control: public so that a reverse proxy can answer the next visitors without hitting Django.
+It has to come before SessionMiddleware in settings.MIDDLEWARE, so that it sees the response after the
+session, CSRF and messages middleware did.
+
+As these responses don't vary on Cookie any more, the proxy must not answer requests carrying a session
+cookie from its cache (e.g. with nginx: proxy_cache_bypass $cookie_sessionid; proxy_no_cache $cookie_sessionid;).
+"""
+
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+
+
+class PublicReadMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.public_read = False
+        response = self.get_response(request)
+        if request.public_read and self.is_anonymous(request):
+            # Nothing on these pages depends on the visitor, so nothing may be personal in the response
+            response.cookies.clear()
+            if response.has_header('Vary'):
+                vary = [header.strip() for header in response['Vary'].split(',')]
+                vary = [header for header in vary if header.lower() != 'cookie']
+                if vary:
+                    response['Vary'] = ', '.join(vary)
+                else:
+                    del response['Vary']
+            patch_cache_control(response, public=True, max_age=getattr(settings, 'PUBLIC_READ_MAX_AGE', 300))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        request.public_read = request.method in ('GET', 'HEAD') and (
+            getattr(view_func, 'public_read', False) or getattr(view_class, 'public_read', False))
+
+    @staticmethod
+    def is_anonymous(request):
+        # Without a session cookie the visitor can only be anonymous, and the session is never loaded
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            return True
+        return not request.user.is_authenticated
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(condition=models.Q(status='o'), fields=['due_back'], name='catalog_bookinst_loan_due_idx'),
+        ),
+    ]
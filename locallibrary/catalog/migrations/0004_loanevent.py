@@ -0,0 +1,54 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+from catalog import partitions
+
+
+# The table itself is created by hand: on PostgreSQL it is range partitioned by month on created_at,
+# which the schema editor can't express, see catalog/partitions.py
+def create_loan_event_table(apps, schema_editor):
+    partitions.create_loan_event_table(schema_editor, apps.get_model('catalog', 'LoanEvent'))
+
+
+def drop_loan_event_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('catalog', 'LoanEvent'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0003_hold'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='LoanEvent',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                        ('event', models.CharField(choices=[('q', 'Borrow requested'), ('l', 'Lent'), ('n', 'Renewed'), ('t', 'Returned'), ('h', 'Reserved for a hold')], max_length=1)),
+                        ('due_back', models.DateField(blank=True, null=True)),
+                        ('book', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='loan_events', to='catalog.book')),
+                        ('book_instance', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='loan_events', to='catalog.bookinstance')),
+                        ('borrower', models.ForeignKey(db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='loan_events', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'ordering': ['created_at'],
+                        'indexes': [
+                            models.Index(fields=['created_at'], name='catalog_loanevent_created_idx'),
+                            models.Index(fields=['book_instance', 'created_at'], name='catalog_loanevent_copy_idx'),
+                            models.Index(fields=['borrower', 'created_at'], name='catalog_loanevent_member_idx'),
+                        ],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_loan_event_table, drop_loan_event_table),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:08
+
+import catalog.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_loanevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='id',
+            field=models.UUIDField(default=catalog.utils.new_copy_id, help_text='Unique ID for this particular book across whole library', primary_key=True, serialize=False),
+        ),
+    ]
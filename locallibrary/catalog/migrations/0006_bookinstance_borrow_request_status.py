@@ -0,0 +1,38 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:13
+
+from django.db import migrations, models
+
+
+# Until now a borrow request was an available copy with a due_back date set
+def mark_borrow_requests(apps, schema_editor):
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    BookInstance.objects.filter(status='a', due_back__isnull=False).update(status='p')
+
+
+def unmark_borrow_requests(apps, schema_editor):
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    BookInstance.objects.filter(status='p').update(status='a')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_bookinstance_time_ordered_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookinstance',
+            name='status',
+            field=models.CharField(blank=True, choices=[('m', 'Maintenance'), ('o', 'On Loan'), ('a', 'Available'), ('r', 'Reserved'), ('p', 'Borrow Requested')], default='a', help_text='Book Availability', max_length=1),
+        ),
+        migrations.RunPython(mark_borrow_requests, unmark_borrow_requests),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(condition=models.Q(status='p'), fields=['due_back', 'id'], name='catalog_bookinst_request_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(condition=models.Q(status='a'), fields=['book', 'id'], name='catalog_bookinst_available_idx'),
+        ),
+    ]
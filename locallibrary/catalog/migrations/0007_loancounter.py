@@ -0,0 +1,36 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q
+
+
+def count_loans(apps, schema_editor):
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    LoanCounter = apps.get_model('catalog', 'LoanCounter')
+    totals = BookInstance.objects.filter(borrower__isnull=False).values('borrower').annotate(
+        on_loan=Count('id', filter=Q(status='o')), requested=Count('id', filter=Q(status='p')))
+    LoanCounter.objects.bulk_create(
+        (LoanCounter(user_id=row['borrower'], on_loan=row['on_loan'], requested=row['requested'])
+         for row in totals.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0006_bookinstance_borrow_request_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='loan_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('on_loan', models.PositiveIntegerField(default=0)),
+                ('requested', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_loans, migrations.RunPython.noop),
+    ]
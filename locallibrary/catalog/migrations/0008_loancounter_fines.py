@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_loancounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loancounter',
+            name='fines',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_variants_of',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-19 08:36
+
+import catalog.storage
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_book_cover_variants_of'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField()),
+                ('references', models.IntegerField(default=0)),
+                ('stored_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='book_cover',
+            field=models.ImageField(storage=catalog.storage.ContentAddressedStorage(), upload_to='covers'),
+        ),
+        migrations.AddIndex(
+            model_name='coverblob',
+            index=models.Index(condition=models.Q(references__lte=0), fields=['stored_at'], name='catalog_coverblob_unused_idx'),
+        ),
+    ]
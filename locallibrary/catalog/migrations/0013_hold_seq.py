@@ -0,0 +1,43 @@
+# Generated by Django 3.1.14 on 2026-10-19 10:02
+
+from django.db import migrations, models
+
+
+# The holds placed so far are numbered in the order they were placed, per book
+def number_holds(apps, schema_editor):
+    Hold = apps.get_model('catalog', 'Hold')
+    book_id, seq = None, 0
+    for hold in Hold.objects.order_by('book_id', 'created_at', 'id').only('id', 'book_id').iterator():
+        if hold.book_id != book_id:
+            book_id, seq = hold.book_id, 0
+        seq += 1
+        Hold.objects.filter(pk=hold.pk).update(seq=seq)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_book_cover_metadata'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='hold',
+            name='catalog_hold_queue_idx',
+        ),
+        migrations.AddField(
+            model_name='hold',
+            name='seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.RunPython(number_holds, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(fulfilled_at__isnull=True), fields=['book', 'seq'], name='catalog_hold_queue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hold',
+            constraint=models.UniqueConstraint(fields=('book', 'seq'), name='catalog_hold_unique_seq'),
+        ),
+    ]
@@ -1,13 +1,34 @@
 import datetime
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F, Count, Max, ExpressionWrapper
+from django.db.models.functions import Now, TruncDate, Greatest
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage
 from django.urls import reverse  # Used to generate URLs by reversing the URL patterns
-import uuid  # Required for unique book instances
 from datetime import date
 from django.contrib.auth.models import User, Group
 from django.utils import timezone
 
+from .storage import COVERS_DIRECTORY, cover_storage
+from .utils import batched, new_copy_id
+
+
+# Every member joins this group once they have confirmed their email address
+LIBRARY_MEMBERS_GROUP = 'Library Members'
+LIBRARY_MEMBERS_GROUP_CACHE_KEY = 'catalog:library-members-group'
+
+
+def library_members_group_id():
+    """Primary key of the Library Members group, looked up (or created) once and then kept in the cache.
+    catalog.signals drops it when the group is deleted, a group created again gets a new id"""
+    group_id = cache.get(LIBRARY_MEMBERS_GROUP_CACHE_KEY)
+    if group_id is None:
+        group_id = Group.objects.get_or_create(name=LIBRARY_MEMBERS_GROUP)[0].pk
+        cache.set(LIBRARY_MEMBERS_GROUP_CACHE_KEY, group_id)
+    return group_id
+
 
 class Genre(models.Model):
     """Model representing a book genre"""
@@ -61,7 +82,7 @@ class BookManager(models.Manager):
 
 
 def user_directory_path(instance, filename):
-    # file will be uploaded to MEDIA_ROOT/<tourist_centre_name>/<filename>
+    # Only kept for the migrations: covers are now saved under the digest of their content (see catalog/storage.py)
     return '{0}/{1}'.format(instance.author.__str__(), filename)
 
 
@@ -82,7 +103,19 @@ class Book(models.Model):
     isbn = models.CharField('ISBN', max_length=13,
                             help_text='13 Character <a href="https://www.isbn-international.org/content/what-isbn'
                                       '">ISBN number</a>')
-    book_cover = models.ImageField(upload_to=user_directory_path)
+    # Saved under the digest of the image (covers/<xx>/<sha256>.<ext>), so it never clashes with another cover
+    book_cover = models.ImageField(upload_to=COVERS_DIRECTORY, storage=cover_storage)
+    # Name of the cover the resized variants were last made from (see catalog/covers.py), they are
+    # out of date whenever it differs from book_cover
+    cover_variants_of = models.CharField(max_length=100, blank=True, editable=False)
+    # Read from the image header once, when the cover is saved (or by the backfill_cover_metadata command), so that
+    # pages can size the cover and paint its placeholder without opening the file
+    cover_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    cover_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    cover_bytes = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Most common color of the cover, as #rrggbb. It needs the decoded image, so it is worked out along with the
+    # variants (see catalog/covers.py) and is empty until then
+    cover_color = models.CharField(max_length=7, blank=True, editable=False)
     # ManyToManyField used because genre can contain many books. Books can cover many genres
     genre = models.ManyToManyField(Genre, help_text='Select a genre for this book or press shift key '
                                                     'and select more to select more than one Genre')
@@ -129,11 +162,100 @@ class Book(models.Model):
 # avoid performance issues.
 
 
+class BookInstanceQuerySet(models.QuerySet):
+    """This queryset handles the loan selection and bulk renewal queries for the BookInstance Model.
+    Every predicate below is chainable, so a librarian can narrow a selection down e.g.
+    BookInstance.objects.on_loan().overdue().for_borrower(user)"""
+    def on_loan(self):
+        return self.filter(status__exact='o')
+
+    # Both of these are served by their own partial index (see BookInstance.Meta)
+    def available(self):
+        return self.filter(status__exact='a')
+
+    def requested(self):
+        return self.filter(status__exact='p')
+
+    def reserved_for(self, user):
+        """Copies set aside for <user> by the hold queue (see HoldQuerySet.fulfil_next)"""
+        return self.filter(status__exact='r', borrower=user)
+
+    def claimable_by(self, user):
+        """Copies <user> can ask to borrow: the available ones and the ones reserved for them"""
+        return self.filter(Q(status__exact='a') | Q(status__exact='r', borrower=user))
+
+    # Overdue is worked out against the database's current date (and not with date.today() on
+    # every row in Python) so that it can be filtered, sorted and aggregated in a single query.
+    # The partial index on due_back for copies on loan (see BookInstance.Meta) serves these queries.
+    def overdue(self):
+        return self.on_loan().filter(due_back__lt=TruncDate(Now()))
+
+    def with_days_overdue(self):
+        """Annotates every copy with days_overdue, the (timedelta) difference between the database's
+        current date and due_back"""
+        return self.annotate(days_overdue=ExpressionWrapper(
+            TruncDate(Now()) - F('due_back'), output_field=models.DurationField()))
+
+    def overdue_by_member(self):
+        """Number of overdue copies and the longest overdue time for every member with an overdue loan"""
+        return self.overdue().with_days_overdue().order_by().values(
+            'borrower', 'borrower__username').annotate(
+            overdue_loans=Count('id'), max_days_overdue=Max('days_overdue')).order_by(
+            '-max_days_overdue', 'borrower__username')
+
+    def due_back_counts(self, start, end):
+        """Number of copies on loan due back on each day from <start> up to (not including) <end>, as a
+        {date: copies} dict without the days nothing is due. One GROUP BY over the partial due_back index."""
+        return dict(self.on_loan().filter(due_back__gte=start, due_back__lt=end).values('due_back').annotate(
+            copies=Count('id')).order_by().values_list('due_back', 'copies'))
+
+    def due_within(self, days):
+        """Loans that are overdue or fall due in the next <days> days"""
+        return self.on_loan().filter(due_back__lte=date.today() + datetime.timedelta(days=days))
+
+    def for_borrower(self, borrower):
+        return self.filter(borrower=borrower)
+
+    def for_book(self, book):
+        return self.filter(book=book)
+
+    def renew(self, due_back, batch_size=1000):
+        """Extends every selected loan to <due_back> and returns the ids of the renewed copies.
+
+        The renewal rules of LibrarianRenewBookModelForm are part of the WHERE clause, so rows that changed
+        state between selection and update are left alone: only copies still on loan to a borrower are
+        renewed, and a due date is only ever moved forward, never shortened.
+
+        The renewable rows are locked first and handled <batch_size> at a time: one UPDATE by id and one
+        insert into the loan event log per batch, so the log, the UPDATE and the ids returned cover exactly
+        the same loans."""
+        today = date.today()
+        if due_back < today or due_back > today + BookInstance.RENEWAL_PERIOD:
+            raise ValueError('Renewal date must be between today and {0} ahead'.format(BookInstance.RENEWAL_PERIOD))
+        renewable = self.on_loan().filter(borrower__isnull=False, due_back__lt=due_back)
+        renewed = []
+        with transaction.atomic():
+            now = timezone.now()
+            rows = renewable.select_for_update().values_list('id', 'book_id', 'borrower_id').iterator(
+                chunk_size=batch_size)
+            for batch in batched(rows, batch_size):
+                ids = [copy_id for copy_id, _, _ in batch]
+                BookInstance.objects.filter(id__in=ids).update(due_back=due_back)
+                LoanEvent.objects.bulk_create(
+                    LoanEvent(created_at=now, event=LoanEvent.RENEWED, book_instance_id=copy_id, book_id=book_id,
+                              borrower_id=borrower_id, due_back=due_back)
+                    for copy_id, book_id, borrower_id in batch)
+                renewed.extend(ids)
+        return renewed
+
+
 class BookInstance(models.Model):
     """Model representing a specific copy of a book (i.e. that can be borrowed from the library)."""
     # UUIDField is used for the id field to set it as the primary_key for this model. This type of
     # field allocates a globally unique value for each instance (one for every book you can find in the library)
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+    # The values are time ordered (see catalog.utils.uuid7) so that new copies don't scatter inserts
+    # all over the primary key index.
+    id = models.UUIDField(primary_key=True, default=new_copy_id,
                           help_text='Unique ID for this particular book across whole library')
 
     # each book can have many copies, but a copy can only have one Book
@@ -141,11 +263,14 @@ class BookInstance(models.Model):
     imprint = models.CharField(max_length=200)
     due_back = models.DateField(null=True, blank=True)
 
+    # A member's borrow request has its own status ('p') until a librarian approves it as 'o', rather
+    # than being an 'a' copy that happens to have a due_back date set.
     LOAN_STATUS = (
         ('m', 'Maintenance'),
         ('o', 'On Loan'),
         ('a', 'Available'),
         ('r', 'Reserved'),
+        ('p', 'Borrow Requested'),
     )
 
     status = models.CharField(
@@ -159,12 +284,22 @@ class BookInstance(models.Model):
     # on loan, this makes it possible for users to borrow books more than one book
     borrower = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
 
+    # A librarian can only push a due date up to two weeks from today, both for a single copy
+    # (LibrarianRenewBookModelForm) and for a bulk renewal (BookInstanceQuerySet.renew)
+    RENEWAL_PERIOD = datetime.timedelta(weeks=2)
+
+    objects = BookInstanceQuerySet.as_manager()
+
     # The @property decorator below, allow this function(is_overdue) to be called directly from templates
     # Note: First verify whether due_back is empty before making a comparison. An empty due_back field
     # would cause Django to throw an error instead of showing the page: empty values are not comparable.
     # This is not something site users should experience!
+    # Rows loaded with BookInstance.objects.with_days_overdue() already carry the answer from the database.
     @property
     def is_overdue(self):
+        days_overdue = getattr(self, 'days_overdue', None)
+        if days_overdue is not None:
+            return self.status == 'o' and days_overdue > datetime.timedelta(0)
         if self.due_back and date.today() > self.due_back:
             return True
         return False
@@ -172,6 +307,16 @@ class BookInstance(models.Model):
     class Meta:
         ordering = ['due_back']
 
+        # Partial index covering only the copies on loan, it keeps the overdue queries away from the
+        # (much bigger) rest of the copy table and stays small as the catalogue grows.
+        indexes = [
+            models.Index(fields=['due_back'], name='catalog_bookinst_loan_due_idx', condition=Q(status='o')),
+            # The librarian's approval queue (oldest return date first) and the members' list of copies
+            # available to borrow each only ever read one status, so each gets its own narrow index
+            models.Index(fields=['due_back', 'id'], name='catalog_bookinst_request_idx', condition=Q(status='p')),
+            models.Index(fields=['book', 'id'], name='catalog_bookinst_available_idx', condition=Q(status='a')),
+        ]
+
         # Permissions are associated with models and define the operations that
         # can be performed on a model instance by a user who has the permission.
         # By default, Django automatically gives add, change, and delete permissions
@@ -199,6 +344,294 @@ class BookInstance(models.Model):
         return '{0} ({1})'.format(self.id, self.book.title)
 
 
+class LoanCounterQuerySet(models.QuerySet):
+    """This queryset keeps every member's LoanCounter in step with the status changes of the copies
+    they borrow, with relative (F expression) updates so that concurrent transitions never lose a count"""
+    # The copy statuses that are counted, and the LoanCounter column counting them
+    COUNTED_STATUSES = {'o': 'on_loan', 'p': 'requested'}
+
+    def request_borrow(self, user):
+        """Counts one more borrow request for <user>, unless that would take them past
+        settings.MAX_LOANS_PER_MEMBER. Returns False (and counts nothing) when they are at the limit."""
+        self.get_or_create(user=user)
+        # The limit is checked in the WHERE clause of the increment itself, two concurrent requests can't
+        # both see the member one below their limit
+        limit = getattr(settings, 'MAX_LOANS_PER_MEMBER', 5)
+        return self.filter(user=user, on_loan__lt=limit - F('requested')).update(
+            requested=F('requested') + 1) == 1
+
+    def move(self, user_id, from_status, to_status):
+        """Moves one copy of member <user_id> from the count of <from_status> to the count of <to_status>"""
+        if user_id is None or from_status == to_status:
+            return
+        changes = {}
+        if from_status in self.COUNTED_STATUSES:
+            field = self.COUNTED_STATUSES[from_status]
+            changes[field] = Greatest(F(field) - 1, 0)
+        if to_status in self.COUNTED_STATUSES:
+            field = self.COUNTED_STATUSES[to_status]
+            changes[field] = F(field) + 1
+        if changes:
+            self.filter(user_id=user_id).update(**changes)
+
+    def recount(self):
+        """Rebuilds every counter from the copy table, for counts that drifted through edits made
+        outside of the circulation views (e.g. in the admin site)"""
+        totals = BookInstance.objects.filter(borrower__isnull=False).values('borrower').annotate(
+            on_loan=Count('id', filter=Q(status='o')), requested=Count('id', filter=Q(status='p')))
+        with transaction.atomic():
+            self.all().delete()
+            for batch in batched(totals.iterator(), 1000):
+                self.bulk_create(LoanCounter(user_id=row['borrower'], on_loan=row['on_loan'],
+                                             requested=row['requested']) for row in batch)
+        return self.count()
+
+
+class LoanCounter(models.Model):
+    """Model counting the copies a member has on loan and asked to borrow, so that the borrowing limit
+    and the counts on "My Borrowed" are a primary key lookup instead of a COUNT over the copy table"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='loan_counter')
+    on_loan = models.PositiveIntegerField(default=0)
+    requested = models.PositiveIntegerField(default=0)
+    # Fines accrued on the member's overdue copies, worked out by the calculate_fines command (see catalog.fines)
+    fines = models.DecimalField(max_digits=9, decimal_places=2, default=0)
+
+    objects = LoanCounterQuerySet.as_manager()
+
+    @property
+    def total(self):
+        return self.on_loan + self.requested
+
+    def __str__(self):
+        return '{0} ({1} on loan, {2} requested)'.format(self.user, self.on_loan, self.requested)
+
+
+class HoldQuerySet(models.QuerySet):
+    """This queryset handles the reservation queue of every Book. A hold is waiting in the queue
+    until a returned copy has been set aside for its member (fulfilled_at is then set)"""
+    def waiting(self):
+        return self.filter(fulfilled_at__isnull=True)
+
+    def queue(self, book):
+        """Holds waiting for <book>, first come first served"""
+        return self.waiting().filter(book=book).order_by('seq')
+
+    def next_in_line(self, book):
+        # A single seek on the head of the (book, seq) queue index, whatever the length of the queue
+        return self.queue(book).first()
+
+    def place(self, book, user):
+        """Puts <user> at the back of the queue of <book> and returns the new hold. Every hold of a book
+        gets the next sequence number of that book; the book row is locked meanwhile, so two members
+        joining the queue at the same time get consecutive numbers."""
+        with transaction.atomic():
+            Book.objects.select_for_update().only('pk').get(pk=book.pk)
+            last = self.filter(book=book).order_by('-seq').values_list('seq', flat=True).first()
+            return self.create(book=book, user=user, seq=(last or 0) + 1)
+
+    def position(self, hold):
+        """1-based position of <hold> in its queue, or None once it is not waiting any more. The waiting holds
+        of its book numbered up to its own are counted: one bounded scan of the (book, seq) queue index,
+        which stays right when holds leave the middle of the queue (deleted in the admin site, or with their
+        member)."""
+        counts = self.queue(hold.book_id).filter(seq__lte=hold.seq).aggregate(
+            position=Count('id'), waiting=Count('id', filter=Q(pk=hold.pk)))
+        return counts['position'] if counts['waiting'] else None
+
+    def fulfil_next(self, book_instance):
+        """Sets <book_instance> aside (status 'r') for the member at the head of its book's queue and
+        returns the fulfilled hold, or None when nobody is waiting. Must run inside the transaction
+        that returned the copy; skip_locked lets two copies of the same book returned at the same
+        time go to two different members instead of queueing behind one another."""
+        hold = self.queue(book_instance.book_id).select_for_update(skip_locked=True).first()
+        if hold is None:
+            return None
+        book_instance.status = 'r'
+        book_instance.borrower_id = hold.user_id
+        book_instance.due_back = None
+        book_instance.save(update_fields=['status', 'borrower', 'due_back'])
+        hold.book_instance = book_instance
+        hold.fulfilled_at = timezone.now()
+        hold.save(update_fields=['book_instance', 'fulfilled_at'])
+        LoanEvent.objects.record(book_instance, LoanEvent.RESERVED)
+        return hold
+
+
+class Hold(models.Model):
+    """Model representing a member waiting for any copy of a Book to be returned"""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Place of the hold in the queue of its book, numbered 1, 2, ... per book (see HoldQuerySet.place)
+    seq = models.PositiveIntegerField(editable=False)
+
+    # Filled in once a returned copy has been reserved for the member
+    book_instance = models.ForeignKey(BookInstance, on_delete=models.SET_NULL, null=True, blank=True)
+    fulfilled_at = models.DateTimeField(null=True, blank=True)
+
+    objects = HoldQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['created_at']
+
+        # The queue index only holds the waiting holds, fulfilled ones drop out of it, so the head
+        # of every queue is always the first entry for its book.
+        indexes = [
+            models.Index(fields=['book', 'seq'], name='catalog_hold_queue_idx',
+                         condition=Q(fulfilled_at__isnull=True)),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'seq'], name='catalog_hold_unique_seq'),
+            models.UniqueConstraint(fields=['book', 'user'], name='catalog_hold_one_waiting_per_member',
+                                    condition=Q(fulfilled_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.book.title, self.user)
+
+
+class LoanEventQuerySet(models.QuerySet):
+    """This queryset handles the queries on the loan event log. On PostgreSQL the log is partitioned
+    by month on created_at, so every query should be bounded in time to only touch the recent partitions"""
+    def record(self, book_instance, event):
+        """Appends <event> for the current state of <book_instance> to the log"""
+        return self.create(event=event, book_instance_id=book_instance.pk, book_id=book_instance.book_id,
+                           borrower_id=book_instance.borrower_id, due_back=book_instance.due_back)
+
+    def between(self, start, end):
+        return self.filter(created_at__gte=start, created_at__lt=end)
+
+    def since(self, start):
+        return self.filter(created_at__gte=start)
+
+    def recent(self, days=30):
+        return self.since(timezone.now() - datetime.timedelta(days=days))
+
+
+class LoanEvent(models.Model):
+    """Append-only log of every circulation transition of a copy (BookInstance only keeps the current state).
+
+    Rows are never updated or deleted by the application, old months are archived and dropped with the
+    archive_loan_events command. Copies, books and members are referenced without database constraints
+    so that the history survives their deletion."""
+    REQUESTED = 'q'
+    LENT = 'l'
+    RENEWED = 'n'
+    RETURNED = 't'
+    RESERVED = 'h'
+    EVENT_TYPES = (
+        (REQUESTED, 'Borrow requested'),
+        (LENT, 'Lent'),
+        (RENEWED, 'Renewed'),
+        (RETURNED, 'Returned'),
+        (RESERVED, 'Reserved for a hold'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+
+    # Partition key of the table on PostgreSQL (see catalog/partitions.py)
+    created_at = models.DateTimeField(default=timezone.now)
+    event = models.CharField(max_length=1, choices=EVENT_TYPES)
+    book_instance = models.ForeignKey(BookInstance, on_delete=models.DO_NOTHING, db_constraint=False,
+                                      db_index=False, related_name='loan_events')
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                             null=True, related_name='loan_events')
+    borrower = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                                 null=True, related_name='loan_events')
+    due_back = models.DateField(null=True, blank=True)
+
+    objects = LoanEventQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['created_at']
+
+        # Every index leads with (or ends on) created_at, so a time bounded query stays inside the
+        # matching partitions and index ranges.
+        indexes = [
+            models.Index(fields=['created_at'], name='catalog_loanevent_created_idx'),
+            models.Index(fields=['book_instance', 'created_at'], name='catalog_loanevent_copy_idx'),
+            models.Index(fields=['borrower', 'created_at'], name='catalog_loanevent_member_idx'),
+        ]
+
+    def __str__(self):
+        return '{0} {1} ({2})'.format(self.created_at, self.get_event_display(), self.book_instance_id)
+
+
+class OutgoingEmailQuerySet(models.QuerySet):
+    """This queryset handles the email outbox: emails are queued by the views, in the same transaction
+    as the change they are about, and sent later on by the send_queued_email command"""
+    def enqueue(self, message):
+        """Queues the django.core.mail EmailMessage <message>, one outbox row per recipient"""
+        return self.bulk_create([
+            OutgoingEmail(subject=message.subject, body=message.body, content_subtype=message.content_subtype,
+                          from_email=message.from_email or '', to=recipient)
+            for recipient in message.to])
+
+    def pending(self):
+        return self.filter(sent_at__isnull=True, attempts__lt=OutgoingEmail.MAX_ATTEMPTS)
+
+    def due(self):
+        """Emails waiting to be sent whose next attempt is due, oldest first"""
+        return self.pending().filter(send_after__lte=timezone.now()).order_by('send_after', 'id')
+
+
+class OutgoingEmail(models.Model):
+    """Model of an email waiting in the outbox (or sent from it). An email that can't be sent is retried with
+    an exponential backoff (send_after is pushed back after every failure) up to MAX_ATTEMPTS times."""
+    MAX_ATTEMPTS = 5
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=20, default='plain')
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.EmailField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OutgoingEmailQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['created_at']
+
+        # The outbox worker only ever reads the emails not sent yet, which stay a tiny part of the table
+        indexes = [
+            models.Index(fields=['send_after', 'id'], name='catalog_outbox_pending_idx',
+                         condition=Q(sent_at__isnull=True)),
+        ]
+
+    def message(self, connection=None):
+        """Returns the EmailMessage to send for this email"""
+        message = EmailMessage(self.subject, self.body, to=[self.to], from_email=self.from_email or None,
+                               connection=connection)
+        message.content_subtype = self.content_subtype
+        return message
+
+    def __str__(self):
+        return '{0} ({1})'.format(self.subject, self.to)
+
+
+class CoverBlob(models.Model):
+    """Model of a cover file saved by the content addressed storage (see catalog/storage.py), with the number
+    of books using it. Files nobody has used since stored_at are deleted by the collect_covers command."""
+    name = models.CharField(max_length=100, primary_key=True)
+    size = models.PositiveIntegerField()
+    references = models.IntegerField(default=0)
+    # Last time the file was uploaded, a newly uploaded file is kept a while before a book refers to it
+    stored_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stored_at'], name='catalog_coverblob_unused_idx', condition=Q(references__lte=0)),
+        ]
+
+    def __str__(self):
+        return '{0} ({1} references)'.format(self.name, self.references)
+
+
 class AuthorManager(models.Manager):
     """This model handles every search query for the Author Model"""
     def search(self, query=None):
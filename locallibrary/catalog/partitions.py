@@ -0,0 +1,145 @@
+"""
+Monthly range partitioning of the loan event log (catalog_loanevent) on PostgreSQL.
+
+The parent table is partitioned on created_at, every month gets its own partition named
+catalog_loanevent_<yyyy>_<mm>, and a default partition catches rows for months that have no partition
+(yet). Queries bounded on created_at are pruned to the matching partitions, and archiving a month is a
+DETACH and DROP of its partition instead of a huge DELETE.
+
+Other databases (SQLite for local development) get a plain table, every function below is then a no-op.
+"""
+
+import datetime
+
+from django.db import transaction
+
+LOAN_EVENT_TABLE = 'catalog_loanevent'
+
+
+def is_partitioned(connection):
+    return connection.vendor == 'postgresql'
+
+
+def month_start(day):
+    return datetime.date(day.year, day.month, 1)
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """First instant of <month> and of the month after it, in UTC like the database connection"""
+    start = datetime.datetime(month.year, month.month, 1, tzinfo=datetime.timezone.utc)
+    end = next_month(month)
+    return start, datetime.datetime(end.year, end.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def partition_name(month):
+    return '{0}_{1:04d}_{2:02d}'.format(LOAN_EVENT_TABLE, month.year, month.month)
+
+
+def create_loan_event_table(schema_editor, model):
+    """Creates the loan event table, partitioned by month on PostgreSQL and as a plain table elsewhere"""
+    if not is_partitioned(schema_editor.connection):
+        schema_editor.create_model(model)
+        return
+
+    quote = schema_editor.quote_name
+    # The partition key has to be part of the primary key of a partitioned table.
+    schema_editor.execute(
+        'CREATE TABLE {table} ('
+        '{id} bigserial NOT NULL, '
+        '{created_at} timestamp with time zone NOT NULL, '
+        '{event} varchar(1) NOT NULL, '
+        '{book_instance_id} uuid NOT NULL, '
+        '{book_id} integer NULL, '
+        '{borrower_id} integer NULL, '
+        '{due_back} date NULL, '
+        'PRIMARY KEY ({id}, {created_at})'
+        ') PARTITION BY RANGE ({created_at})'.format(
+            table=quote(LOAN_EVENT_TABLE), id=quote('id'), created_at=quote('created_at'), event=quote('event'),
+            book_instance_id=quote('book_instance_id'), book_id=quote('book_id'), borrower_id=quote('borrower_id'),
+            due_back=quote('due_back')))
+    schema_editor.execute('CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(
+        quote(LOAN_EVENT_TABLE + '_default'), quote(LOAN_EVENT_TABLE)))
+    # Indexes created on the parent are created on every partition, present and future.
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+    create_month_partitions(schema_editor.connection, datetime.date.today(), 3)
+
+
+def create_month_partitions(connection, start, months):
+    """Creates the partitions for <months> months from the month of <start> on, skipping existing ones.
+    Returns the names of the partitions created"""
+    if not is_partitioned(connection):
+        return []
+    existing = set(month_partitions(connection))
+    created = []
+    month = month_start(start)
+    for _ in range(months):
+        name = partition_name(month)
+        if name not in existing:
+            create_month_partition(connection, month)
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def create_month_partition(connection, month):
+    """Creates the partition of <month>. PostgreSQL refuses to create a partition while the default
+    partition holds rows that belong in it, those rows are then moved to the new table before it is
+    attached, in one transaction."""
+    name = connection.ops.quote_name(partition_name(month))
+    table = connection.ops.quote_name(LOAN_EVENT_TABLE)
+    default = connection.ops.quote_name(LOAN_EVENT_TABLE + '_default')
+    bounds = list(month_bounds(month))
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM {0} WHERE created_at >= %s AND created_at < %s)'.format(
+            default), bounds)
+        if not cursor.fetchone()[0]:
+            cursor.execute('CREATE TABLE {0} PARTITION OF {1} FOR VALUES FROM (%s) TO (%s)'.format(name, table),
+                           bounds)
+            return
+        cursor.execute('CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(name, table))
+        cursor.execute(
+            'WITH moved AS (DELETE FROM {0} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+            'INSERT INTO {1} SELECT * FROM moved'.format(default, name), bounds)
+        # Attaching creates the partition's copies of the parent's indexes and primary key
+        cursor.execute('ALTER TABLE {0} ATTACH PARTITION {1} FOR VALUES FROM (%s) TO (%s)'.format(table, name),
+                       bounds)
+
+
+def month_partitions(connection):
+    """Names of the monthly partitions of the loan event table, oldest first"""
+    if not is_partitioned(connection):
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT child.relname FROM pg_inherits '
+            'JOIN pg_class parent ON pg_inherits.inhparent = parent.oid '
+            'JOIN pg_class child ON pg_inherits.inhrelid = child.oid '
+            'WHERE parent.relname = %s AND child.relname <> %s ORDER BY child.relname',
+            [LOAN_EVENT_TABLE, LOAN_EVENT_TABLE + '_default'])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def drop_month_partition(connection, month, expected_rows=None):
+    """Detaches and drops the partition of <month>. When <expected_rows> is given, the partition is locked
+    and only dropped if it holds exactly that many rows (the ones archived), so no row that isn't in the
+    archive is ever dropped with it. Returns False when the partition was not dropped (or doesn't exist)"""
+    name = partition_name(month)
+    if name not in month_partitions(connection):
+        return False
+    quoted_name = connection.ops.quote_name(name)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if expected_rows is not None:
+            # The lock keeps rows from being added (or removed) until the partition is dropped
+            cursor.execute('LOCK TABLE {0} IN ACCESS EXCLUSIVE MODE'.format(quoted_name))
+            cursor.execute('SELECT count(*) FROM {0}'.format(quoted_name))
+            if cursor.fetchone()[0] != expected_rows:
+                return False
+        cursor.execute('ALTER TABLE {0} DETACH PARTITION {1}'.format(
+            connection.ops.quote_name(LOAN_EVENT_TABLE), quoted_name))
+        cursor.execute('DROP TABLE {0}'.format(quoted_name))
+    return True
@@ -0,0 +1,68 @@
+"""
+Signal receivers of the catalog app, connected in CatalogConfig.ready().
+"""
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from .backends import invalidate_permissions, invalidate_user
+from .covers import set_cover_metadata
+from .models import LIBRARY_MEMBERS_GROUP_CACHE_KEY, Book, CoverBlob
+
+
+def permissions_changed(sender, action=None, **kwargs):
+    # m2m_changed is sent before and after every change, the cache only needs clearing once it is done
+    if action is None or action.startswith('post_'):
+        invalidate_permissions()
+
+
+def user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+def group_deleted(sender, instance, **kwargs):
+    if instance.pk == cache.get(LIBRARY_MEMBERS_GROUP_CACHE_KEY):
+        cache.delete(LIBRARY_MEMBERS_GROUP_CACHE_KEY)
+
+
+def count_cover_references(name, delta):
+    # Covers saved before the content addressed storage have no CoverBlob row and are simply not counted
+    if name:
+        CoverBlob.objects.filter(name=name).update(references=F('references') + delta)
+
+
+def book_saving(sender, instance, raw=False, **kwargs):
+    # Cover the saved row had before, the references only change when a book gets another cover
+    instance._previous_cover = ''
+    if instance.pk is not None:
+        previous = Book.objects.filter(pk=instance.pk).values_list('book_cover', flat=True).first()
+        instance._previous_cover = previous or ''
+    # The cover is only read when it is new or replaced, raw saves (loaddata) keep the fixture's values
+    if not raw and (not instance.book_cover._committed or instance.book_cover.name != instance._previous_cover):
+        set_cover_metadata(instance)
+
+
+def book_saved(sender, instance, **kwargs):
+    previous, current = getattr(instance, '_previous_cover', ''), instance.book_cover.name or ''
+    if previous != current:
+        count_cover_references(current, 1)
+        count_cover_references(previous, -1)
+
+
+def book_deleted(sender, instance, **kwargs):
+    count_cover_references(instance.book_cover.name, -1)
+
+
+def connect():
+    for through in (User.groups.through, User.user_permissions.through, Group.permissions.through):
+        m2m_changed.connect(permissions_changed, sender=through, dispatch_uid='catalog_permissions_changed')
+    for model in (Group, Permission):
+        post_delete.connect(permissions_changed, sender=model, dispatch_uid='catalog_permissions_deleted')
+    post_delete.connect(group_deleted, sender=Group, dispatch_uid='catalog_group_deleted')
+    post_save.connect(user_changed, sender=User, dispatch_uid='catalog_user_saved')
+    post_delete.connect(user_changed, sender=User, dispatch_uid='catalog_user_deleted')
+    pre_save.connect(book_saving, sender=Book, dispatch_uid='catalog_book_saving')
+    post_save.connect(book_saved, sender=Book, dispatch_uid='catalog_book_saved')
+    post_delete.connect(book_deleted, sender=Book, dispatch_uid='catalog_book_deleted')
@@ -0,0 +1,96 @@
+"""
+Content addressed storage of the book covers.
+
+A cover is saved under the SHA-256 digest of its bytes ("covers/3f/3f9a...c2.jpg") instead of the name it
+was uploaded with, so two different covers can never overwrite each other and the same image uploaded
+twice is stored once. The digest is worked out while the upload is streamed to a temporary file, which is
+then renamed into place, so a cover is never held in memory and a half written file is never visible.
+
+Every stored file has a CoverBlob row counting the books that use it (kept up to date by the signal
+receivers in catalog/signals.py). The collect_covers command deletes the files nobody uses any more.
+As the content of a name never changes, covers can be cached by browsers for good.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+# Directory, under MEDIA_ROOT, holding the content addressed files
+COVERS_DIRECTORY = 'covers'
+
+
+def blob_name(digest, extension):
+    # A level of sub directories keeps any single directory from growing to hundreds of thousands of files
+    return '{0}/{1}/{2}{3}'.format(COVERS_DIRECTORY, digest[:2], digest, extension.lower())
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage saving files under the digest of their content, see the module docstring"""
+
+    def get_available_name(self, name, max_length=None):
+        # The final name is only known once the content has been read, see _save()
+        return name
+
+    def _write_temporary(self, directory, content, digest=None):
+        """Streams <content> to a new temporary file in <directory>, updating <digest> along the way.
+        Returns the path of the file, which the caller renames into place or removes"""
+        os.makedirs(directory, exist_ok=True)
+        handle, temporary_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        with os.fdopen(handle, 'wb') as temporary:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                if digest is not None:
+                    digest.update(chunk)
+                temporary.write(chunk)
+        os.chmod(temporary_path, self.file_permissions_mode or 0o644)
+        return temporary_path
+
+    def _save(self, name, content):
+        from .models import CoverBlob
+
+        digest = hashlib.sha256()
+        temporary_path = self._write_temporary(self.path(COVERS_DIRECTORY), content, digest)
+        try:
+            name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+            # Touching the row first makes the upload wait for a collect_covers run deleting the same file,
+            # in which case the file is written again below
+            with transaction.atomic():
+                known = CoverBlob.objects.filter(name=name).update(stored_at=timezone.now())
+                if not known or not self.exists(name):
+                    os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                    os.replace(temporary_path, self.path(name))
+                    CoverBlob.objects.get_or_create(name=name, defaults={'size': os.path.getsize(self.path(name))})
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return name
+
+    def save_as(self, name, content):
+        """Saves <content> under exactly <name>, replacing any existing file. Used for the files derived
+        from a blob (the resized variants), whose names are just as immutable as the blob's"""
+        temporary_path = self._write_temporary(os.path.dirname(self.path(name)), content)
+        os.replace(temporary_path, self.path(name))
+        return name
+
+
+cover_storage = ContentAddressedStorage()
+
+
+class HashedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Storage of collectstatic (settings.STATICFILES_STORAGE). Every file is written under a name holding
+    a hash of its content (css/styles.3f9a6c2b1d4e.css) along with a .gz and, if Brotli is installed,
+    a .br compressed copy. WhiteNoise sends the smallest copy the browser accepts and tells it to keep the
+    hashed files for good, so a changed file simply gets a new URL.
+
+    A file missing from the manifest (collectstatic not run since it was added) is hashed when it is asked for
+    instead of breaking the page."""
+
+    manifest_strict = False
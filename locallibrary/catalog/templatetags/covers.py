@@ -0,0 +1,47 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from catalog.covers import PLACEHOLDER_COVER, VARIANT_FORMATS, cover_widths, variant_name, variants_ready
+
+register = template.Library()
+
+
+def srcset(book, extension):
+    storage = book.book_cover.storage
+    return ', '.join('{0} {1}w'.format(storage.url(variant_name(book.book_cover.name, width, extension)), width)
+                     for width in cover_widths())
+
+
+def size_attributes(book):
+    """width, height and placeholder color of the cover <img>, straight from the Book row. Browsers reserve the
+    room of the image from its width and height, so the page doesn't jump once the image has loaded"""
+    attributes = []
+    if book.cover_width and book.cover_height:
+        attributes += [('width', book.cover_width), ('height', book.cover_height)]
+    if book.cover_color:
+        attributes.append(('style', 'background-color: {0}'.format(book.cover_color)))
+    return format_html_join('', ' {0}="{1}"', attributes)
+
+
+@register.simple_tag
+def cover_image(book, sizes='100vw', css_class='', alt=''):
+    """Cover of <book> as a <picture>: WebP variants for the browsers that support them, JPEG ones otherwise,
+    <sizes> tells the browser how wide the image is shown so that it can pick a variant. Renders the
+    placeholder image until the variants have been made.
+
+    Usage: {% load covers %}{% cover_image book sizes="(min-width: 768px) 25vw, 100vw" css_class="card-img-top" %}
+    """
+    if not variants_ready(book):
+        return format_html('<img class="{0}" src="{1}" alt="{2}"{3}>', css_class, static(PLACEHOLDER_COVER), alt,
+                           size_attributes(book))
+    widths = cover_widths()
+    storage = book.book_cover.storage
+    # Every format but the last is offered as a <source>, the last one is the <img> fallback
+    sources = format_html_join('', '<source type="image/{0}" srcset="{1}" sizes="{2}">', (
+        (image_format.lower(), srcset(book, extension), sizes) for extension, image_format, _ in VARIANT_FORMATS[:-1]))
+    fallback = VARIANT_FORMATS[-1][0]
+    # Middle width as src, for the browsers that ignore srcset
+    src = storage.url(variant_name(book.book_cover.name, widths[len(widths) // 2], fallback))
+    return format_html('<picture>{0}<img class="{1}" src="{2}" srcset="{3}" sizes="{4}" alt="{5}"{6}></picture>',
+                       sources, css_class, src, srcset(book, fallback), sizes, alt, size_attributes(book))
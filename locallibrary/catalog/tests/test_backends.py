@@ -0,0 +1,122 @@
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.backends import CachedPermissionBackend, CachedUserBackend
+
+
+class CachedPermissionBackendTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedPermissionBackend()
+        self.librarian = User.objects.create(username='Librarian')
+        self.can_mark_returned = Permission.objects.get(codename='can_mark_returned')
+        self.can_renew = Permission.objects.get(codename='can_renew')
+        self.librarians = Group.objects.create(name='Librarians')
+        self.librarians.permissions.add(self.can_renew)
+        self.librarian.user_permissions.add(self.can_mark_returned)
+        self.librarian.groups.add(self.librarians)
+
+    def fresh_user(self):
+        # A new User object per "request", like the one the session middleware loads
+        return User.objects.get(pk=self.librarian.pk)
+
+    def test_permissions_looked_up_once_across_requests(self):
+        self.assertEquals(self.backend.get_all_permissions(self.fresh_user()),
+                          {'catalog.can_mark_returned', 'catalog.can_renew'})
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.backend.has_perm(user, 'catalog.can_renew'))
+            self.assertFalse(self.backend.has_perm(user, 'catalog.can_borrow'))
+
+    def test_user_permission_change_invalidates_cache(self):
+        self.backend.get_all_permissions(self.fresh_user())
+        self.librarian.user_permissions.remove(self.can_mark_returned)
+        self.assertFalse(self.backend.has_perm(self.fresh_user(), 'catalog.can_mark_returned'))
+
+    def test_group_permission_change_invalidates_cache(self):
+        self.backend.get_all_permissions(self.fresh_user())
+        self.librarians.permissions.clear()
+        self.assertFalse(self.backend.has_perm(self.fresh_user(), 'catalog.can_renew'))
+
+    def test_group_membership_change_invalidates_cache(self):
+        self.backend.get_all_permissions(self.fresh_user())
+        self.librarians.user_set.remove(self.librarian)
+        self.assertFalse(self.backend.has_perm(self.fresh_user(), 'catalog.can_renew'))
+
+    def test_group_deletion_invalidates_cache(self):
+        self.backend.get_all_permissions(self.fresh_user())
+        self.librarians.delete()
+        self.assertFalse(self.backend.has_perm(self.fresh_user(), 'catalog.can_renew'))
+
+    def test_inactive_user_has_no_permissions(self):
+        user = self.fresh_user()
+        user.is_active = False
+        self.assertEquals(self.backend.get_all_permissions(user), set())
+
+    def test_librarian_view_checks_permissions_without_queries(self):
+        self.client.force_login(self.librarian)
+        self.client.get(reverse('catalog:all-borrowed'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog:all-borrowed'))
+        self.assertEquals(response.status_code, 200)
+        self.assertFalse([query for query in queries.captured_queries if 'auth_permission' in query['sql']])
+
+
+@override_settings(AUTHENTICATION_BACKENDS=['catalog.backends.CachedUserBackend'],
+                   SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class CachedUserBackendTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.backend = CachedUserBackend()
+        self.member = User.objects.create(username='Member')
+        self.member.set_password('Wh1t3-Rabbit!')
+        self.member.save()
+        self.members = Group.objects.create(name='Library Members')
+        self.member.groups.add(self.members)
+
+    def test_user_loaded_once_with_its_groups(self):
+        self.backend.get_user(self.member.pk)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.member.pk)
+            self.assertEquals(list(user.groups.all()), [self.members])
+
+    def test_saving_user_invalidates_cache(self):
+        self.backend.get_user(self.member.pk)
+        self.member.first_name = 'Ada'
+        self.member.save()
+        self.assertEquals(self.backend.get_user(self.member.pk).first_name, 'Ada')
+
+    def test_group_change_invalidates_cache(self):
+        self.backend.get_user(self.member.pk)
+        self.member.groups.clear()
+        self.assertEquals(list(self.backend.get_user(self.member.pk).groups.all()), [])
+
+    def test_inactive_or_deleted_user_not_loaded(self):
+        self.backend.get_user(self.member.pk)
+        User.objects.filter(pk=self.member.pk).update(is_active=False)
+        self.member.refresh_from_db()
+        self.member.save()
+        self.assertIsNone(self.backend.get_user(self.member.pk))
+        self.member.delete()
+        self.assertIsNone(self.backend.get_user(self.member.pk))
+
+    def test_authenticated_page_view_skips_session_and_user_lookups(self):
+        self.client.login(username='Member', password='Wh1t3-Rabbit!')
+        self.client.get(reverse('catalog:book-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog:book-list'))
+        self.assertEquals(str(response.context['user']), 'Member')
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'django_session' in query['sql'] or 'FROM "auth_user"' in query['sql']])
+
+    def test_password_change_logs_other_sessions_out(self):
+        self.client.login(username='Member', password='Wh1t3-Rabbit!')
+        self.client.get(reverse('catalog:index'))
+        self.member.set_password('An0ther-Rabbit!')
+        self.member.save()
+        response = self.client.get(reverse('catalog:index'))
+        self.assertFalse(response.context['user'].is_authenticated)
@@ -0,0 +1,318 @@
+"""
+NOTE: Management commands are run with call_command(), their output is captured in a StringIO so that it can
+be checked and doesn't clutter the test run.
+"""
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth.models import Group
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from catalog import partitions
+from catalog.management.commands.send_overdue_notices import checkpoint_path
+from catalog.models import Author, Book, BookInstance, Genre, LoanEvent, LoanCounter, OutgoingEmail, User
+
+
+class ArchiveLoanEventsCommandTest(TestCase):
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+
+        borrower = User.objects.create(username='Borrower')
+        book = Book.objects.create(title='Book Title')
+        self.copy = BookInstance.objects.create(book=book, imprint='Imprint', borrower=borrower, status='o')
+        now = timezone.now()
+        self.old_event = LoanEvent.objects.create(created_at=now - datetime.timedelta(days=800),
+                                                  event=LoanEvent.LENT, book_instance_id=self.copy.pk)
+        self.recent_event = LoanEvent.objects.create(created_at=now, event=LoanEvent.RENEWED,
+                                                     book_instance_id=self.copy.pk)
+
+    def test_expired_months_are_archived_and_removed(self):
+        out = StringIO()
+        call_command('archive_loan_events', keep_months=24, archive_dir=self.archive_dir, stdout=out)
+        self.assertEquals(list(LoanEvent.objects.all()), [self.recent_event])
+
+        path = '{0}/loan-events-{1:%Y-%m}.jsonl.gz'.format(self.archive_dir, self.old_event.created_at)
+        with gzip.open(path, 'rt') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEquals(len(rows), 1)
+        self.assertEquals(rows[0]['id'], self.old_event.id)
+        self.assertEquals(rows[0]['event'], LoanEvent.LENT)
+        self.assertIn('archived 1 events', out.getvalue())
+
+    def test_rerun_never_overwrites_an_archive_file(self):
+        path = '{0}/loan-events-{1:%Y-%m}.jsonl.gz'.format(self.archive_dir, self.old_event.created_at)
+        with gzip.open(path, 'wt') as archive:
+            archive.write('{"id": 0}\n')
+        call_command('archive_loan_events', keep_months=24, archive_dir=self.archive_dir, stdout=StringIO())
+
+        with gzip.open(path, 'rt') as archive:
+            self.assertEquals(archive.read(), '{"id": 0}\n')
+        with gzip.open(path.replace('.jsonl.gz', '.2.jsonl.gz'), 'rt') as archive:
+            self.assertEquals([json.loads(line)['id'] for line in archive], [self.old_event.id])
+        self.assertEquals(list(LoanEvent.objects.all()), [self.recent_event])
+
+    @skipUnless(partitions.is_partitioned(connection), 'Only PostgreSQL partitions the loan event log')
+    def test_rows_in_the_default_partition_are_moved_to_a_new_partition(self):
+        month = datetime.date.today()
+        for _ in range(5):
+            month = partitions.next_month(month)
+        start = partitions.month_bounds(month)[0]
+        event = LoanEvent.objects.create(created_at=start, event=LoanEvent.LENT, book_instance_id=self.copy.pk)
+
+        out = StringIO()
+        call_command('archive_loan_events', create_ahead=6, archive_dir=self.archive_dir, stdout=out)
+        self.assertIn('Created partition {0}'.format(partitions.partition_name(month)), out.getvalue())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM {0}'.format(partitions.partition_name(month)))
+            self.assertEquals(cursor.fetchall(), [(event.id,)])
+            cursor.execute('SELECT count(*) FROM {0}_default'.format(partitions.LOAN_EVENT_TABLE))
+            self.assertEquals(cursor.fetchone(), (0,))
+
+    @skipUnless(partitions.is_partitioned(connection), 'Only PostgreSQL partitions the loan event log')
+    def test_partition_holding_rows_not_archived_is_kept(self):
+        month = partitions.month_start(self.old_event.created_at.date())
+        partitions.create_month_partitions(connection, month, 1)
+        self.assertFalse(partitions.drop_month_partition(connection, month, expected_rows=0))
+        self.assertTrue(LoanEvent.objects.filter(pk=self.old_event.pk).exists())
+        self.assertTrue(partitions.drop_month_partition(connection, month, expected_rows=1))
+        self.assertFalse(LoanEvent.objects.filter(pk=self.old_event.pk).exists())
+
+    def test_nothing_to_archive_within_retention_period(self):
+        out = StringIO()
+        call_command('archive_loan_events', keep_months=36, archive_dir=self.archive_dir, stdout=out)
+        self.assertEquals(LoanEvent.objects.count(), 2)
+        self.assertIn('No loan events older than', out.getvalue())
+
+
+class SendOverdueNoticesCommandTest(TestCase):
+    def setUp(self):
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint))
+
+        self.member_1 = User.objects.create(username='Member 1', first_name='Rachel', email='rachel@example.com')
+        self.member_2 = User.objects.create(username='Member 2', email='mike@example.com')
+        book = Book.objects.create(title='Book Title')
+        overdue = datetime.date.today() - datetime.timedelta(days=3)
+        for member in (self.member_1, self.member_1, self.member_2):
+            BookInstance.objects.create(book=book, imprint='Imprint', borrower=member, status='o', due_back=overdue)
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=self.member_2, status='o',
+                                    due_back=datetime.date.today() + datetime.timedelta(days=3))
+
+    def test_one_notice_per_member_listing_every_overdue_loan(self):
+        call_command('send_overdue_notices', checkpoint=self.checkpoint, batch_size=1, stdout=StringIO())
+        self.assertEquals(len(mail.outbox), 2)
+        self.assertEquals(mail.outbox[0].to, ['rachel@example.com'])
+        self.assertEquals(mail.outbox[0].body.count('Book Title'), 2)
+        self.assertIn('3 days overdue', mail.outbox[0].body)
+        self.assertEquals(mail.outbox[1].body.count('Book Title'), 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run_sends_nothing(self):
+        out = StringIO()
+        call_command('send_overdue_notices', checkpoint=self.checkpoint, dry_run=True, stdout=out)
+        self.assertEquals(len(mail.outbox), 0)
+        self.assertIn('Rendered 2 notices', out.getvalue())
+
+    def test_resume_skips_members_already_notified(self):
+        with open(self.checkpoint, 'w') as checkpoint:
+            checkpoint.write(str(self.member_1.pk))
+        call_command('send_overdue_notices', checkpoint=self.checkpoint, resume=True, stdout=StringIO())
+        self.assertEquals([message.to for message in mail.outbox], [['mike@example.com']])
+
+    def test_checkpoint_of_an_earlier_day_is_not_resumed(self):
+        yesterday = checkpoint_path(datetime.date.today() - datetime.timedelta(days=1))
+        with open(yesterday, 'w') as checkpoint:
+            checkpoint.write(str(self.member_1.pk))
+        self.addCleanup(os.remove, yesterday)
+        call_command('send_overdue_notices', resume=True, stdout=StringIO())
+        self.assertEquals(len(mail.outbox), 2)
+        self.assertFalse(os.path.exists(checkpoint_path(datetime.date.today())))
+
+
+class RecountLoansCommandTest(TestCase):
+    def test_counters_rebuilt_from_copies(self):
+        member = User.objects.create(username='Member')
+        book = Book.objects.create(title='Book Title')
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=member, status='o')
+        out = StringIO()
+        call_command('recount_loans', stdout=out)
+        self.assertIn('Recounted the loans of 1 members', out.getvalue())
+        self.assertEquals(LoanCounter.objects.get(user=member).on_loan, 1)
+
+
+class CalculateFinesCommandTest(TestCase):
+    def test_fines_reported(self):
+        member = User.objects.create(username='Member')
+        book = Book.objects.create(title='Book Title')
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=member, status='o',
+                                    due_back=datetime.date(2020, 6, 28))
+        out = StringIO()
+        call_command('calculate_fines', '--date', '2020-06-30', stdout=out)
+        self.assertIn('Fined 1 members 0.20 in total for 1 overdue loans', out.getvalue())
+        self.assertEquals(LoanCounter.objects.get(user=member).fines, Decimal('0.20'))
+
+
+class AddLibraryMembersCommandTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_active_users_added_once(self):
+        group = Group.objects.create(name='Library Members')
+        member = User.objects.create(username='Member')
+        member.groups.add(group)
+        User.objects.create(username='New member')
+        User.objects.create(username='Inactive', is_active=False)
+        out = StringIO()
+        call_command('add_library_members', '--batch-size', '1', stdout=out)
+        call_command('add_library_members', stdout=out)
+        self.assertIn('Added 1 users to the Library Members group', out.getvalue())
+        self.assertIn('Added 0 users to the Library Members group', out.getvalue())
+        self.assertEquals(sorted(group.user_set.values_list('username', flat=True)), ['Member', 'New member'])
+
+    def test_recreated_group_is_looked_up_again(self):
+        Group.objects.create(name='Library Members')
+        call_command('add_library_members', stdout=StringIO())
+        Group.objects.get(name='Library Members').delete()
+        group = Group.objects.create(name='Library Members')
+        User.objects.create(username='Member')
+        call_command('add_library_members', stdout=StringIO())
+        self.assertEquals(list(group.user_set.values_list('username', flat=True)), ['Member'])
+
+
+class FailingEmailBackend(EmailBackend):
+    """The locmem backend, refusing every email sent to refused@example.com"""
+    def send_messages(self, messages):
+        if any('refused@example.com' in message.to for message in messages):
+            raise ConnectionError('Recipient refused')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='catalog.tests.test_commands.FailingEmailBackend')
+class SendQueuedEmailCommandTest(TestCase):
+    def setUp(self):
+        for recipient in ('one@example.com', 'two@example.com', 'refused@example.com'):
+            OutgoingEmail.objects.enqueue(EmailMessage('Subject', 'Body', to=[recipient]))
+
+    def test_outbox_drained_in_batches(self):
+        out = StringIO()
+        call_command('send_queued_email', '--batch-size', '1', stdout=out)
+        self.assertIn('Sent 2 emails, 1 failed attempts', out.getvalue())
+        self.assertEquals(sorted(message.to[0] for message in mail.outbox), ['one@example.com', 'two@example.com'])
+        self.assertEquals(OutgoingEmail.objects.filter(sent_at__isnull=False).count(), 2)
+
+    def test_failed_email_retried_with_backoff(self):
+        call_command('send_queued_email', '--retry-delay', '60', stdout=StringIO())
+        email = OutgoingEmail.objects.get(to='refused@example.com')
+        self.assertEquals(email.attempts, 1)
+        self.assertEquals(email.last_error, 'Recipient refused')
+        self.assertGreater(email.send_after, timezone.now() + datetime.timedelta(seconds=50))
+
+        # Not due yet, so nothing is sent until the backoff is over
+        call_command('send_queued_email', stdout=StringIO())
+        self.assertEquals(OutgoingEmail.objects.get(pk=email.pk).attempts, 1)
+
+        OutgoingEmail.objects.filter(pk=email.pk).update(send_after=timezone.now())
+        call_command('send_queued_email', '--retry-delay', '60', stdout=StringIO())
+        email.refresh_from_db()
+        self.assertEquals(email.attempts, 2)
+        self.assertGreater(email.send_after, timezone.now() + datetime.timedelta(seconds=110))
+
+    def test_email_given_up_after_max_attempts(self):
+        OutgoingEmail.objects.filter(to='refused@example.com').update(attempts=OutgoingEmail.MAX_ATTEMPTS)
+        out = StringIO()
+        call_command('send_queued_email', stdout=out)
+        self.assertIn('Sent 2 emails, 0 failed attempts', out.getvalue())
+
+
+class ClearExpiredSessionsCommandTest(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        for number in range(7):
+            Session.objects.create(session_key='expired{0}'.format(number), session_data='e30:',
+                                   expire_date=now - datetime.timedelta(days=1))
+            Session.objects.create(session_key='current{0}'.format(number), session_data='e30:',
+                                   expire_date=now + datetime.timedelta(days=1))
+
+    def test_expired_sessions_deleted_in_batches(self):
+        out = StringIO()
+        call_command('clear_expired_sessions', batch_size=3, sleep=0, verbosity=2, stdout=out)
+        self.assertIn('Deleted 3 expired sessions, up to key expired2', out.getvalue())
+        self.assertIn('Deleted 7 expired sessions in 3 batches', out.getvalue())
+        self.assertEquals(sorted(Session.objects.values_list('session_key', flat=True)),
+                          ['current{0}'.format(number) for number in range(7)])
+
+
+# A TransactionTestCase runs after every TestCase, so the authors it creates don't move the ids the model tests
+# expect on PostgreSQL (whose sequences aren't rolled back)
+class ImportCatalogCommandTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.author = Author.objects.create(first_name='Chinua', last_name='Achebe')
+        self.genre = Genre.objects.create(name='Fiction')
+
+    def import_file(self, name, content, *args):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as file:
+            file.write(content)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import(self):
+        out, err = self.import_file('books.csv', (
+            'title,author,summary,isbn,language,genres\n'
+            'Things Fall Apart,"Achebe, Chinua",Okonkwo,9780385474542,English,Fiction|Classics\n'
+            'Arrow of God,"Achebe, Chinua",Ezeulu,9780385014809,English,Classics\n'
+            ',"Nobody, No",,,,\n'
+            'Half of a Yellow Sun,"Adichie, Chimamanda Ngozi",Biafra,9780007200283,English,Fiction\n'),
+            '--batch-size', '2')
+        self.assertIn('Imported 3 books (1 invalid rows skipped), created 1 authors, 1 languages and 1 genres', out)
+        self.assertIn('Line 4: no title', err)
+        book = Book.objects.get(title='Things Fall Apart')
+        self.assertEquals(book.author, self.author)
+        self.assertEquals(book.language.name, 'English')
+        self.assertEquals(sorted(book.genre.values_list('name', flat=True)), ['Classics', 'Fiction'])
+        self.assertEquals(Book.objects.get(title='Half of a Yellow Sun').author.first_name, 'Chimamanda Ngozi')
+        self.assertEquals(list(Book.objects.get(title='Arrow of God').genre.values_list('name', flat=True)),
+                          ['Classics'])
+
+    def test_gzipped_jsonl_import(self):
+        out, err = self.import_file('books.jsonl.gz', (
+            '{"title": "Anthills of the Savannah", "author": "Achebe, Chinua", "genres": ["Fiction", "Fiction"]}\n'
+            '\n'
+            'not json\n'
+            '{"title": "No Author"}\n'))
+        self.assertIn('Imported 2 books (1 invalid rows skipped), created 0 authors', out)
+        self.assertIn('Line 3:', err)
+        self.assertEquals(list(Book.objects.get(title='Anthills of the Savannah').genre.all()), [self.genre])
+        self.assertIsNone(Book.objects.get(title='No Author').author)
+
+    def test_json_values_of_the_wrong_type(self):
+        out, err = self.import_file('books.jsonl', (
+            '{"title": "Numbered", "isbn": 9780385474542}\n'
+            '{"title": "Bad Genre", "genres": ["Fiction", 3]}\n'
+            '{"title": "Bad Genres", "genres": {"name": "Fiction"}}\n'
+            '{"title": ["Not", "Text"]}\n'))
+        self.assertIn('Imported 1 books (3 invalid rows skipped)', out)
+        self.assertIn('Line 2: genres is not a list of names', err)
+        self.assertIn('Line 4: title is not text', err)
+        self.assertEquals(Book.objects.get(title='Numbered').isbn, '9780385474542')
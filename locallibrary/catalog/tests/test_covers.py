@@ -0,0 +1,150 @@
+import csv
+import os
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from catalog import covers
+from catalog.models import Book
+
+
+def cover_upload(name='cover.jpg', size=(800, 1200), image_format='JPEG', color=(200, 30, 30)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, image_format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(COVER_WIDTHS=(100, 200))
+class CoverVariantsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.book = Book.objects.create(title='Book Title', book_cover=cover_upload())
+
+    def render(self, book):
+        return Template('{% load covers %}{% cover_image book sizes="100px" %}').render(Context({'book': book}))
+
+    def test_variants_are_saved_next_to_the_cover(self):
+        self.assertTrue(covers.generate_variants(self.book))
+        name = self.book.book_cover.name
+        for width in (100, 200):
+            for extension in ('jpg', 'webp'):
+                path = os.path.join(self.media_root, covers.variant_name(name, width, extension))
+                with Image.open(path) as variant:
+                    self.assertEquals(variant.size, (width, width * 3 // 2))
+        self.assertEquals(Book.objects.get(pk=self.book.pk).cover_variants_of, name)
+
+    def test_small_covers_are_not_enlarged(self):
+        book = Book.objects.create(title='Small Cover', book_cover=cover_upload('small.png', (150, 150), 'PNG'))
+        covers.generate_variants(book)
+        path = os.path.join(self.media_root, covers.variant_name(book.book_cover.name, 200, 'webp'))
+        with Image.open(path) as variant:
+            self.assertEquals(variant.size, (150, 150))
+
+    def test_replaced_cover_needs_new_variants(self):
+        covers.generate_variants(self.book)
+        self.assertFalse(covers.books_needing_variants().exists())
+        self.book.book_cover = cover_upload('new_cover.jpg', color=(30, 30, 200))
+        self.book.save()
+        self.assertEquals(list(covers.books_needing_variants()), [self.book])
+
+    def test_cover_replaced_while_resizing_is_not_marked_ready(self):
+        Book.objects.filter(pk=self.book.pk).update(book_cover='None/other.jpg')
+        self.assertFalse(covers.generate_variants(self.book))
+        self.assertEquals(Book.objects.get(pk=self.book.pk).cover_variants_of, '')
+
+    def test_placeholder_until_variants_are_ready(self):
+        html = self.render(self.book)
+        self.assertRegex(html, r'images/cover-placeholder\.[0-9a-f]{12}\.svg')
+        self.assertNotIn('srcset', html)
+
+    def test_srcset_once_variants_are_ready(self):
+        covers.generate_variants(self.book)
+        html = self.render(self.book)
+        stem = os.path.splitext(self.book.book_cover.url)[0]
+        self.assertIn('<source type="image/webp" srcset="{0}.100w.webp 100w, {0}.200w.webp 200w" sizes="100px">'
+                      .format(stem), html)
+        self.assertIn('srcset="{0}.100w.jpg 100w, {0}.200w.jpg 200w"'.format(stem), html)
+        self.assertNotIn('placeholder', html)
+
+    def test_command_makes_missing_variants(self):
+        out, err = StringIO(), StringIO()
+        broken = Book.objects.create(title='Broken Cover',
+                                     book_cover=SimpleUploadedFile('broken.jpg', b'not an image'))
+        call_command('make_cover_variants', stdout=out, stderr=err)
+        self.assertIn('Made the variants of 1 covers, 1 failed', out.getvalue())
+        self.assertIn(broken.book_cover.name, err.getvalue())
+        self.assertEquals(list(covers.books_needing_variants()), [broken])
+
+    def test_command_goes_on_after_a_batch_that_all_failed(self):
+        # The first batch only holds self.book, whose cover file is missing
+        Book.objects.filter(pk=self.book.pk).update(book_cover='covers/missing.jpg')
+        good = Book.objects.create(title='Good Cover', book_cover=cover_upload('good.jpg', color=(30, 200, 30)))
+        out = StringIO()
+        call_command('make_cover_variants', '--batch-size', '1', stdout=out, stderr=StringIO())
+        self.assertIn('Made the variants of 1 covers, 1 failed', out.getvalue())
+        self.assertTrue(covers.variants_ready(Book.objects.get(pk=good.pk)))
+
+    def test_process_covers_uses_a_process_pool(self):
+        # Same image as self.book, the shared file is only processed once
+        same_cover = Book.objects.create(title='Same Cover', book_cover=cover_upload('other_name.jpg'))
+        broken = Book.objects.create(title='Broken Cover',
+                                     book_cover=SimpleUploadedFile('broken.jpg', b'not an image'))
+        timings = os.path.join(self.media_root, 'timings.csv')
+        out, err = StringIO(), StringIO()
+        call_command('process_covers', '--workers', '2', '--queue-size', '1', '--timings', timings,
+                     stdout=out, stderr=err)
+        self.assertIn('Processed 2 covers (1 failed)', out.getvalue())
+        self.assertIn(broken.book_cover.name, err.getvalue())
+        self.assertEquals(list(covers.books_needing_variants()), [broken])
+        self.assertTrue(covers.variants_ready(Book.objects.get(pk=same_cover.pk)))
+        with open(timings) as timings_file:
+            rows = list(csv.DictReader(timings_file))
+        self.assertEquals({row['cover']: row['books'] for row in rows},
+                          {self.book.book_cover.name: '2', broken.book_cover.name: '0'})
+
+    def test_cover_metadata_is_saved_with_the_cover(self):
+        self.assertEquals((self.book.cover_width, self.book.cover_height), (800, 1200))
+        self.assertEquals(self.book.cover_bytes, self.book.book_cover.size)
+        # The color needs the pixels, it is left to the variants worker
+        self.assertEquals(self.book.cover_color, '')
+        covers.generate_variants(self.book)
+        # JPEG is lossy, the color is only close to the one drawn
+        self.assertRegex(Book.objects.get(pk=self.book.pk).cover_color, r'^#c[89a]1[def]1[def]$')
+
+        self.book.book_cover = cover_upload('new_cover.png', (300, 200), 'PNG', color=(30, 30, 200))
+        self.book.save()
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEquals((book.cover_width, book.cover_height, book.cover_color), (300, 200, ''))
+
+    def test_only_the_header_is_read_when_saving_a_cover(self):
+        # The pixel data of this PNG is cut short, decoding it would fail
+        content = cover_upload('big.png', (4000, 3000), 'PNG').read()[:2000]
+        book = Book.objects.create(title='Big Cover', book_cover=SimpleUploadedFile('big.png', content))
+        self.assertEquals((book.cover_width, book.cover_height), (4000, 3000))
+
+    def test_size_and_color_are_rendered_without_opening_the_cover(self):
+        covers.generate_variants(self.book)
+        book = Book.objects.get(pk=self.book.pk)
+        with self.settings(MEDIA_ROOT='/nonexistent'):
+            html = self.render(book)
+        self.assertIn('width="800" height="1200" style="background-color: {0}"'.format(book.cover_color), html)
+
+    def test_backfill_cover_metadata(self):
+        same_cover = Book.objects.create(title='Same Cover', book_cover=self.book.book_cover.name)
+        Book.objects.update(cover_width=None, cover_height=None, cover_bytes=None, cover_color='')
+        out = StringIO()
+        call_command('backfill_cover_metadata', stdout=out)
+        self.assertIn('Read 1 covers (0 unreadable), updated 2 books', out.getvalue())
+        same_cover.refresh_from_db()
+        self.assertEquals(same_cover.cover_width, 800)
+        self.assertRegex(same_cover.cover_color, r'^#c[89a]1[def]1[def]$')
@@ -0,0 +1,48 @@
+import datetime
+from decimal import Decimal
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from catalog import fines
+from catalog.models import Book, BookInstance, LoanCounter, User
+
+
+class LoanFinesTest(SimpleTestCase):
+    def test_each_tier_charges_its_own_daily_rate(self):
+        tiers = ((1, 10), (8, 25), (29, 50))
+        # 7 days at 10, then 1 day at 25, then 21 days at 25 + 2 days at 50
+        self.assertEquals(fines.loan_fines([0, 7, 8, 30], tiers, cap=None).tolist(), [0, 70, 95, 70 + 525 + 100])
+
+    def test_fine_is_capped_per_loan(self):
+        self.assertEquals(fines.loan_fines([365], ((1, 10), ), cap=500).tolist(), [500])
+
+    def test_not_yet_overdue_loans_are_not_fined(self):
+        self.assertEquals(fines.loan_fines([-3], ((1, 10), ), cap=None).tolist(), [0])
+
+
+@override_settings(FINE_TIERS=((1, 10), ), MAX_FINE_PER_LOAN=None)
+class ApplyFinesTest(TestCase):
+    def setUp(self):
+        self.today = datetime.date(2020, 6, 30)
+        self.member_1 = User.objects.create(username='Member 1')
+        self.member_2 = User.objects.create(username='Member 2')
+        book = Book.objects.create(title='Book Title')
+        for member, days_overdue in ((self.member_1, 3), (self.member_1, 5), (self.member_2, 1), (self.member_2, -2)):
+            BookInstance.objects.create(book=book, imprint='Imprint', borrower=member, status='o',
+                                        due_back=self.today - datetime.timedelta(days=days_overdue))
+
+    def test_fines_summed_per_member(self):
+        members, cents, loans = fines.member_fines(self.today, chunk_size=2)
+        self.assertEquals(dict(zip(members.tolist(), cents.tolist())), {self.member_1.pk: 80, self.member_2.pk: 10})
+        self.assertEquals(loans, 3)
+
+    def test_fines_saved_on_loan_counters(self):
+        self.assertEquals(fines.apply_fines(self.today), (2, 90, 3))
+        self.assertEquals(LoanCounter.objects.get(user=self.member_1).fines, Decimal('0.80'))
+        self.assertEquals(LoanCounter.objects.get(user=self.member_2).fines, Decimal('0.10'))
+
+    def test_fines_cleared_once_nothing_is_overdue(self):
+        fines.apply_fines(self.today)
+        BookInstance.objects.filter(borrower=self.member_2).update(status='a', borrower=None, due_back=None)
+        fines.apply_fines(self.today)
+        self.assertEquals(LoanCounter.objects.get(user=self.member_2).fines, 0)
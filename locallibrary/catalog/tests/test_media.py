@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from catalog import media
+
+
+class MediaServeTest(SimpleTestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SERVE_MODE='django')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(self.media_root, 'covers', 'ab'))
+        with open(os.path.join(self.media_root, 'covers', 'ab', 'abcd.jpg'), 'wb') as cover:
+            cover.write(b'0123456789')
+
+    def get(self, path='covers/ab/abcd.jpg', **headers):
+        return media.serve(RequestFactory().get('/media/' + path, **headers), path)
+
+    def test_whole_file_is_a_file_response(self):
+        response = self.get()
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEquals(b''.join(response.streaming_content), b'0123456789')
+        self.assertEquals(response['Content-Type'], 'image/jpeg')
+        self.assertEquals(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_range_request(self):
+        response = self.get(HTTP_RANGE='bytes=2-5')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(b''.join(response.streaming_content), b'2345')
+        self.assertEquals(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEquals(response['Content-Length'], '4')
+
+    def test_open_and_suffix_ranges(self):
+        self.assertEquals(b''.join(self.get(HTTP_RANGE='bytes=7-').streaming_content), b'789')
+        self.assertEquals(b''.join(self.get(HTTP_RANGE='bytes=-3').streaming_content), b'789')
+        self.assertEquals(b''.join(self.get(HTTP_RANGE='bytes=8-100').streaming_content), b'89')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=20-30')
+        self.assertEquals(response.status_code, 416)
+        self.assertEquals(response['Content-Range'], 'bytes */10')
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='Thu, 01 Jan 1970 00:00:00 GMT')
+        self.assertEquals(response.status_code, 200)
+
+    def test_not_modified(self):
+        last_modified = self.get()['Last-Modified']
+        self.assertEquals(self.get(HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_files_outside_media_root_are_not_served(self):
+        for path in ('../etc/passwd', 'covers', 'covers/ab/missing.jpg'):
+            with self.assertRaises(Http404, msg=path):
+                self.get(path)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/')
+    def test_x_accel_redirect(self):
+        response = self.get()
+        self.assertEquals(response['X-Accel-Redirect'], '/protected-media/covers/ab/abcd.jpg')
+        self.assertEquals(response.content, b'')
+        self.assertEquals(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    @override_settings(MEDIA_SERVE_MODE='x-sendfile')
+    def test_x_sendfile(self):
+        response = self.get()
+        self.assertEquals(response['X-Sendfile'], os.path.join(self.media_root, 'covers', 'ab', 'abcd.jpg'))
+        self.assertEquals(response.content, b'')
@@ -4,11 +4,11 @@ the id dynamically, but for stand alone models with no dependency on other model
 """
 
 import datetime
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from catalog.models import Author, Genre, Book, BookInstance, Language, User
+from catalog.models import Author, Genre, Book, BookInstance, Language, User, Hold, LoanEvent, LoanCounter
 
 
 # Create your tests here
@@ -362,8 +362,187 @@ class BookInstanceModelTest(TestCase):
 
     def test_bookinstance_status_field_displays_choices(self):
         field_label = self.book_instance._meta.get_field('status').choices
-        self.assertEquals(field_label, (('m', 'Maintenance'), ('o', 'On Loan'), ('a', 'Available'), ('r', 'Reserved')))
+        self.assertEquals(field_label, (('m', 'Maintenance'), ('o', 'On Loan'), ('a', 'Available'), ('r', 'Reserved'),
+                                       ('p', 'Borrow Requested')))
 
     def test_bookinstance_status_default_choice(self):
         default_choice = self.book_instance._meta.get_field('status').default
         self.assertEquals(default_choice, 'a')
+
+    def test_bookinstance_id_is_time_ordered(self):
+        copies = [BookInstance.objects.create(book=self.book_instance.book, imprint='Imprint') for _ in range(3)]
+        self.assertTrue(all(copy.id.version == 7 for copy in copies))
+        self.assertEquals([copy.id for copy in copies], sorted(copy.id for copy in copies))
+
+    @override_settings(TIME_ORDERED_COPY_IDS=False)
+    def test_bookinstance_id_is_random_when_time_ordered_ids_are_off(self):
+        copy = BookInstance.objects.create(book=self.book_instance.book, imprint='Imprint')
+        self.assertEquals(copy.id.version, 4)
+
+
+class BookInstanceQuerySetTest(TestCase):
+    def setUp(self):
+        self.borrower = User.objects.create(username='Borrower')
+        self.book = Book.objects.create(title='Book Title')
+        self.overdue = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', borrower=self.borrower, status='o',
+            due_back=datetime.date.today() - datetime.timedelta(days=1))
+        self.due_later = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', borrower=self.borrower, status='o',
+            due_back=datetime.date.today() + datetime.timedelta(days=10))
+
+    def test_overdue_selects_only_loans_past_due(self):
+        self.assertEquals(list(BookInstance.objects.overdue()), [self.overdue])
+
+    def test_due_within_includes_overdue_loans(self):
+        self.assertEquals(BookInstance.objects.due_within(3).count(), 1)
+        self.assertEquals(BookInstance.objects.due_within(10).count(), 2)
+
+    def test_renew_never_shortens_a_loan(self):
+        renewal_date = datetime.date.today() + datetime.timedelta(days=5)
+        self.assertEquals(BookInstance.objects.on_loan().renew(renewal_date), [self.overdue.pk])
+        self.due_later.refresh_from_db()
+        self.assertEquals(self.due_later.due_back, datetime.date.today() + datetime.timedelta(days=10))
+
+    def test_renew_logs_one_event_per_renewed_loan(self):
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        BookInstance.objects.on_loan().renew(renewal_date, batch_size=1)
+        events = LoanEvent.objects.filter(event=LoanEvent.RENEWED)
+        self.assertEquals(sorted(event.book_instance_id for event in events),
+                          sorted([self.overdue.pk, self.due_later.pk]))
+        self.assertTrue(all(event.due_back == renewal_date for event in events))
+
+    def test_renew_rejects_date_outside_renewal_period(self):
+        with self.assertRaises(ValueError):
+            BookInstance.objects.overdue().renew(datetime.date.today() + datetime.timedelta(weeks=3))
+
+    def test_with_days_overdue_is_computed_by_the_database(self):
+        copy = BookInstance.objects.with_days_overdue().get(pk=self.overdue.pk)
+        self.assertEquals(copy.days_overdue, datetime.timedelta(days=1))
+        self.assertTrue(copy.is_overdue)
+
+    def test_overdue_by_member_aggregates_per_borrower(self):
+        BookInstance.objects.create(
+            book=self.book, imprint='Imprint', borrower=self.borrower, status='o',
+            due_back=datetime.date.today() - datetime.timedelta(days=4))
+        members = list(BookInstance.objects.overdue_by_member())
+        self.assertEquals(len(members), 1)
+        self.assertEquals(members[0]['overdue_loans'], 2)
+        self.assertEquals(members[0]['max_days_overdue'], datetime.timedelta(days=4))
+
+    def test_due_back_counts_groups_loans_by_day(self):
+        today = datetime.date.today()
+        BookInstance.objects.create(book=self.book, imprint='Imprint', borrower=self.borrower, status='o',
+                                    due_back=today + datetime.timedelta(days=10))
+        BookInstance.objects.create(book=self.book, imprint='Imprint', status='a',
+                                    due_back=today + datetime.timedelta(days=10))
+        counts = BookInstance.objects.due_back_counts(today, today + datetime.timedelta(weeks=2))
+        self.assertEquals(counts, {today + datetime.timedelta(days=10): 2})
+
+    def test_borrow_requests_are_neither_available_nor_on_loan(self):
+        available = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+        requested = BookInstance.objects.create(
+            book=self.book, imprint='Imprint', borrower=self.borrower, status='p',
+            due_back=datetime.date.today() + datetime.timedelta(weeks=1))
+        self.assertEquals(list(BookInstance.objects.available()), [available])
+        self.assertEquals(list(BookInstance.objects.requested()), [requested])
+        self.assertNotIn(requested, BookInstance.objects.on_loan())
+
+
+class LoanCounterQuerySetTest(TestCase):
+    def setUp(self):
+        self.member = User.objects.create(username='Member')
+
+    @override_settings(MAX_LOANS_PER_MEMBER=2)
+    def test_request_borrow_stops_at_the_limit(self):
+        self.assertTrue(LoanCounter.objects.request_borrow(self.member))
+        LoanCounter.objects.move(self.member.pk, 'p', 'o')
+        self.assertTrue(LoanCounter.objects.request_borrow(self.member))
+        self.assertFalse(LoanCounter.objects.request_borrow(self.member))
+        counter = LoanCounter.objects.get(user=self.member)
+        self.assertEquals((counter.on_loan, counter.requested), (1, 1))
+
+    def test_move_never_counts_below_zero(self):
+        LoanCounter.objects.create(user=self.member)
+        LoanCounter.objects.move(self.member.pk, 'o', 'a')
+        self.assertEquals(LoanCounter.objects.get(user=self.member).on_loan, 0)
+
+    def test_recount_rebuilds_counters_from_copies(self):
+        book = Book.objects.create(title='Book Title')
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=self.member, status='o')
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=self.member, status='p')
+        BookInstance.objects.create(book=book, imprint='Imprint', borrower=self.member, status='r')
+        LoanCounter.objects.create(user=self.member, on_loan=7)
+        self.assertEquals(LoanCounter.objects.recount(), 1)
+        counter = LoanCounter.objects.get(user=self.member)
+        self.assertEquals((counter.on_loan, counter.requested, counter.total), (1, 1, 2))
+
+
+class HoldQuerySetTest(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Book Title')
+        self.members = [User.objects.create(username='Member {0}'.format(i)) for i in range(3)]
+        self.holds = [Hold.objects.place(self.book, member) for member in self.members]
+        self.copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+    def test_next_in_line_is_first_hold_placed(self):
+        self.assertEquals(Hold.objects.next_in_line(self.book), self.holds[0])
+
+    def test_position_counts_only_waiting_holds_ahead(self):
+        self.assertEquals([Hold.objects.position(hold) for hold in self.holds], [1, 2, 3])
+        Hold.objects.fulfil_next(self.copy)
+        self.assertEquals(Hold.objects.position(self.holds[2]), 2)
+
+    def test_holds_are_numbered_per_book(self):
+        self.assertEquals([hold.seq for hold in self.holds], [1, 2, 3])
+        other_book = Book.objects.create(title='Other Title')
+        self.assertEquals(Hold.objects.place(other_book, self.members[0]).seq, 1)
+
+    def test_position_is_one_lookup_whatever_the_place_in_the_queue(self):
+        with self.assertNumQueries(1):
+            self.assertEquals(Hold.objects.position(self.holds[2]), 3)
+
+    def test_position_after_a_hold_left_the_middle_of_the_queue(self):
+        self.holds[1].delete()
+        self.assertEquals(Hold.objects.position(self.holds[2]), 2)
+        self.assertEquals(Hold.objects.place(self.book, self.members[1]).seq, 4)
+        self.assertEquals(Hold.objects.position(Hold.objects.get(seq=4)), 3)
+
+    def test_no_position_once_the_hold_is_fulfilled(self):
+        Hold.objects.fulfil_next(self.copy)
+        self.assertIsNone(Hold.objects.position(self.holds[0]))
+
+    def test_fulfil_next_reserves_copy_for_head_of_queue(self):
+        hold = Hold.objects.fulfil_next(self.copy)
+        self.assertEquals(hold, self.holds[0])
+        self.copy.refresh_from_db()
+        self.assertEquals(self.copy.status, 'r')
+        self.assertEquals(self.copy.borrower, self.members[0])
+        self.assertEquals(Hold.objects.next_in_line(self.book), self.holds[1])
+
+    def test_fulfil_next_logs_reservation(self):
+        Hold.objects.fulfil_next(self.copy)
+        event = LoanEvent.objects.get()
+        self.assertEquals(event.event, LoanEvent.RESERVED)
+        self.assertEquals(event.borrower, self.members[0])
+
+    def test_fulfil_next_without_waiting_holds(self):
+        Hold.objects.all().delete()
+        self.assertIsNone(Hold.objects.fulfil_next(self.copy))
+        self.copy.refresh_from_db()
+        self.assertEquals(self.copy.status, 'a')
+
+
+class LoanEventQuerySetTest(TestCase):
+    def setUp(self):
+        self.copy = BookInstance.objects.create(book=Book.objects.create(title='Book Title'), imprint='Imprint')
+        self.old_event = LoanEvent.objects.create(created_at=timezone.now() - datetime.timedelta(days=60),
+                                                  event=LoanEvent.LENT, book_instance_id=self.copy.pk)
+        self.new_event = LoanEvent.objects.record(self.copy, LoanEvent.RETURNED)
+
+    def test_recent_only_returns_events_in_time_window(self):
+        self.assertEquals(list(LoanEvent.objects.recent(days=30)), [self.new_event])
+
+    def test_history_survives_copy_deletion(self):
+        self.copy.delete()
+        self.assertEquals(LoanEvent.objects.count(), 2)
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book
+
+
+class PublicReadMiddlewareTest(TestCase):
+    def setUp(self):
+        author = Author.objects.create(first_name='John', last_name='Obioma')
+        self.book = Book.objects.create(title='Book Title', summary='Book Summary', isbn='7798uj', author=author,
+                                        book_cover='book_covers/cover.jpg')
+
+    def public_urls(self):
+        return [
+            reverse('catalog:book-list'),
+            reverse('catalog:book-detail', kwargs={'pk': self.book.pk}),
+            reverse('catalog:author-list'),
+            reverse('catalog:search') + '?q=Book',
+        ]
+
+    def test_anonymous_public_pages_set_no_cookie(self):
+        for url in self.public_urls():
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200, url)
+            self.assertNotIn('Set-Cookie', str(response.serialize_headers()), url)
+            self.assertFalse(response.cookies, url)
+            self.assertNotIn('Cookie', response.get('Vary', ''), url)
+            self.assertIn('public', response['Cache-Control'], url)
+
+    def test_index_still_uses_the_session(self):
+        response = self.client.get(reverse('catalog:index'))
+        self.assertIn('sessionid', response.cookies)
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+
+    def test_anonymous_visitor_with_a_session_cookie_gets_public_page(self):
+        self.client.get(reverse('catalog:index'))
+        response = self.client.get(reverse('catalog:book-list'))
+        self.assertFalse(response.cookies)
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_logged_in_user_pages_not_public(self):
+        self.client.force_login(User.objects.create(username='Member'))
+        response = self.client.get(reverse('catalog:book-list'))
+        self.assertNotIn('public', response.get('Cache-Control', ''))
+        self.assertIn('Cookie', response['Vary'])
@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class HashedStaticFilesStorageTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Compressing the admin files takes a while, they are collected once for the whole class
+        cls.static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.static_root)
+        settings_override = override_settings(STATIC_ROOT=cls.static_root,
+                                              STATICFILES_STORAGE='catalog.storage.HashedStaticFilesStorage')
+        settings_override.enable()
+        cls.addClassCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0, stdout=StringIO())
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        name = staticfiles_storage.stored_name('css/styles.css')
+        self.assertRegex(name, r'^css/styles\.[0-9a-f]{12}\.css$')
+        for suffix in ('', '.gz', '.br'):
+            self.assertTrue(os.path.exists(os.path.join(self.static_root, name + suffix)), name + suffix)
+
+    def test_file_missing_from_the_manifest_is_hashed_on_demand(self):
+        path = os.path.join(self.static_root, 'css', 'not-collected.css')
+        with open(path, 'w') as static_file:
+            static_file.write('body { margin: 0; }')
+        self.addCleanup(os.remove, path)
+        self.assertRegex(staticfiles_storage.stored_name('css/not-collected.css'),
+                         r'^css/not-collected\.[0-9a-f]{12}\.css$')
+
+    def test_compressed_copy_is_served_for_good(self):
+        url = staticfiles_storage.url('css/styles.css')
+        middleware = WhiteNoiseMiddleware(lambda request: HttpResponse(status=404))
+        for accept_encoding, encoding in (('gzip, deflate, br', 'br'), ('gzip', 'gzip')):
+            response = middleware(RequestFactory().get(url, HTTP_ACCEPT_ENCODING=accept_encoding))
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(response['Content-Encoding'], encoding)
+            self.assertIn('immutable', response['Cache-Control'])
+            response.close()
@@ -0,0 +1,93 @@
+import datetime
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from catalog import media
+from catalog.covers import variant_name
+from catalog.models import Book, CoverBlob
+from catalog.storage import cover_storage
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def book(self, title, content, filename='cover.jpg'):
+        return Book.objects.create(title=title, book_cover=SimpleUploadedFile(filename, content))
+
+    def references(self, book):
+        return CoverBlob.objects.get(name=book.book_cover.name).references
+
+    def test_same_content_is_stored_once(self):
+        book_1 = self.book('Book 1', b'same image', 'first.JPG')
+        book_2 = self.book('Book 2', b'same image', 'second.jpg')
+        self.assertEquals(book_1.book_cover.name, book_2.book_cover.name)
+        self.assertRegex(book_1.book_cover.name, r'^covers/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEquals(self.references(book_1), 2)
+        files = [name for _, _, names in os.walk(self.media_root) for name in names]
+        self.assertEquals(files, [os.path.basename(book_1.book_cover.name)])
+
+    def test_same_filename_does_not_clash(self):
+        book_1 = self.book('Book 1', b'first image')
+        book_2 = self.book('Book 2', b'second image')
+        self.assertNotEqual(book_1.book_cover.name, book_2.book_cover.name)
+        with book_1.book_cover.open('rb') as cover:
+            self.assertEquals(cover.read(), b'first image')
+
+    def test_references_follow_the_books(self):
+        book = self.book('Book 1', b'first image')
+        first_cover = book.book_cover.name
+        book.book_cover = SimpleUploadedFile('cover.jpg', b'second image')
+        book.save()
+        self.assertEquals(CoverBlob.objects.get(name=first_cover).references, 0)
+        self.assertEquals(self.references(book), 1)
+        book.title = 'New Title'
+        book.save()
+        self.assertEquals(self.references(book), 1)
+        book.delete()
+        self.assertEquals(CoverBlob.objects.get(name=book.book_cover.name).references, 0)
+
+    def test_collect_covers_deletes_unused_files_after_the_grace_period(self):
+        used = self.book('Book 1', b'used image')
+        unused = self.book('Book 2', b'unused image')
+        recent = self.book('Book 3', b'recent image')
+        variant = variant_name(unused.book_cover.name, 160, 'webp')
+        cover_storage.save_as(variant, SimpleUploadedFile('variant.webp', b'variant'))
+        Book.objects.filter(pk__in=[unused.pk, recent.pk]).delete()
+        CoverBlob.objects.exclude(name=recent.book_cover.name).update(
+            stored_at=timezone.now() - datetime.timedelta(days=2))
+
+        out = StringIO()
+        call_command('collect_covers', stdout=out)
+        self.assertIn('Deleted 1 unused cover files', out.getvalue())
+        self.assertFalse(cover_storage.exists(unused.book_cover.name))
+        self.assertFalse(cover_storage.exists(variant))
+        self.assertTrue(cover_storage.exists(used.book_cover.name))
+        self.assertTrue(cover_storage.exists(recent.book_cover.name))
+        self.assertEquals(set(CoverBlob.objects.values_list('name', flat=True)),
+                          {used.book_cover.name, recent.book_cover.name})
+
+    def test_recount(self):
+        book = self.book('Book 1', b'image')
+        CoverBlob.objects.update(references=0, stored_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('collect_covers', '--recount', stdout=StringIO())
+        self.assertEquals(self.references(book), 1)
+        self.assertTrue(cover_storage.exists(book.book_cover.name))
+
+    def test_covers_are_served_as_immutable(self):
+        # The media URLs are only routed with DEBUG on, so the view is called directly
+        book = self.book('Book 1', b'image')
+        response = media.serve(RequestFactory().get(book.book_cover.url), book.book_cover.name)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
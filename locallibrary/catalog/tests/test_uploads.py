@@ -0,0 +1,77 @@
+import struct
+import zlib
+from io import BytesIO
+
+from django.core.files.uploadedfile import InMemoryUploadedFile, SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from PIL import Image
+
+from catalog.forms import CoverImageField
+from catalog.uploads import CoverUpload
+
+
+def image_bytes(image_format='PNG', size=(300, 450)):
+    buffer = BytesIO()
+    Image.new('RGB', size, (10, 120, 60)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def png_bomb(width, height):
+    """Small PNG claiming to be <width> x <height>, its pixel data (zeros) would only take that much
+    memory once decoded"""
+    return (b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            png_chunk(b'IDAT', zlib.compress(b'\0' * 100000)) + png_chunk(b'IEND', b''))
+
+
+class CoverUploadHandlerTest(SimpleTestCase):
+    def upload(self, content, name='cover.png', field='book_cover'):
+        request = RequestFactory().post('/catalog/book/create/', {field: SimpleUploadedFile(name, content)})
+        return request.FILES[field]
+
+    def test_cover_is_streamed_to_disk_and_checked(self):
+        cover = self.upload(image_bytes())
+        self.assertIsInstance(cover, CoverUpload)
+        self.assertTrue(cover.temporary_file_path())
+        self.assertIsNone(cover.upload_error)
+        self.assertEquals((cover.image_format, cover.image_size), ('PNG', (300, 450)))
+        self.assertEquals(cover.read(), image_bytes())
+
+    def test_other_fields_keep_the_default_handlers(self):
+        self.assertIsInstance(self.upload(b'some text', 'notes.txt', field='attachment'), InMemoryUploadedFile)
+
+    @override_settings(COVER_UPLOAD_MAX_BYTES=1000)
+    def test_too_big_upload_is_cut_off(self):
+        cover = self.upload(image_bytes('BMP'))
+        self.assertIn('too big', cover.upload_error)
+        self.assertEquals(cover.size, 0)
+        self.assertEquals(cover.read(), b'')
+
+    @override_settings(COVER_MAX_PIXELS=1000 * 1000)
+    def test_too_many_pixels_are_rejected_from_the_header(self):
+        self.assertIn('at most 1 megapixels', self.upload(png_bomb(2000, 1000)).upload_error)
+
+    def test_decompression_bomb_is_rejected_before_decoding(self):
+        self.assertIn('too many pixels', self.upload(png_bomb(100000, 100000)).upload_error)
+
+    def test_formats_not_accepted_are_rejected(self):
+        self.assertIn('TIFF images are not accepted', self.upload(image_bytes('TIFF'), 'scan.tif').upload_error)
+
+    def test_not_an_image(self):
+        self.assertIn('Upload a valid image', self.upload(b'not an image' * 100).upload_error)
+
+
+class CoverImageFieldTest(SimpleTestCase):
+    def test_handler_error_is_a_validation_error(self):
+        request = RequestFactory().post('/', {'book_cover': SimpleUploadedFile('scan.tif', image_bytes('TIFF'))})
+        with self.assertRaisesMessage(Exception, 'TIFF images are not accepted'):
+            CoverImageField().clean(request.FILES['book_cover'])
+
+    def test_files_built_in_code_get_the_same_checks(self):
+        cover = CoverImageField().clean(SimpleUploadedFile('cover.jpg', image_bytes('JPEG')))
+        self.assertEquals(cover.content_type, 'image/jpeg')
+        with self.assertRaisesMessage(Exception, 'Upload a valid image'):
+            CoverImageField().clean(SimpleUploadedFile('cover.jpg', b'not an image'))
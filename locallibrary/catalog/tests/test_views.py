@@ -10,12 +10,69 @@ book_update
 import datetime
 import uuid
 
-from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.contrib.auth.models import User, Permission, Group
+from django.core import mail
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
 from django.utils import timezone
 
-from locallibrary.catalog.models import Author, Genre, Language, BookInstance, Book
+from locallibrary.catalog.forms import LibrarianBulkCreateBookCopyForm
+from locallibrary.catalog.tokens import user_tokenizer
+from locallibrary.catalog.models import Author, Genre, Language, BookInstance, Book, Hold, LoanEvent, LoanCounter, \
+    OutgoingEmail
+from locallibrary.catalog.views import CopyOfBookBulkCreateView
+
+
+class SignUpViewTest(TestCase):
+    def test_confirmation_email_queued_not_sent(self):
+        response = self.client.post(reverse('catalog:signup'), data={
+            'first_name': 'Ada', 'last_name': 'Obi', 'username': 'ada', 'email': 'ada@example.com',
+            'password1': 'Wh1t3-Rabbit!', 'password2': 'Wh1t3-Rabbit!'})
+        self.assertTemplateUsed(response, 'catalog/signup_redirect.html')
+        self.assertEquals(len(mail.outbox), 0)
+        email = OutgoingEmail.objects.get()
+        self.assertEquals(email.to, 'ada@example.com')
+        self.assertEquals(email.content_subtype, 'html')
+        self.assertIn(reverse('catalog:confirm_email', kwargs={
+            'user_id': urlsafe_base64_encode(force_bytes(User.objects.get(username='ada').pk)),
+            'token': user_tokenizer.make_token(User.objects.get(username='ada'))}), email.body)
+
+    def test_invalid_signup_queues_nothing(self):
+        response = self.client.post(reverse('catalog:signup'), data={'username': 'ada'})
+        self.assertTemplateUsed(response, 'catalog/signup.html')
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+
+class ConfirmRegistrationViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(name='Library Members')
+        for number in range(5):
+            User.objects.create(username='Member {0}'.format(number))
+
+    def confirm_url(self, user):
+        return reverse('catalog:confirm_email', kwargs={
+            'user_id': urlsafe_base64_encode(force_bytes(user.pk)), 'token': user_tokenizer.make_token(user)})
+
+    def test_only_confirming_user_joins_library_members(self):
+        user = User.objects.create(username='New member', is_active=False)
+        response = self.client.get(self.confirm_url(user))
+        self.assertTemplateUsed(response, 'catalog/signup_complete_after_confirm_email.html')
+        self.assertEquals(list(self.group.user_set.all()), [user])
+        self.assertTrue(User.objects.get(pk=user.pk).is_active)
+
+    def test_confirmation_runs_constant_number_of_queries(self):
+        # Warm the cached group lookup, so that every confirmation below has the same cost
+        self.client.get(self.confirm_url(User.objects.create(username='First', is_active=False)))
+        for number in range(20):
+            User.objects.create(username='Active {0}'.format(number))
+        user = User.objects.create(username='New member', is_active=False)
+        # Fetch and save the user, then look up and insert the membership, however many users there are
+        with self.assertNumQueries(4):
+            self.client.get(self.confirm_url(user))
 
 
 class AuthorListViewTest(TestCase):
@@ -360,6 +417,14 @@ class LoanedBookInstanceByUserListViewTest(TestCase):
                 self.assertTrue(last_date <= book.due_back)
                 last_date = book.due_back
 
+    def test_counts_come_from_loan_counter(self):
+        LoanCounter.objects.create(user=self.test_user1, on_loan=3, requested=1)
+        self.client.force_login(self.test_user1)
+        response = self.client.get(reverse('catalog:my-borrowed'))
+        self.assertEquals(response.context['loan_counter'].on_loan, 3)
+        self.assertContains(response, 'On loan: 3, waiting for approval: 1')
+        self.assertContains(response, 'My Borrowed (3)')
+
 
 class AllLoanedBooksLibrarianListViewTest(TestCase):
     def setUp(self):
@@ -476,6 +541,105 @@ class AllLoanedBooksLibrarianListViewTest(TestCase):
         self.assertEquals(book_count_user_2, 16)
 
 
+class OverdueReportLibrarianListViewTest(TestCase):
+    def setUp(self):
+        self.user_1 = User.objects.create(username='User 1', password='Grjhjhj7')
+        self.user_2 = User.objects.create(username='User 2', password='Gtrhjhjh7')
+        self.test_librarian = User.objects.create(username='Librarian', password='12Thyr^')
+
+        permission = Permission.objects.get(name='Set book as returned')
+        self.test_librarian.user_permissions.add(permission)
+
+        test_book = Book.objects.create(title='Book Title', summary='Book Summary', isbn='7798uj')
+
+        # 12 overdue copies, 11 for user_1 and one (the longest overdue) for user_2
+        for days in range(1, 12):
+            BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint', borrower=self.user_1,
+                                        status='o', due_back=datetime.date.today() - datetime.timedelta(days=days))
+        self.longest_overdue = BookInstance.objects.create(
+            book=test_book, imprint='Unlikely Imprint', borrower=self.user_2, status='o',
+            due_back=datetime.date.today() - datetime.timedelta(days=30))
+        BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint', borrower=self.user_2,
+                                    status='o', due_back=datetime.date.today())
+
+    def test_that_non_permitted_users_cant_access_this_view(self):
+        self.client.force_login(self.user_1)
+        response = self.client.get(reverse('catalog:overdue-report'))
+        self.assertEquals(response.status_code, 403)
+
+    def test_correct_template_used(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:overdue-report'))
+        self.assertEquals(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/librarian_overdue_report.html')
+
+    def test_list_is_ordered_by_days_overdue_and_paginated(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:overdue-report'))
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEquals(len(response.context['bookinstance_list']), 10)
+        self.assertEquals(response.context['bookinstance_list'][0], self.longest_overdue)
+        days_overdue = [copy.days_overdue for copy in response.context['bookinstance_list']]
+        self.assertEquals(days_overdue, sorted(days_overdue, reverse=True))
+
+        response = self.client.get(reverse('catalog:overdue-report') + '?page=2')
+        # The copy due back today is not overdue yet
+        self.assertEquals(len(response.context['bookinstance_list']), 2)
+
+    def test_member_aggregates_for_members_on_page(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:overdue-report'))
+        members = {member['borrower__username']: member for member in response.context['member_list']}
+        self.assertEquals(members['User 1']['overdue_loans'], 11)
+        self.assertEquals(members['User 2']['overdue_loans'], 1)
+        self.assertEquals(members['User 2']['max_days_overdue'], datetime.timedelta(days=30))
+
+
+class DueDateCalendarLibrarianViewTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.test_user = User.objects.create(username='User', password='12336')
+        self.test_librarian = User.objects.create(username='Librarian', password='yuhghnjm')
+        permission = Permission.objects.get(name='Set book as returned')
+        self.test_librarian.user_permissions.add(permission)
+
+        self.today = datetime.date.today()
+        self.monday = self.today - datetime.timedelta(days=self.today.weekday())
+        test_book = Book.objects.create(title='Book Title', summary='Book Summary', isbn='7798uj')
+        for days in (0, 3, 3, 30):
+            BookInstance.objects.create(book=test_book, imprint='Imprint', borrower=self.test_user, status='o',
+                                        due_back=self.today + datetime.timedelta(days=days))
+
+    def test_user_without_permission_cant_access_view(self):
+        self.client.force_login(self.test_user)
+        response = self.client.get(reverse('catalog:due-date-calendar'))
+        self.assertEquals(response.status_code, 403)
+
+    def test_correct_template_used(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:due-date-calendar'))
+        self.assertEquals(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/librarian_due_date_calendar.html')
+
+    def test_copies_counted_per_day(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:due-date-calendar') + '?weeks=2')
+        days = dict(day for week in response.context['weeks'] for day in week)
+        self.assertEquals(len(response.context['weeks']), 2)
+        self.assertEquals(min(days), self.monday)
+        self.assertEquals(days[self.today], 1)
+        self.assertEquals(days[self.today + datetime.timedelta(days=3)], 2)
+        self.assertEquals(response.context['total'], 3)
+
+    def test_counts_served_from_cache(self):
+        self.client.force_login(self.test_librarian)
+        self.client.get(reverse('catalog:due-date-calendar'))
+        BookInstance.objects.filter(due_back=self.today).delete()
+        response = self.client.get(reverse('catalog:due-date-calendar'))
+        days = dict(day for week in response.context['weeks'] for day in week)
+        self.assertEquals(days[self.today], 1)
+
+
 class CopyOfBookAvailableViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='testUser', password='123234')
@@ -556,6 +720,42 @@ class CopyOfBookAvailableViewTest(TestCase):
         self.assertContains(response, 'There are no copies currently available to borrow in the library.')
 
 
+class UserPlaceHoldViewTest(TestCase):
+    def setUp(self):
+        self.user_1 = User.objects.create(username='User 1', password='dhjhjhfj')
+        self.user_2 = User.objects.create(username='User 2', password='dhjhjhfj')
+        permission = Permission.objects.get(name='Users can make a borrow request')
+        self.user_1.user_permissions.add(permission)
+        self.user_2.user_permissions.add(permission)
+        self.test_book = Book.objects.create(title='Book Title', summary='Book Summary', isbn='7798uj')
+
+    def test_redirect_if_not_logged_in(self):
+        response = self.client.get(reverse('catalog:place_hold', kwargs={'pk': self.test_book.pk}))
+        self.assertEquals(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/accounts/login/'))
+
+    def test_correct_template_used(self):
+        self.client.force_login(self.user_1)
+        response = self.client.get(reverse('catalog:place_hold', kwargs={'pk': self.test_book.pk}))
+        self.assertEquals(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/user_place_hold.html')
+        self.assertIsNone(response.context['hold'])
+
+    def test_members_join_queue_in_order(self):
+        Hold.objects.place(self.test_book, self.user_2)
+        self.client.force_login(self.user_1)
+        response = self.client.post(reverse('catalog:place_hold', kwargs={'pk': self.test_book.pk}))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.context['position'], 2)
+
+    def test_placing_hold_twice_keeps_one_hold(self):
+        self.client.force_login(self.user_1)
+        self.client.post(reverse('catalog:place_hold', kwargs={'pk': self.test_book.pk}))
+        response = self.client.post(reverse('catalog:place_hold', kwargs={'pk': self.test_book.pk}))
+        self.assertEquals(response.context['position'], 1)
+        self.assertEquals(Hold.objects.filter(user=self.user_1).count(), 1)
+
+
 class BorrowBooksRequestForLibrarianListViewTest(TestCase):
     def setUp(self):
         self.test_user = User.objects.create(username='User', password='12336')
@@ -587,12 +787,12 @@ class BorrowBooksRequestForLibrarianListViewTest(TestCase):
         number_of_book_copies = 31
         for book_copy in range(number_of_book_copies):
             return_date = timezone.localtime() + datetime.timedelta(days=book_copy % 5)
-            status = 'a'
+            status = ['p', 'a']
             BookInstance.objects.create(
                 book=book,
                 imprint='Joels publishing house',
                 due_back=return_date if book_copy % 2 else None,
-                status=status
+                status=status[0] if book_copy % 2 else status[1]
             )
 
     def test_user_without_permission_cant_access_view(self):
@@ -618,16 +818,18 @@ class BorrowBooksRequestForLibrarianListViewTest(TestCase):
 
     def test_list_all_book_copy_for_borrow_approval(self):
         self.client.force_login(self.test_librarian)
-        # Only books with status available and due_back != null will be  displayed
+        # Only books with a pending borrow request will be displayed
         response = self.client.get(reverse('catalog:borrow_approval_list') + '?page=2')
         self.assertContains(response, 'Borrow Request')
         self.assertEquals(len(response.context['bookinstance_list']), 5)
 
     def test_only_available_book_with_due_back_date_is_displayed(self):
-        book_to_display_count = BookInstance.objects.filter(status__exact='a').filter(due_back__isnull=False).count()
+        book_to_display_count = BookInstance.objects.filter(status__exact='p').count()
         self.client.force_login(user=self.test_librarian)
         response = self.client.get(reverse('catalog:borrow_approval_list'))
         self.assertTrue(response.context['bookinstance_list'])
+        for book_item in response.context['bookinstance_list']:
+            self.assertEquals(book_item.status, 'p')
         self.assertEquals(str(response.context['user']), 'Librarian')
         self.assertEquals(book_to_display_count, 15)
 
@@ -874,6 +1076,96 @@ class LibrarianRenewBookViewTest(TestCase):
         self.assertFormError(post_response, 'form', 'due_back', 'Invalid date - renewal more than 2 weeks ahead')
 
 
+class LibrarianBulkRenewBooksViewTest(TestCase):
+    def setUp(self):
+        self.user_1 = User.objects.create(username='User', password='dhjhjhfj')
+        self.user_2 = User.objects.create(username='Another User', password='dhjhjhfj')
+        self.test_librarian = User.objects.create(username='Librarian', password='12Thyr^')
+
+        permission = Permission.objects.get(name='Renew date for books on loan')
+        self.test_librarian.user_permissions.add(permission)
+
+        test_book = Book.objects.create(title='Book Title', summary='Book Summary', isbn='7798uj')
+
+        self.overdue_1 = BookInstance.objects.create(
+            book=test_book, imprint='Printed June 11, 2020 1:01AM', borrower=self.user_1, status='o',
+            due_back=datetime.date.today() - datetime.timedelta(days=3))
+        self.overdue_2 = BookInstance.objects.create(
+            book=test_book, imprint='Printed June 11, 2020 1:02AM', borrower=self.user_2, status='o',
+            due_back=datetime.date.today() - datetime.timedelta(days=1))
+        self.due_soon = BookInstance.objects.create(
+            book=test_book, imprint='Printed June 11, 2020 1:03AM', borrower=self.user_1, status='o',
+            due_back=datetime.date.today() + datetime.timedelta(days=2))
+        self.borrow_request = BookInstance.objects.create(
+            book=test_book, imprint='Printed June 11, 2020 1:04AM', borrower=self.user_1, status='p',
+            due_back=datetime.date.today() - datetime.timedelta(days=1))
+
+    def test_redirect_if_logged_in_but_not_correct_permission(self):
+        self.client.force_login(self.user_1)
+        response = self.client.get(reverse('catalog:bulk-renew-librarian'))
+        self.assertEquals(response.status_code, 302)
+        self.assertTrue(response.url.startswith('/accounts/login/'))
+
+    def test_correct_template_used(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.get(reverse('catalog:bulk-renew-librarian'))
+        self.assertEquals(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/librarian_bulk_renew_book_copies.html')
+
+    def test_renews_only_overdue_loans(self):
+        self.client.force_login(self.test_librarian)
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=1)
+        response = self.client.post(reverse('catalog:bulk-renew-librarian'),
+                                    data={'selection': 'overdue', 'due_back': renewal_date})
+        self.assertEquals(response.status_code, 200)
+        summary = b''.join(response.streaming_content).decode()
+        self.assertTrue(summary.startswith('renewed,2,'))
+        self.assertIn(str(self.overdue_1.pk), summary)
+        self.assertNotIn(str(self.due_soon.pk), summary)
+        self.assertEquals(BookInstance.objects.get(pk=self.overdue_1.pk).due_back, renewal_date)
+        self.assertEquals(BookInstance.objects.get(pk=self.overdue_2.pk).due_back, renewal_date)
+        self.assertEquals(BookInstance.objects.get(pk=self.due_soon.pk).due_back, self.due_soon.due_back)
+        # A pending borrow request is not a loan, so it must never be renewed
+        self.assertEquals(BookInstance.objects.get(pk=self.borrow_request.pk).due_back,
+                          self.borrow_request.due_back)
+
+    def test_summary_leaves_out_loans_already_due_on_the_renewal_date(self):
+        self.client.force_login(self.test_librarian)
+        response = self.client.post(reverse('catalog:bulk-renew-librarian'), data={
+            'selection': 'due_within', 'days': 3, 'due_back': self.due_soon.due_back})
+        summary = b''.join(response.streaming_content).decode()
+        self.assertTrue(summary.startswith('renewed,2,'))
+        self.assertIn(str(self.overdue_1.pk), summary)
+        self.assertNotIn(str(self.due_soon.pk), summary)
+        self.assertEquals(len(summary.splitlines()), 4)
+
+    def test_summary_is_sorted_by_borrower(self):
+        self.client.force_login(self.test_librarian)
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=1)
+        response = self.client.post(reverse('catalog:bulk-renew-librarian'),
+                                    data={'selection': 'overdue', 'due_back': renewal_date})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEquals([line.split(',')[2] for line in lines[2:]], ['Another User', 'User'])
+
+    def test_renews_loans_due_within_days_for_one_member(self):
+        self.client.force_login(self.test_librarian)
+        renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+        response = self.client.post(reverse('catalog:bulk-renew-librarian'), data={
+            'selection': 'due_within', 'days': 3, 'borrower': self.user_1.pk, 'due_back': renewal_date})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(BookInstance.objects.filter(due_back=renewal_date).count(), 2)
+        self.assertEquals(BookInstance.objects.get(pk=self.overdue_2.pk).due_back, self.overdue_2.due_back)
+
+    def test_form_invalid_renewal_date_future(self):
+        self.client.force_login(self.test_librarian)
+        date_in_future = datetime.date.today() + datetime.timedelta(weeks=3)
+        response = self.client.post(reverse('catalog:bulk-renew-librarian'),
+                                    data={'selection': 'overdue', 'due_back': date_in_future})
+        self.assertEquals(response.status_code, 200)
+        self.assertFormError(response, 'form', 'due_back', 'Invalid date - renewal more than 2 weeks ahead')
+        self.assertEquals(BookInstance.objects.get(pk=self.overdue_1.pk).due_back, self.overdue_1.due_back)
+
+
 class UserBorrowBookViewTest(TestCase):
     def setUp(self):
         self.user_1 = User.objects.create(username='User', password='dhjhjhfj')
@@ -973,6 +1265,7 @@ class UserBorrowBookViewTest(TestCase):
         self.assertEquals(str(response.context['user']), 'User')
         self.assertEquals(post_response.status_code, 200)
         self.assertTemplateUsed(post_response, 'catalog/user_book_copies_available.html')
+        self.assertEquals(BookInstance.objects.get(pk=self.test_bookinstance_1.pk).status, 'p')
 
     def test_form_invalid_return_date_past(self):
         self.client.force_login(user=self.user_1)
@@ -996,6 +1289,64 @@ class UserBorrowBookViewTest(TestCase):
         self.assertEquals(post_response.status_code, 200)
         self.assertFormError(post_response, 'form', 'due_back', 'Invalid date - return date more than 3 weeks ahead')
 
+    def test_borrow_request_is_counted(self):
+        self.client.force_login(self.user_1)
+        self.client.post(reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}),
+                         data={'due_back': datetime.date.today() + datetime.timedelta(weeks=1)})
+        self.assertEquals(LoanCounter.objects.get(user=self.user_1).requested, 1)
+
+    @override_settings(MAX_LOANS_PER_MEMBER=1)
+    def test_borrow_request_refused_at_limit(self):
+        LoanCounter.objects.create(user=self.user_1, on_loan=1)
+        self.client.force_login(self.user_1)
+        response = self.client.post(reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}),
+                                    data={'due_back': datetime.date.today() + datetime.timedelta(weeks=1)})
+        self.assertEquals(response.status_code, 200)
+        self.assertFormError(response, 'form', None, 'You have reached the most books you can borrow at the same time')
+        self.assertEquals(BookInstance.objects.get(pk=self.test_bookinstance_1.pk).status, 'a')
+        self.assertEquals(LoanCounter.objects.get(user=self.user_1).requested, 0)
+
+    def test_borrow_request_refused_for_copy_not_available(self):
+        self.test_bookinstance_1.status = 'm'
+        self.test_bookinstance_1.save()
+        self.client.force_login(self.user_1)
+        response = self.client.post(reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}),
+                                    data={'due_back': datetime.date.today() + datetime.timedelta(weeks=1)})
+        self.assertFormError(response, 'form', None, 'This copy is no longer available to borrow')
+        self.assertFalse(LoanCounter.objects.filter(user=self.user_1, requested__gt=0).exists())
+
+
+    def test_copy_reserved_by_a_hold_is_borrowed_by_its_member(self):
+        librarian = User.objects.create(username='Librarian')
+        librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+        self.test_bookinstance_1.status = 'o'
+        self.test_bookinstance_1.borrower = self.user_2
+        self.test_bookinstance_1.save()
+        Hold.objects.place(self.test_bookinstance_1.book, self.user_1)
+
+        self.client.force_login(librarian)
+        self.client.post(reverse('catalog:bookinstance_return', kwargs={'pk': self.test_bookinstance_1.pk}),
+                         data={'borrower': '', 'due_back': '', 'status': 'a'})
+        self.client.force_login(self.user_1)
+        response = self.client.get(reverse('catalog:my-borrowed'))
+        self.assertContains(response, reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}))
+        due_back = datetime.date.today() + datetime.timedelta(weeks=1)
+        response = self.client.post(reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}),
+                                    data={'due_back': due_back})
+        self.assertTemplateUsed(response, 'catalog/user_book_copies_available.html')
+        self.test_bookinstance_1.refresh_from_db()
+        self.assertEquals((self.test_bookinstance_1.status, self.test_bookinstance_1.borrower,
+                           self.test_bookinstance_1.due_back), ('p', self.user_1, due_back))
+
+    def test_copy_reserved_for_another_member_is_refused(self):
+        self.test_bookinstance_1.status = 'r'
+        self.test_bookinstance_1.borrower = self.user_2
+        self.test_bookinstance_1.save()
+        self.client.force_login(self.user_1)
+        response = self.client.post(reverse('catalog:borrow_request', kwargs={'pk': self.test_bookinstance_1.pk}),
+                                    data={'due_back': datetime.date.today() + datetime.timedelta(weeks=1)})
+        self.assertFormError(response, 'form', None, 'This copy is no longer available to borrow')
+
 
 class LibrarianMarkCopyAsReturnedViewTest(TestCase):
     def setUp(self):
@@ -1093,6 +1444,43 @@ class LibrarianMarkCopyAsReturnedViewTest(TestCase):
         self.assertEquals(post_response.status_code, 302)
         self.assertRedirects(post_response, reverse('catalog:bookinstance_list'))
 
+    def test_returned_copy_is_reserved_for_next_member_in_hold_queue(self):
+        self.client.force_login(self.test_librarian)
+        hold = Hold.objects.place(self.test_bookinstance_1.book, self.test_librarian)
+        form_data = {
+            'borrower': '',
+            'due_back': '',
+            'status': 'a'
+        }
+        post_response = self.client.post(
+            reverse('catalog:bookinstance_return', kwargs={'pk': self.test_bookinstance_1.pk}),
+            data=form_data)
+        self.assertEquals(post_response.status_code, 302)
+        self.test_bookinstance_1.refresh_from_db()
+        hold.refresh_from_db()
+        self.assertEquals(self.test_bookinstance_1.status, 'r')
+        self.assertEquals(self.test_bookinstance_1.borrower, self.test_librarian)
+        self.assertEquals(hold.book_instance, self.test_bookinstance_1)
+        self.assertIsNotNone(hold.fulfilled_at)
+
+    def test_return_is_logged_with_the_borrower(self):
+        self.client.force_login(self.test_librarian)
+        self.client.post(reverse('catalog:bookinstance_return', kwargs={'pk': self.test_bookinstance_1.pk}),
+                         data={'borrower': '', 'due_back': '', 'status': 'a'})
+        event = LoanEvent.objects.get(book_instance=self.test_bookinstance_1)
+        self.assertEquals(event.event, LoanEvent.RETURNED)
+        self.assertEquals(event.borrower, self.user_1)
+
+    def test_copy_is_only_returned_once(self):
+        LoanCounter.objects.create(user=self.user_1, on_loan=2)
+        self.client.force_login(self.test_librarian)
+        url = reverse('catalog:bookinstance_return', kwargs={'pk': self.test_bookinstance_1.pk})
+        self.client.post(url, data={'borrower': '', 'due_back': '', 'status': 'a'})
+        response = self.client.post(url, data={'borrower': '', 'due_back': '', 'status': 'a'})
+        self.assertFormError(response, 'form', None, 'This copy is not borrowed by anybody')
+        self.assertEquals(LoanCounter.objects.get(user=self.user_1).on_loan, 1)
+        self.assertEquals(LoanEvent.objects.filter(book_instance=self.test_bookinstance_1).count(), 1)
+
     def test_form_borrower_field_borrower_field_must_be_empty_error(self):
         self.client.force_login(self.test_librarian)
         response = self.client.get(reverse('catalog:bookinstance_return', kwargs={'pk': self.test_bookinstance_1.pk}))
@@ -1251,6 +1639,8 @@ class LibrarianApproveBorrowRequestViewTest(TestCase):
         self.assertEquals(response.context['form'].initial['status'], initial_status)
 
     def test_redirects_to_all_borrowed_book_list_on_success(self):
+        self.test_bookinstance_1.status = 'p'
+        self.test_bookinstance_1.save()
         self.client.force_login(self.test_librarian)
         response = self.client.get(reverse('catalog:copy_approve', kwargs={'pk': self.test_bookinstance_1.pk}))
         self.assertEquals(response.status_code, 200)
@@ -1291,6 +1681,39 @@ class LibrarianApproveBorrowRequestViewTest(TestCase):
         self.assertEquals(post_response.status_code, 200)
         self.assertFormError(post_response, 'form', 'status', 'You must approve as "On-Loan" ')
 
+    def test_approval_moves_request_to_on_loan_count(self):
+        LoanCounter.objects.create(user=self.user_1, requested=1)
+        self.test_bookinstance_1.status = 'p'
+        self.test_bookinstance_1.save()
+        self.client.force_login(self.test_librarian)
+        self.client.post(reverse('catalog:copy_approve', kwargs={'pk': self.test_bookinstance_1.pk}),
+                         data={'status': 'o'})
+        counter = LoanCounter.objects.get(user=self.user_1)
+        self.assertEquals((counter.on_loan, counter.requested), (1, 0))
+
+    def test_request_is_only_approved_once(self):
+        LoanCounter.objects.create(user=self.user_1, requested=1)
+        self.test_bookinstance_1.status = 'p'
+        self.test_bookinstance_1.save()
+        self.client.force_login(self.test_librarian)
+        url = reverse('catalog:copy_approve', kwargs={'pk': self.test_bookinstance_1.pk})
+        self.client.post(url, data={'status': 'o'})
+        response = self.client.post(url, data={'status': 'o'})
+        self.assertFormError(response, 'form', None, 'This copy is not waiting for a borrow approval')
+        counter = LoanCounter.objects.get(user=self.user_1)
+        self.assertEquals((counter.on_loan, counter.requested), (1, 0))
+        self.assertEquals(LoanEvent.objects.filter(book_instance=self.test_bookinstance_1).count(), 1)
+
+    def test_copy_without_borrow_request_is_not_approved(self):
+        self.test_bookinstance_1.status = 'a'
+        self.test_bookinstance_1.save()
+        self.client.force_login(self.test_librarian)
+        response = self.client.post(reverse('catalog:copy_approve', kwargs={'pk': self.test_bookinstance_1.pk}),
+                                    data={'status': 'o'})
+        self.assertFormError(response, 'form', None, 'This copy is not waiting for a borrow approval')
+        self.assertEquals(BookInstance.objects.get(pk=self.test_bookinstance_1.pk).status, 'a')
+        self.assertFalse(LoanCounter.objects.filter(user=self.user_1, on_loan__gt=0).exists())
+
 
 class CopyOfBookCreateViewTest(TestCase):
 
@@ -1388,6 +1811,72 @@ class CopyOfBookCreateViewTest(TestCase):
         self.assertFormError(post_response, 'form', 'status', 'You must update as "Available" only!')
 
 
+class CopyOfBookBulkCreateViewTest(TestCase):
+    def setUp(self):
+        self.librarian_user = User.objects.create(username="librarian_user", password='123456')
+        self.normal_user = User.objects.create(username='normal_user', password='7890')
+
+        permission = Permission.objects.get(name='Set book as returned')
+        self.librarian_user.user_permissions.add(permission)
+
+        self.test_book = Book.objects.create(title='A war Zone')
+
+    def test_user_without_permission_cant_access_view(self):
+        self.client.force_login(user=self.normal_user)
+        response = self.client.get(reverse('catalog:bookinstance_bulk_create'))
+        self.assertEquals(response.status_code, 403)
+
+    def test_correct_template_used_and_book_preselected(self):
+        self.client.force_login(user=self.librarian_user)
+        response = self.client.get(reverse('catalog:bookinstance_bulk_create') + '?book={0}'.format(self.test_book.pk))
+        self.assertTemplateUsed(response, 'catalog/bookinstance_bulk_form.html')
+        self.assertEquals(response.context['form'].initial['book'], str(self.test_book.pk))
+
+    def test_quantity_of_copies_created(self):
+        self.client.force_login(user=self.librarian_user)
+        response = self.client.post(reverse('catalog:bookinstance_bulk_create'), data={
+            'book': self.test_book.pk, 'imprint': 'Shipment 1', 'quantity': 50})
+        self.assertRedirects(response, reverse('catalog:bookinstance_list'))
+        self.assertEquals(BookInstance.objects.filter(book=self.test_book, imprint='Shipment 1', status='a').count(), 50)
+
+    def test_copies_created_from_barcodes(self):
+        self.client.force_login(user=self.librarian_user)
+        barcodes = [uuid.uuid4() for _ in range(3)]
+        response = self.client.post(reverse('catalog:bookinstance_bulk_create'), data={
+            'book': self.test_book.pk, 'imprint': 'Shipment 2', 'barcodes': '\n'.join(map(str, barcodes))})
+        self.assertEquals(response.status_code, 302)
+        self.assertEquals(set(BookInstance.objects.values_list('pk', flat=True)), set(barcodes))
+
+    def test_barcode_already_in_use_creates_nothing(self):
+        self.client.force_login(user=self.librarian_user)
+        copy = BookInstance.objects.create(book=self.test_book, imprint='Old shipment')
+        response = self.client.post(reverse('catalog:bookinstance_bulk_create'), data={
+            'book': self.test_book.pk, 'imprint': 'Shipment 3', 'barcodes': '{0}\n{1}'.format(uuid.uuid4(), copy.pk)})
+        self.assertEquals(response.status_code, 200)
+        self.assertFormError(response, 'form', 'barcodes', 'Barcode already in use - {0}'.format(copy.pk))
+        self.assertEquals(BookInstance.objects.count(), 1)
+
+    def test_barcode_taken_after_the_form_was_checked(self):
+        barcode = uuid.uuid4()
+        form = LibrarianBulkCreateBookCopyForm(data={
+            'book': self.test_book.pk, 'imprint': 'Shipment 5', 'barcodes': '{0}\n{1}'.format(uuid.uuid4(), barcode)})
+        self.assertTrue(form.is_valid())
+        BookInstance.objects.create(id=barcode, book=self.test_book, imprint='Other intake')
+        view = CopyOfBookBulkCreateView()
+        view.setup(RequestFactory().post(reverse('catalog:bookinstance_bulk_create')))
+        response = view.form_valid(form)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(form.errors['barcodes'],
+                          ['One of these barcodes has just been added by somebody else, no copy was added'])
+        self.assertEquals(BookInstance.objects.count(), 1)
+
+    def test_quantity_or_barcodes_required(self):
+        self.client.force_login(user=self.librarian_user)
+        response = self.client.post(reverse('catalog:bookinstance_bulk_create'), data={
+            'book': self.test_book.pk, 'imprint': 'Shipment 4'})
+        self.assertFormError(response, 'form', None, 'Enter a quantity or a list of barcodes')
+
+
 class CopyOfBookUpdateViewTest(TestCase):
     def setUp(self):
         test_bookinstance = BookInstance.objects.create(imprint='Rachel publishing house', status='a')
@@ -0,0 +1,141 @@
+"""
+Upload handling of the book covers.
+
+Django's default handlers keep uploads of up to 2.5MB in memory and forms.ImageField then has Pillow
+verify the whole image, so a huge scan (or a small file that claims to be gigapixels wide, a
+"decompression bomb") can take a worker down. CoverUploadHandler takes over the book_cover field of every
+upload: the file is streamed to a temporary file on disk, and it is checked as it arrives:
+
+ - it is cut off as soon as it is bigger than COVER_UPLOAD_MAX_BYTES,
+ - as soon as the start of the file holds the image header, the format must be one of COVER_FORMATS and
+   the width times the height at most COVER_MAX_PIXELS. Nothing is decoded for this, Pillow only reads the
+   header, so a bomb is turned away before a single pixel is unpacked.
+
+A rejected upload stops being written to disk, the reason is kept on the file and reported by the form's
+CoverImageField (catalog/forms.py) as a validation error.
+"""
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+# Name of the form field handled
+COVER_FIELD = 'book_cover'
+
+COVER_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+
+# 25 megapixels is already a 5000 x 5000 image, well above anything a cover needs
+COVER_MAX_PIXELS = 25000000
+
+# Pillow format names of the images accepted as covers
+COVER_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+# Most bytes read looking for the header, a JPEG's dimensions come after its EXIF data (thumbnail included)
+HEADER_MAX_BYTES = 1024 * 1024
+
+
+class CoverUploadError(Exception):
+    pass
+
+
+def max_bytes():
+    return getattr(settings, 'COVER_UPLOAD_MAX_BYTES', COVER_UPLOAD_MAX_BYTES)
+
+
+def max_pixels():
+    return getattr(settings, 'COVER_MAX_PIXELS', COVER_MAX_PIXELS)
+
+
+def allowed_formats():
+    return tuple(getattr(settings, 'COVER_FORMATS', COVER_FORMATS))
+
+
+def check_header(file):
+    """Reads the image header at the start of <file> and returns (format, (width, height)). Raises
+    CoverUploadError if the image is not one of the accepted formats or has too many pixels, and lets
+    Pillow's errors through when the header can't be read (yet). No pixel data is decoded."""
+    position = file.tell()
+    file.seek(0)
+    try:
+        # Image.open() only parses the header, the file object passed in is left open
+        image = Image.open(file)
+        image_format, size = image.format, image.size
+    except Image.DecompressionBombError as error:
+        raise CoverUploadError('The image has too many pixels ({0}).'.format(error))
+    finally:
+        file.seek(position)
+    if image_format not in allowed_formats():
+        raise CoverUploadError('{0} images are not accepted as covers, upload a {1} file.'.format(
+            image_format, ', '.join(allowed_formats())))
+    if size[0] * size[1] > max_pixels():
+        raise CoverUploadError('The image is {0} x {1} pixels, covers can have at most {2} megapixels.'.format(
+            size[0], size[1], max_pixels() // 1000000))
+    return image_format, size
+
+
+class CoverUpload(TemporaryUploadedFile):
+    """Temporary file of a cover upload, with what the handler found out about it"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.upload_error = None
+        self.image_format = None
+        self.image_size = None
+
+
+class CoverUploadHandler(FileUploadHandler):
+    """Streams the book_cover upload to disk, checking its size and image header as it arrives (see the
+    module docstring). The other fields of the request are left to the next handlers."""
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.active = field_name == COVER_FIELD
+        if not self.active:
+            return
+        self.file = CoverUpload(file_name, content_type, 0, charset, content_type_extra)
+        self.received = 0
+        if content_length and content_length > max_bytes():
+            self.reject('The file is too big, covers can be at most {0}.'.format(filesizeformat(max_bytes())))
+        raise StopFutureHandlers()
+
+    def reject(self, error):
+        self.file.upload_error = error
+        # Whatever was written so far is of no use any more
+        self.file.seek(0)
+        self.file.truncate()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        if self.file.upload_error:
+            return None
+        self.received += len(raw_data)
+        if self.received > max_bytes():
+            self.reject('The file is too big, covers can be at most {0}.'.format(filesizeformat(max_bytes())))
+            return None
+        self.file.write(raw_data)
+        if self.file.image_format is None:
+            self.read_header(complete=False)
+        return None
+
+    def read_header(self, complete):
+        try:
+            self.file.image_format, self.file.image_size = check_header(self.file)
+        except CoverUploadError as error:
+            self.reject(str(error))
+        except Exception:
+            # The header may just not have arrived yet
+            if complete or self.received >= HEADER_MAX_BYTES:
+                self.reject('Upload a valid image. The file you uploaded was either not an image or a '
+                            'corrupted image.')
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if not self.file.upload_error and self.file.image_format is None:
+            self.read_header(complete=True)
+        self.file.seek(0)
+        self.file.size = 0 if self.file.upload_error else file_size
+        return self.file
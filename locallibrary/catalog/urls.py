@@ -12,6 +12,9 @@ urlpatterns = [
     path('mybooks/', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
     path('borrowed/', views.AllLoanedBooksLibrarianListView.as_view(), name='all-borrowed'),
     path('book/<uuid:pk>/renew/', views.librarian_renew_book, name='renew-book-librarian'),
+    path('borrowed/renew/', views.librarian_bulk_renew_books, name='bulk-renew-librarian'),
+    path('overdue/', views.OverdueReportLibrarianListView.as_view(), name='overdue-report'),
+    path('borrowed/calendar/', views.DueDateCalendarLibrarianView.as_view(), name='due-date-calendar'),
 
 ]
 
@@ -34,12 +37,14 @@ urlpatterns += [
     path('languages/<int:pk>/delete/', views.LanguageDeleteView.as_view(), name='language_delete'),
 
     path('bookcopy/create/', views.CopyOfBookCreateView.as_view(), name='bookinstance_create'),
+    path('bookcopy/create/bulk/', views.CopyOfBookBulkCreateView.as_view(), name='bookinstance_bulk_create'),
     path('bookcopy/update/<uuid:pk>/', views.CopyOfBookUpdateView.as_view(), name='bookinstance_update'),
     path('bookcopy/<uuid:pk>/delete/', views.CopyOfBookDeleteView.as_view(), name='bookinstance_delete'),
     path('bookcopy/', views.CopyOfBookListView.as_view(), name='bookinstance_list'),
     path('available/', views.CopyOfBookAvailableView.as_view(), name='copy_available'),
 
     path('available/<uuid:pk>/borrow/', views.user_borrow_book, name='borrow_request'),
+    path('books/<int:pk>/hold/', views.user_place_hold, name='place_hold'),
     path('approve_borrow/', views.BorrowBooksRequestForLibrarianListView.as_view(), name='borrow_approval_list'),
     path('bookcopy/approve/<uuid:pk>/', views.librarian_approve_borrow_request, name='copy_approve'),
     path('bookcopy/mark_return/<uuid:pk>/', views.LibrarianMarkCopyAsReturnedView.as_view(), name='bookinstance_return'),
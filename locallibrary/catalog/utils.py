@@ -0,0 +1,37 @@
+import os
+import time
+import uuid
+from itertools import islice
+
+from django.conf import settings
+
+
+def batched(iterable, size):
+    """Yields lists of at most <size> items from <iterable> without ever holding more than one batch.
+    bulk_create() turns whatever it gets into a list first, so big writes are fed to it one batch at a time"""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def uuid7():
+    """Time-ordered UUID (version 7 layout): 48 bits of Unix time in milliseconds followed by random bits.
+
+    New values sort after older ones, so primary key inserts go to the right-hand end of the index
+    instead of a random page of it, which keeps the B-tree dense and the recently used pages in cache.
+    The result is a regular uuid.UUID, it works with UUIDField and the <uuid:pk> URL converter."""
+    timestamp_ms, remainder_ns = divmod(time.time_ns(), 1000000)
+    # The 12 bits after the version hold the fraction of the millisecond, so ids created
+    # within the same millisecond still (mostly) come out in order.
+    sub_ms = remainder_ns * 4096 // 1000000
+    rand_b = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+    return uuid.UUID(int=(timestamp_ms & ((1 << 48) - 1)) << 80 | 7 << 76 | sub_ms << 64 | 2 << 62 | rand_b)
+
+
+def new_copy_id():
+    """Default primary key of a new BookInstance: time ordered unless settings.TIME_ORDERED_COPY_IDS is False"""
+    if getattr(settings, 'TIME_ORDERED_COPY_IDS', True):
+        return uuid7()
+    return uuid.uuid4()
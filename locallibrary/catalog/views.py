@@ -1,22 +1,29 @@
+import csv
 import datetime
 
 from django.db.models import Q
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.template.loader import get_template
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 
 from django.conf import settings
-from .models import Author, Book, BookInstance, Genre, Language
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from .models import Author, Book, BookInstance, Genre, Language, Hold, LoanEvent, LoanCounter, OutgoingEmail, \
+    library_members_group_id
 from django.views import generic
-from django.views.generic.edit import CreateView, UpdateView, DeleteView
+from django.views.generic.edit import CreateView, UpdateView, DeleteView, FormView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.urls import reverse, reverse_lazy
 from .forms import LibrarianRenewBookModelForm, LibrarianCreateBookCopyModelForm, \
     LibrarianUpdateBookCopyModelForm, UserBorrowBookModelForm, LibrarianApproveBookCopyBorrowModelForm, \
-    LibrarianMarkBookCopyAsReturnedModelForm, SignupForm
+    LibrarianMarkBookCopyAsReturnedModelForm, SignupForm, LibrarianBulkRenewBookForm, LibrarianBulkCreateBookCopyForm, \
+    BookModelForm
 from .tokens import user_tokenizer
-from django.contrib.auth.models import User, Group
+from .utils import batched
+from django.contrib.auth.models import User
 from django.core.mail import EmailMessage
 from django.views import View
 
@@ -37,22 +44,28 @@ class SignUpView(View):
             user = form.save(commit=False)
             user.is_valid = False
             user.is_active = False
-            user.save()
-            token = user_tokenizer.make_token(user)
-            uid = urlsafe_base64_encode(force_bytes(user.id))
-            url = 'http://localhost:8000' + reverse(
-                'catalog:confirm_email', kwargs={'user_id': uid, 'token': token})
-            message = get_template('catalog/signup_confirm_email.html').render({
-                'confirm_url': url, 'user': user,
-            })
-            mail = EmailMessage("Joels' Local Library Email Confirmation", message,
-                                to=[user.email], from_email=settings.EMAIL_HOST_USER)
-            mail.content_subtype = 'html'
-            mail.send()
-
+            with transaction.atomic():
+                user.save()
+                OutgoingEmail.objects.enqueue(self.confirmation_email(user))
             return render(request, 'catalog/signup_redirect.html', {'user': user})
         return render(request, 'catalog/signup.html', {'form': form})
 
+    # The email is only queued here (with the new user, in the same transaction) and sent by the
+    # send_queued_email command, so a signup never waits on, or fails with, the mail server
+    def confirmation_email(self, user):
+        """Returns the email asking <user> to confirm their email address"""
+        token = user_tokenizer.make_token(user)
+        uid = urlsafe_base64_encode(force_bytes(user.id))
+        url = 'http://localhost:8000' + reverse(
+            'catalog:confirm_email', kwargs={'user_id': uid, 'token': token})
+        message = get_template('catalog/signup_confirm_email.html').render({
+            'confirm_url': url, 'user': user,
+        })
+        mail = EmailMessage("Joels' Local Library Email Confirmation", message,
+                            to=[user.email], from_email=settings.EMAIL_HOST_USER)
+        mail.content_subtype = 'html'
+        return mail
+
 
 class ConfirmRegistrationView(View):
     def get(self, request, user_id, token):
@@ -71,13 +84,9 @@ class ConfirmRegistrationView(View):
             user.is_active = True
             user.save()
 
-            # Automatically migrating all authenticated users as Library Member
-            # group on signup confirmation.
-            group = Group.objects.get(name='Library Members')
-            users = User.objects.all()
-            for user in users:
-                if user.is_active:
-                    group.user_set.add(user)
+            # Only the confirming user joins the Library Members group, the members who confirmed before
+            # the group existed are added by the add_library_members command
+            user.groups.add(library_members_group_id())
             return render(request, 'catalog/signup_complete_after_confirm_email.html', {'user': user})
 
         return render(request, 'registration/login.html', context)
@@ -90,7 +99,7 @@ def index(request):
     num_instances = BookInstance.objects.all().count()
 
     # Available book (status = 'a')
-    num_instances_available = BookInstance.objects.filter(status__exact='a').count()
+    num_instances_available = BookInstance.objects.available().count()
 
     # The 'all()' is implied by default
     num_authors = Author.objects.count()
@@ -133,6 +142,8 @@ def index(request):
 class BookListView(generic.ListView):
     """This view list all books in the library"""
     model = Book
+    # Served to anonymous visitors without cookies and as a publicly cacheable page (see catalog/middleware.py)
+    public_read = True
     context_object_name = 'list_of_books'
     template_name = 'catalog/book.html'
     paginate_by = 9
@@ -145,6 +156,7 @@ class BookListView(generic.ListView):
 class BookDetailView(generic.DetailView):
     """This view gives the detail about a specific book in the library"""
     model = Book
+    public_read = True
 
 
 """Function based representation of the above class BookDetailView"""
@@ -160,7 +172,7 @@ def book_detail_view(request, primary_key):
 class BookCreateView(PermissionRequiredMixin, CreateView):
     """This view allows the librarian to add a book to the library"""
     model = Book
-    fields = '__all__'
+    form_class = BookModelForm
     permission_required = 'catalog.can_mark_returned'
 
 
@@ -168,7 +180,7 @@ class BookUpdateView(PermissionRequiredMixin, UpdateView):
     """This view allows the librarian to be able to update already added book in the library"""
     model = Book
     permission_required = 'catalog.can_mark_returned'
-    fields = '__all__'
+    form_class = BookModelForm
 
 
 class BookDeleteView(PermissionRequiredMixin, DeleteView):
@@ -182,6 +194,7 @@ class BookDeleteView(PermissionRequiredMixin, DeleteView):
 class AuthorListView(generic.ListView):
     """This view gives a list of all the authors in the library"""
     model = Author
+    public_read = True
     paginate_by = 9
 
 
@@ -276,6 +289,14 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
             status__exact='o').order_by(
             'due_back')
 
+    # The counts come from the member's LoanCounter (a primary key lookup), not from counting their copies
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['loan_counter'], _ = LoanCounter.objects.get_or_create(user=self.request.user)
+        context['max_loans'] = getattr(settings, 'MAX_LOANS_PER_MEMBER', 5)
+        context['reserved_list'] = BookInstance.objects.reserved_for(self.request.user).select_related('book')
+        return context
+
 
 # TEMPLATE: The current user's permissions are stored in a template variable called {{ perms }}.
 # One can check whether the current user has a particular permission using the specific variable
@@ -321,7 +342,77 @@ class AllLoanedBooksLibrarianListView(PermissionRequiredMixin, generic.ListView)
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+        return BookInstance.objects.filter(status__exact='o').with_days_overdue().order_by('due_back')
+
+
+class OverdueReportLibrarianListView(PermissionRequiredMixin, generic.ListView):
+    """Generic class-based view listing every overdue copy, longest overdue first, together with the
+    overdue totals of the members on the current page. Only visible to users with can_mark_returned permission."""
+    model = BookInstance
+    permission_required = 'catalog.can_mark_returned'
+    template_name = 'catalog/librarian_overdue_report.html'
+    paginate_by = 10
+
+    # Ordering by due_back gives the same order as "most days overdue first" and can be read
+    # straight off the partial index on due_back for copies on loan.
+    def get_queryset(self):
+        return BookInstance.objects.overdue().with_days_overdue().select_related(
+            'book', 'borrower').order_by('due_back', 'id')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        borrowers = {copy.borrower_id for copy in context['object_list']}
+        context['member_list'] = BookInstance.objects.filter(borrower__in=borrowers).overdue_by_member()
+        return context
+
+
+class DueDateCalendarLibrarianView(PermissionRequiredMixin, generic.TemplateView):
+    """View showing how many copies on loan are due back on each day of the coming weeks, e.g. to staff
+    the returns desk. Only visible to users with can_mark_returned permission."""
+    permission_required = 'catalog.can_mark_returned'
+    template_name = 'catalog/librarian_due_date_calendar.html'
+    MAX_WEEKS = 12
+
+    # The counts of days gone by are cached for good, as they are only looked back at, the days from today
+    # on still change with every loan and return so they are cached for DUE_CALENDAR_CACHE_TIMEOUT seconds only
+    def get_past_counts(self, start, end):
+        keys = {day: 'catalog:due-back:{0}'.format(day.isoformat())
+                for day in (start + datetime.timedelta(days=n) for n in range((end - start).days))}
+        cached = cache.get_many(keys.values())
+        missing = [day for day, key in keys.items() if key not in cached]
+        if missing:
+            counts = BookInstance.objects.due_back_counts(missing[0], missing[-1] + datetime.timedelta(days=1))
+            new = {keys[day]: counts.get(day, 0) for day in missing}
+            cache.set_many(new, timeout=None)
+            cached.update(new)
+        return {day: cached[key] for day, key in keys.items()}
+
+    def get_current_counts(self, start, end):
+        key = 'catalog:due-back:{0}:{1}'.format(start.isoformat(), end.isoformat())
+        counts = cache.get(key)
+        if counts is None:
+            counts = BookInstance.objects.due_back_counts(start, end)
+            cache.set(key, counts, getattr(settings, 'DUE_CALENDAR_CACHE_TIMEOUT', 60))
+        return counts
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        today = datetime.date.today()
+        try:
+            weeks = min(max(int(self.request.GET.get('weeks', 4)), 1), self.MAX_WEEKS)
+        except ValueError:
+            weeks = 4
+        # The calendar starts on the Monday of the current week
+        start = today - datetime.timedelta(days=today.weekday())
+        end = start + datetime.timedelta(weeks=weeks)
+
+        counts = self.get_past_counts(start, today)
+        counts.update(self.get_current_counts(today, end))
+        days = [start + datetime.timedelta(days=n) for n in range((end - start).days)]
+        context['weeks'] = [[(day, counts.get(day, 0)) for day in days[n:n + 7]] for n in range(0, len(days), 7)]
+        context['today'] = today
+        context['total'] = sum(counts.get(day, 0) for day in days if day >= today)
+        return context
 
 
 # the view has to render the default form when it is first called and then either re-render
@@ -344,8 +435,20 @@ def user_borrow_book(request, pk):
         if form.is_valid():
             book_instance.due_back = form.cleaned_data['due_back']
             book_instance.borrower = request.user
-            book_instance.save()
-            return render(request, 'catalog/user_book_copies_available.html')
+            book_instance.status = 'p'
+            # The member's counter and the copy are both only changed if they still allow the borrow
+            # (member below their borrowing limit, copy still available or reserved for this member),
+            # otherwise nothing is changed
+            with transaction.atomic():
+                if not LoanCounter.objects.request_borrow(request.user):
+                    form.add_error(None, 'You have reached the most books you can borrow at the same time')
+                elif not BookInstance.objects.claimable_by(request.user).filter(pk=pk).update(
+                        due_back=book_instance.due_back, borrower=book_instance.borrower, status='p'):
+                    transaction.set_rollback(True)
+                    form.add_error(None, 'This copy is no longer available to borrow')
+                else:
+                    LoanEvent.objects.record(book_instance, LoanEvent.REQUESTED)
+                    return render(request, 'catalog/user_book_copies_available.html')
     else:
         proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
         form = UserBorrowBookModelForm(initial={'due_back': proposed_renewal_date})
@@ -367,7 +470,7 @@ class BorrowBooksRequestForLibrarianListView(PermissionRequiredMixin, generic.Li
     paginate_by = 10
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='a').filter(due_back__isnull=False)
+        return BookInstance.objects.requested().order_by('due_back', 'id')
 
 
 @permission_required('catalog.can_renew')
@@ -389,7 +492,9 @@ def librarian_renew_book(request, pk):
             # If using (forms.form) from forms.py use: the current active one is for (ModelForm)
             # book_instance.due_back = form.cleaned_data['renewal_date']
             book_instance.due_back = form.cleaned_data['due_back']
-            book_instance.save()
+            with transaction.atomic():
+                book_instance.save()
+                LoanEvent.objects.record(book_instance, LoanEvent.RENEWED)
 
             # redirect to a new URl. reverse() generates a URL from a URL
             # configuration name and a set of arguments. It is the Python
@@ -411,6 +516,50 @@ def librarian_renew_book(request, pk):
     return render(request, 'catalog/librarian_renew_book_copy.html', context)
 
 
+class Echo:
+    """Pseudo-buffer for csv.writer, it hands every written row straight back so that it can be
+    streamed to the client instead of being collected in memory first"""
+    def write(self, value):
+        return value
+
+
+@permission_required('catalog.can_renew')
+def librarian_bulk_renew_books(request):
+    """This function allows the librarian to renew every loan matching a selection (overdue, due within
+    a number of days, for a member and/or for a book) with one UPDATE statement"""
+    if request.method == 'POST':
+        form = LibrarianBulkRenewBookForm(request.POST)
+        if form.is_valid():
+            due_back = form.cleaned_data['due_back']
+            renewed = form.get_queryset().renew(due_back)
+
+            # The summary lists exactly the copies renew() updated (loans that were already due back on that
+            # date are not part of it), sorted by borrower and title across the whole renewal. Their rows are
+            # read one batch of ids at a time (a handful of columns, next to the ids already in memory) and
+            # sorted once before being streamed.
+            writer = csv.writer(Echo())
+            rows = []
+            for ids in batched(renewed, 1000):
+                rows.extend(BookInstance.objects.filter(id__in=ids).values_list(
+                    'id', 'book__title', 'borrower__username', 'due_back'))
+            rows.sort(key=lambda row: (row[2] or '', row[1] or '', row[0]))
+
+            def summary():
+                yield writer.writerow(['renewed', len(renewed), 'due back', due_back])
+                yield writer.writerow(['copy', 'book', 'borrower', 'due back'])
+                for row in rows:
+                    yield writer.writerow(row)
+
+            response = StreamingHttpResponse(summary(), content_type='text/csv')
+            response['Content-Disposition'] = 'attachment; filename="renewals-{0}.csv"'.format(due_back)
+            return response
+    else:
+        proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=1)
+        form = LibrarianBulkRenewBookForm(initial={'due_back': proposed_renewal_date})
+
+    return render(request, 'catalog/librarian_bulk_renew_book_copies.html', {'form': form})
+
+
 # Generic Editing Views(FORMS)
 # The form handling algorithm we used in our function view example above represents an extremely
 # common pattern in form editing views. Django abstracts much of this "boilerplate", by creating
@@ -475,6 +624,32 @@ class CopyOfBookCreateView(PermissionRequiredMixin, CreateView):
     permission_required = 'catalog.can_mark_returned'
 
 
+class CopyOfBookBulkCreateView(PermissionRequiredMixin, FormView):
+    """This view allows the librarian to receive a shipment of copies of one book in a single submission"""
+    form_class = LibrarianBulkCreateBookCopyForm
+    template_name = 'catalog/bookinstance_bulk_form.html'
+    permission_required = 'catalog.can_mark_returned'
+    success_url = reverse_lazy('catalog:bookinstance_list')
+
+    # e.g. /catalog/bookcopy/create/bulk/?book=3 from the book detail page
+    def get_initial(self):
+        initial = super().get_initial()
+        if self.request.GET.get('book', '').isdigit():
+            initial['book'] = self.request.GET['book']
+        return initial
+
+    def form_valid(self, form):
+        # One multi-row INSERT per batch and all of the copies or none of them. The form checked the barcodes,
+        # but another intake of the same shipment can still take one of them before the INSERT
+        try:
+            with transaction.atomic():
+                BookInstance.objects.bulk_create(form.get_copies(), batch_size=500)
+        except IntegrityError:
+            form.add_error('barcodes', 'One of these barcodes has just been added by somebody else, no copy was added')
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+
 class CopyOfBookUpdateView(PermissionRequiredMixin, UpdateView):
     """This view allows the librarian to update a copy of a particular book already added in the library"""
     model = BookInstance
@@ -482,6 +657,18 @@ class CopyOfBookUpdateView(PermissionRequiredMixin, UpdateView):
     form_class = LibrarianUpdateBookCopyModelForm
     template_name = 'catalog/librarian_update_copy_of_book.html'
 
+    def form_valid(self, form):
+        # e.g. a copy lost on loan and sent for maintenance no longer counts against its borrower's limit.
+        # The copy is only updated if it still has the status the form was loaded with, so two librarians
+        # saving the same copy at once can't both move its borrower's counters.
+        with transaction.atomic():
+            if not BookInstance.objects.filter(pk=self.object.pk, status=form.initial.get('status')).update(
+                    imprint=self.object.imprint, status=self.object.status):
+                form.add_error(None, 'The status of this copy has just been changed, reload it and try again')
+                return self.form_invalid(form)
+            LoanCounter.objects.move(self.object.borrower_id, form.initial.get('status'), self.object.status)
+        return HttpResponseRedirect(self.get_success_url())
+
 
 @permission_required('catalog.can_renew')
 def librarian_approve_borrow_request(request, pk):
@@ -490,9 +677,17 @@ def librarian_approve_borrow_request(request, pk):
     if request.method == 'POST':
         form = LibrarianApproveBookCopyBorrowModelForm(request.POST)
         if form.is_valid():
-            book_instance.status = form.cleaned_data['status']
-            book_instance.save()
-            return render(request, 'catalog/librarian_book_copy_borrow_approval_page.html')
+            # Only a pending borrow request can be approved, and only once: the status is changed by a
+            # conditional UPDATE, a second (double submitted or concurrent) approval updates nothing.
+            # The request was already counted against the member's limit and has its due date.
+            with transaction.atomic():
+                if not BookInstance.objects.requested().filter(pk=pk).update(status=form.cleaned_data['status']):
+                    form.add_error(None, 'This copy is not waiting for a borrow approval')
+                else:
+                    book_instance.refresh_from_db()
+                    LoanCounter.objects.move(book_instance.borrower_id, 'p', book_instance.status)
+                    LoanEvent.objects.record(book_instance, LoanEvent.LENT)
+                    return render(request, 'catalog/librarian_book_copy_borrow_approval_page.html')
     else:
         form = LibrarianApproveBookCopyBorrowModelForm(initial={'status': 'a'})
 
@@ -525,20 +720,58 @@ class CopyOfBookAvailableView(LoginRequiredMixin, generic.ListView):
     template_name = 'catalog/user_book_copies_available.html'
 
     def get_queryset(self):
-        return BookInstance.objects.filter(status__exact='a').filter(due_back__isnull=True)
+        return BookInstance.objects.available().order_by('book_id', 'id')
 
 
 class LibrarianMarkCopyAsReturnedView(PermissionRequiredMixin, UpdateView):
     """This view allows the librarian to mark a book as returned from the user and makes that copy
-    available for borrow again"""
+    available for borrow again, or reserves it for the next member waiting for that book"""
     model = BookInstance
     permission_required = 'catalog.can_mark_returned'
     form_class = LibrarianMarkBookCopyAsReturnedModelForm
     template_name = 'catalog/librarian_book_copy_mark_return.html'
 
+    def form_valid(self, form):
+        # The return and the hand over to the head of the hold queue happen in the same transaction,
+        # so a returned copy is never seen as available while somebody is waiting for it.
+        # The borrower is cleared by the form, the loan event keeps who returned the copy
+        # (form.initial still holds the values the copy had before the form was submitted).
+        # The return is a conditional UPDATE on the borrower and status the form was loaded with, so a
+        # double submitted or concurrent return of the same copy changes nothing the second time.
+        borrower_id = form.initial.get('borrower')
+        with transaction.atomic():
+            if borrower_id is None or not BookInstance.objects.filter(
+                    pk=self.object.pk, borrower_id=borrower_id, status=form.initial.get('status')).update(
+                    borrower=None, due_back=None, status=self.object.status):
+                form.add_error(None, 'This copy is not borrowed by anybody')
+                return self.form_invalid(form)
+            LoanEvent.objects.create(event=LoanEvent.RETURNED, book_instance_id=self.object.pk,
+                                     book_id=self.object.book_id, borrower_id=borrower_id)
+            LoanCounter.objects.move(borrower_id, form.initial.get('status'), self.object.status)
+            Hold.objects.fulfil_next(self.object)
+        return HttpResponseRedirect(self.get_success_url())
+
+
+@permission_required('catalog.can_borrow')
+def user_place_hold(request, pk):
+    """This function enables the user to join the queue for a book whose copies are all out"""
+    book = get_object_or_404(Book, pk=pk)
+    hold = Hold.objects.waiting().filter(book=book, user=request.user).first()
+    if request.method == 'POST' and hold is None:
+        hold = Hold.objects.place(book, request.user)
+
+    context = {
+        'book': book,
+        'hold': hold,
+        'position': Hold.objects.position(hold) if hold is not None else None,
+    }
+
+    return render(request, 'catalog/user_place_hold.html', context)
+
 
 class SearchListView(generic.ListView):
     template_name = 'catalog/book_search.html'
+    public_read = True
     paginate_by = 15
     count = 0
 
@@ -51,6 +51,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Serves the collected static files (precompressed, and cached for good when hashed) before anything else runs
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'catalog.middleware.PublicReadMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -96,6 +99,19 @@ DATABASES = {
 }
 
 
+# Users' permission sets are cached across requests (see catalog/backends.py). Use a cache shared by all
+# the server processes (e.g. memcached or redis) when running more than one, so that a permission change
+# made through one process is seen by the others.
+#
+# The logged in users themselves can be cached as well, for USER_CACHE_TIMEOUT seconds, with the sessions read
+# through the cache (cached_db): opt in with the two commented out lines below. Switching the backend logs every
+# session out once.
+AUTHENTICATION_BACKENDS = ['catalog.backends.CachedPermissionBackend']
+# AUTHENTICATION_BACKENDS = ['catalog.backends.CachedUserBackend']
+# SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+USER_CACHE_TIMEOUT = 300
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -140,6 +156,9 @@ STATICFILES_DIR = (
     os.path.join(BASE_DIR, 'catalog/static')
 )
 
+# collectstatic writes content hashed names plus .gz and .br copies (see catalog/storage.py)
+STATICFILES_STORAGE = 'catalog.storage.HashedStaticFilesStorage'
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = (
     os.path.join(BASE_DIR, 'media')
@@ -165,3 +184,34 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_PORT = 587
 PASSWORD_RESET_TIMEOUT_DAYS = 2
+
+# New book copies get time ordered (UUIDv7 style) ids, set to False to go back to random uuid4 ids
+TIME_ORDERED_COPY_IDS = True
+
+# Most copies a member may have on loan and asked to borrow at the same time
+MAX_LOANS_PER_MEMBER = 5
+
+# Seconds the librarians' due dates calendar caches the counts of the days still to come
+DUE_CALENDAR_CACHE_TIMEOUT = 60
+
+# Seconds a reverse proxy may serve the public catalog pages (see catalog/middleware.py) to anonymous visitors
+PUBLIC_READ_MAX_AGE = 300
+
+# Widths, in pixels, of the resized JPEG and WebP variants made of every book cover (see catalog/covers.py)
+COVER_WIDTHS = (160, 320, 640)
+
+# How uploaded files are sent (see catalog/media.py): 'django' streams them with sendfile() from the WSGI
+# server, 'x-accel-redirect' hands them to nginx from MEDIA_ACCEL_REDIRECT_PREFIX, 'x-sendfile' to Apache
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# The book covers are streamed to disk and checked from their header while they arrive (see catalog/uploads.py),
+# the other uploads keep Django's default handlers
+FILE_UPLOAD_HANDLERS = [
+    'catalog.uploads.CoverUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Largest cover upload in bytes, and most pixels (width x height) a cover may have
+COVER_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+COVER_MAX_PIXELS = 25000000
@@ -13,11 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.views.generic import RedirectView
 from django.conf import settings
-from django.conf.urls.static import static
+
+from catalog import media
 
 urlpatterns = [
                   path('admin/', admin.site.urls),
@@ -26,9 +29,14 @@ urlpatterns = [
 
                   # Django site authentication urls (for login, logout, password management)
                   path('accounts/', include('django.contrib.auth.urls')),
-              ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+              ]
+# The static files are served by WhiteNoise (see MIDDLEWARE) or by the web server in front of Django
+
+# Uploaded files go through catalog.media.serve() in production too, which leaves sending the bytes to the web
+# server (X-Accel-Redirect / X-Sendfile) or to sendfile() depending on settings.MEDIA_SERVE_MODE
+urlpatterns += [
+    re_path(r'^{0}(?P<path>.*)$'.format(re.escape(settings.MEDIA_URL.lstrip('/'))), media.serve),
+]
 
 
 """AUTHENTICATION AND PERMISSIONS(MUST READ)"""